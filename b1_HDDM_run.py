@@ -35,10 +35,11 @@ import warnings
 warnings.filterwarnings('ignore')
 
 # get the model specification here
-from hddm_models import make_model
+from hddm_models import make_model, models, datasets, dataset_path
+import quantile_fit, chain_manifest, chain_checkpoint, convergence, starting_values
 import os, hddm, time, kabuki, glob
 from math import ceil
-import os, fnmatch
+import os, fnmatch, traceback
 import corner
 import pandas as pd
 import scipy as sp
@@ -66,10 +67,50 @@ parser.add_option ( "-i", "--trace_id",
         default = 14,
         type = "int",
         help = "Which trace to run, usually 0-60" )
+parser.add_option ( "-c", "--chains",
+        default = 15,
+        type = "int",
+        help = "Number of chains per model, the last one to finish concatenates them" )
 parser.add_option ( "-s", "--samples",
         default = 50,
         type = "int",
         help = "How many samples to use" )
+parser.add_option ( "--checkpoint",
+        default = 1000,
+        type = "int",
+        help = "Save a checkpoint of the chain every this many samples, or more often with --checkpoint_minutes" )
+parser.add_option ( "--checkpoint_minutes",
+        default = 60,
+        type = "float",
+        help = "Save a checkpoint of the chain about every this many minutes" )
+parser.add_option ( "--jitter",
+        default = 0.05,
+        type = "float",
+        help = "SD of the noise each chain adds to the shared starting values, 0 for none" )
+parser.add_option ( "--adaptive",
+        default = 0,
+        type = "int",
+        help = "1: after a burn-in of samples/2, sample until split-R-hat and ESS of all group nodes meet --rhat and --ess" )
+parser.add_option ( "--rhat",
+        default = 1.02,
+        type = "float",
+        help = "Largest split-R-hat of a converged group node, with --adaptive 1" )
+parser.add_option ( "--ess",
+        default = 400,
+        type = "float",
+        help = "Smallest effective sample size (over all chains) of a group node, with --adaptive 1" )
+parser.add_option ( "--max_samples",
+        default = 50000,
+        type = "int",
+        help = "Most samples per chain, with --adaptive 1" )
+parser.add_option ( "-n", "--n_workers",
+        default = 1,
+        type = "int",
+        help = "Number of worker processes for the quantile fits (-r 3), 0 for one per core" )
+parser.add_option ( "--restarts",
+        default = 1,
+        type = "int",
+        help = "Number of quantile fits per subject from random starting values, the best is kept" )
 
 opts,args       = parser.parse_args()
 model_version   = opts.version
@@ -77,21 +118,70 @@ d               = opts.dataset
 trace_id        = opts.trace_id
 runMe           = opts.run
 n_samples       = opts.samples
+n_chains        = opts.chains
 
-def run_model(m, mypath, model_name, trace_id, n_samples):
+def run_model(m, mypath, model_name, trace_id, n_samples, checkpoint_every=1000, checkpoint_minutes=60,
+    adaptive=None, jitter=0.05, run_id=0):
 
     # ============================================ #
-    # do the actual sampling
+    # do the actual sampling, in segments with a checkpoint after each
     # ============================================ #
 
-    print "finding starting values"
-    m.find_starting_values() # this should help the sampling
+    # adaptive sampling: after a burn-in of n_samples/2, sample until all chains have converged
+    # (see convergence.py) or until adaptive['max_samples']
+    folder = os.path.join(mypath, model_name)
+    total = n_samples if adaptive is None else max(n_samples, adaptive['max_samples'])
+    checkpoint = chain_checkpoint.Checkpoint(folder, trace_id, run_id)
+    progress = checkpoint.load(total)
+    if progress is None:
+        # find starting values once for all chains (this should help the sampling), then disperse the chains
+        print "finding starting values"
+        def find_starting_values():
+            m.find_starting_values()
+            return m.values
+        m.set_values(starting_values.shared(folder, run_id, find_starting_values))
+        if jitter > 0:
+            reverted = starting_values.jitter(m, jitter, seed=trace_id)
+            if reverted:
+                print "kept the starting values of %s" %', '.join(reverted)
+        progress = checkpoint.start(total, burn=n_samples/2, thin=2)
+    else:
+        print "resuming after %d of %d samples" %(progress['done'], progress['n_samples'])
+        checkpoint.restore(m)
 
     print "begin sampling"
-    m.sample(n_samples, burn=n_samples/2, thin=2, db='pickle',
-        dbname=os.path.join(mypath, model_name, 'modelfit-md%d.db'%trace_id))
-    # specify a certain backend? pickle?
+    while True:
+        end = progress['n_samples']
+        if adaptive is not None and convergence.stop_target(folder, run_id) is not None:
+            end = min(end, convergence.stop_target(folder, run_id)) # all chains converged
+        if progress['done'] >= end:
+            break
+        n = chain_checkpoint.next_segment(progress, checkpoint_every, checkpoint_minutes, end)
+        starttime = time.time()
+        # each segment in its own database, during the burn-in only the node values at the end are kept
+        segname = checkpoint.sample(m, progress, n)
+        if segname is not None and adaptive is not None:
+            convergence.share_traces(folder, run_id, trace_id, m.get_group_traces(),
+                len(progress['segments']) - 1)
+        progress['seconds_per_sample'] = (time.time() - starttime) / n
+        checkpoint.save(progress, m)
+
+        if adaptive is not None and progress['segments'] and convergence.stop_target(folder, run_id) is None:
+            result = convergence.check(folder, run_id, adaptive['n_chains'])
+            if result is not None:
+                diagnostics, longest = result
+                print "after %d samples: max split-R-hat %.3f, min ESS %.0f" %(progress['done'],
+                    diagnostics.rhat.max(), diagnostics.ess.min())
+                if convergence.converged(diagnostics, adaptive['rhat'], adaptive['ess']):
+                    # one more round beyond the longest chain, so that all chains end at the same length
+                    target = progress['burn'] + progress['thin'] * longest + checkpoint_every
+                    print "all chains converged, stopping at %d samples" %convergence.stop(folder, run_id,
+                        min(target, progress['n_samples']), diagnostics)
+
+    # the chain is the concatenation of its segments after the burn-in
+    m = checkpoint.chain(progress)
     m.save(os.path.join(mypath, model_name, 'modelfit-md%d.model'%trace_id)) # save the model to disk
+    checkpoint.clear()
 
     # ============================================ #
     # save the output values
@@ -102,10 +192,10 @@ def run_model(m, mypath, model_name, trace_id, n_samples):
     text_file.write("Model {}: {}\n".format(trace_id, m.dic))
     text_file.close()
 
-def concat_models(mypath, model_name):
+def concat_models(mypath, model_name, n_chains=15):
 
     # CHECK IF COMBINED MODEL EXISTS
-    if not (os.path.isfile(os.path.join(mypath, model_name, 'modelfit-md14.model'))) and  (os.path.isfile(os.path.join(mypath, model_name, 'modelfit-combined.model'))):
+    if not (os.path.isfile(os.path.join(mypath, model_name, 'modelfit-md%d.model'%(n_chains-1)))) and  (os.path.isfile(os.path.join(mypath, model_name, 'modelfit-combined.model'))):
         print os.path.join(mypath, model_name, 'modelfit-combined.model')
     else:
         # ============================================ #
@@ -114,7 +204,7 @@ def concat_models(mypath, model_name):
 
         allmodels = []
         print ("appending models for %s" %model_name)
-        for trace_id in range(15): # how many chains were run?
+        for trace_id in range(n_chains): # how many chains were run?
             model_filename        = os.path.join(mypath, model_name, 'modelfit-md%d.model'%trace_id)
 
             modelExists           = os.path.isfile(model_filename)
@@ -151,7 +241,7 @@ def concat_models(mypath, model_name):
         # DELETE FILES to save space
         # ============================================ #
 
-        if len(allmodels) == 15:
+        if len(allmodels) == n_chains:
             print "deleting separate chains"
             for fl in glob.glob(os.path.join(mypath, model_name, 'modelfit-md*.model')):
                     os.remove(fl)
@@ -246,57 +336,6 @@ def cornerplot(mypath, datasetname, modelname):
 # PREPARE THE ACTUAL MODEL FITS
 # ============================================ #
 
-# which model are we running at the moment?
-models = ['stimcoding_nohist', # 0
-    'stimcoding_dc_prevresp', # 1
-    'stimcoding_z_prevresp', # 2
-    'stimcoding_dc_z_prevresp', # 3
-    'stimcoding_dc_prevcorrect', # 4
-    'stimcoding_z_prevcorrect', # 5
-    'stimcoding_dc_z_prevcorrect', # 6
-    'regress_dc_z_prevresp', # 7
-    'regress_dc_z_prevresp_prevrt', # 8
-    'regress_dc_z_prev2resp', # 9
-    'regress_dc_z_prev3resp', # 10
-    'regress_dc_z_prevresp_prevstim_prevrt_prevpupil', # 11
-    'stimcoding_dc_z_prevresp_pharma', #12
-    'stimcoding_dc_prevresp_sessions', # 13
-    'regress_dc_z_visualgamma', #14
-    'regress_dc_z_motorslope', #15
-    'regress_dc_z_motorstart', #16
-    'stimcoding_sz_nohist', # 17
-    'stimcoding_sz_dc_prevresp', # 18
-    'stimcoding_sz_z_prevresp', # 19
-    'stimcoding_sz_dc_z_prevresp', # 20
-    'regress_dc_prevresp', # 21
-    'regress_dc_prevresp_prevrt', #22
-    'regress_nohist', # 23
-    'regress_dc_prevcorrect_prevrt', # 24
-    'regress_dc_prevcorrect', # 25
-    'regress_dc_z_prevresp_visualgamma', # 26
-    'regress_dc_z_prevresp_motorslope', # 27
-    'regress_dc_z_prevresp_motorstart', # 28
-    'stimcoding_dc_z_prevresp_sessions', # 29
-    ]
-
-# datasets = ['RT_RDK', # 0
-#     'MEG', # 1
-#     'NatComm', # 2
-#     'Anke_merged', # 3
-#     'JW_yesno', # 4
-#     'Bharath_fMRI', # 5
-#     'Murphy', # 6
-#     'MEG_MEGdata', # 7
-#     'JW_PNAS', # 8
-#     'JW_fMRI', # 9
-#     'Anke_2afc_sequential', #10
-#     'Anke_MEG', #11
-#     'NatComm_500ms', # 12
-#     'MEG_750ms', # 13
-#     'JW_yesno_2500ms'] # 14
-
-datasets = ['Murphy', 'JW_yesno', 'JW_PNAS', 'NatComm', 'MEG'] #'MEG_MEGsessions', 'Bharath_fMRI', 'Anke_2afc_sequential', 'Anke_MEG']
-
 # recode
 if isinstance(d, int):
     d = range(d,d+1) # makes a list out of an integer
@@ -306,78 +345,82 @@ if isinstance(model_version, int):
 for dx in d:
 
     # find path depending on location and dataset
-    usr = os.environ['USER']
-    if 'aeurai' in usr:
-        mypath = os.path.realpath(os.path.expanduser('/nfs/aeurai/HDDM/%s'%datasets[dx]))
-    elif 'anne' in usr:
-        mypath = os.path.realpath(os.path.expanduser('~/Data/HDDM/%s'%datasets[dx]))
+    mypath = dataset_path(datasets[dx])
 
     for vx in model_version:
-        time.sleep(trace_id) # to avoid different jobs trying to make the same folder
-
-        # make a folder for the outputs, combine name and time
+        # make a folder for the outputs, safe when all chains start at once
         thispath = os.path.join(mypath, models[vx])
-        if not os.path.exists(thispath):
-            os.mkdir(thispath)
+        chain_manifest.makedirs(thispath)
 
         if runMe == 1:
 
             starttime = time.time()
             model_filename = os.path.join(mypath, models[vx], 'modelfit-md%d.model'%trace_id)
 
-            # get the csv file for this dataset
-            filename    = fnmatch.filter(os.listdir(mypath), '*.csv')
-            mydata      = hddm.load_csv(os.path.join(mypath, filename[0]))
-
-            # remove RTs below 250 ms
-            mydata = mydata.loc[mydata.rt > 0.250,:]
-
-            # correct a weirdness in Anke's data
-            if 'transitionprob' in mydata.columns:
-                mydata.transitionprob = mydata.transitionprob * 100;
-                mydata.transitionprob = mydata.transitionprob.round();
-
-            # get the model specification, pass data
-            m = make_model(mypath, mydata, models[vx], trace_id)
-
-            # now sample and save
-            # if os.path.exists(model_filename):
-        #         pass # skip if this model i has been run
-        #     elif os.path.exists(os.path.join(mypath, models[vx], 'modelfit-combined.model')) and not os.path.exists(model_filename):
-        #         pass # skip if this model has been concatenated
-        #     else:
-        #
-            # only run if this hasnt been done, and there is no concatenated master model present
-            run_model(m, mypath, models[vx], trace_id, n_samples)
+            # the first chain writes the manifest, the others check that they belong to the same run
+            # (same -c and -s), see chain_manifest.py
+            run = chain_manifest.create_run(thispath, dataset=datasets[dx], model=models[vx], n_chains=n_chains,
+                n_samples=n_samples)
+            run_id = run['run_id']
+            chain_manifest.record(thispath, run_id, trace_id, 'started', n_samples=n_samples)
+            try:
+                # get the csv file for this dataset
+                filename    = fnmatch.filter(os.listdir(mypath), '*.csv')
+                mydata      = hddm.load_csv(os.path.join(mypath, filename[0]))
+
+                # remove RTs below 250 ms
+                mydata = mydata.loc[mydata.rt > 0.250,:]
+
+                # correct a weirdness in Anke's data
+                if 'transitionprob' in mydata.columns:
+                    mydata.transitionprob = mydata.transitionprob * 100;
+                    mydata.transitionprob = mydata.transitionprob.round();
+
+                # get the model specification, pass data
+                m = make_model(mypath, mydata, models[vx], trace_id)
+
+                # now sample and save
+                # if os.path.exists(model_filename):
+            #         pass # skip if this model i has been run
+            #     elif os.path.exists(os.path.join(mypath, models[vx], 'modelfit-combined.model')) and not os.path.exists(model_filename):
+            #         pass # skip if this model has been concatenated
+            #     else:
+            #
+                # only run if this hasnt been done, and there is no concatenated master model present
+                adaptive = None
+                if opts.adaptive:
+                    adaptive = {'n_chains': n_chains, 'rhat': opts.rhat, 'ess': opts.ess,
+                        'max_samples': opts.max_samples}
+                run_model(m, mypath, models[vx], trace_id, n_samples, opts.checkpoint, opts.checkpoint_minutes,
+                    adaptive, opts.jitter, run_id)
+            except BaseException:
+                # record the failure for b1b_HDDM_runLocal.py, which reruns this chain
+                chain_manifest.record(thispath, run_id, trace_id, 'failed', error=traceback.format_exc())
+                raise
             elapsed = time.time() - starttime
+            chain_manifest.record(thispath, run_id, trace_id, 'done', n_samples=n_samples, elapsed=elapsed)
             print( "Elapsed time for %s, %s, %d samples: %f seconds\n" %(models[vx], datasets[dx], n_samples, elapsed))
 
             # ================================================= #
             # important, concat after running to save disk space
             # ================================================= #
 
-            if trace_id == 14: # and not os.path.exists(os.path.join(mypath, models[vx], 'modelfit-combined.model')):
-                # https://stackoverflow.com/questions/35795452/checking-if-a-list-of-files-exists-before-proceeding
-                filelist = []
-                for t in range(15):
-                    filelist.append(os.path.join(mypath, models[vx], 'modelfit-md%d.model'%t))
-
-                print filelist
-                # wait until all the files are present
-                while True:
-                    if all([os.path.isfile(f) for f in filelist]):
-                        break
-                    else: # wait
-                        print("waiting for files")
-                        # raise ValueError('Not all files present')
-                        time.sleep(60)
-
-                # concatenate the different chains, will save disk space
-                concat_models(mypath, models[vx])
-
-            # make corner plot
-            if trace_id == 14 and os.path.exists(os.path.join(mypath, models[vx], 'modelfit-combined.model')):
-                cornerplot(mypath, datasets[dx], models[vx])
+            # the last chain to finish concatenates, see chain_manifest.py
+            if chain_manifest.all_done(thispath, run_id, n_chains) and \
+                    chain_manifest.claim(chain_manifest.run_dir(thispath, run_id), 'concat'):
+                try:
+                    # concatenate the different chains, will save disk space
+                    concat_models(mypath, models[vx], n_chains)
+                except BaseException:
+                    chain_manifest.release(chain_manifest.run_dir(thispath, run_id), 'concat')
+                    raise
+                chain_manifest.end_run(thispath, run_id, 'concatenated') # a rerun starts a new run
+
+                # make corner plot
+                if os.path.exists(os.path.join(mypath, models[vx], 'modelfit-combined.model')):
+                    cornerplot(mypath, datasets[dx], models[vx])
+            else:
+                print("chains not done: %s" %chain_manifest.not_done(thispath, run_id, n_chains))
 
         elif runMe == 2:
 
@@ -423,15 +466,28 @@ for dx in d:
 
             subj_params = []
             bic         = []
-            for subj_idx, subj_data in mydata.groupby('subj_idx'):
-                m_subj    = make_model(mypath, subj_data, models[vx], trace_id)
-                # m_subj.find_starting_values() # this may help the fits
-                thismodel = m_subj.optimize('gsquare')
-                thismodel.update({'subj_idx':subj_idx}) # keep original subject number
-                subj_params.append(thismodel)
-                bic.append(m_subj.bic_info)
-
-            params = pd.DataFrame(subj_params)
-            params.to_csv(os.path.join(mypath, models[vx], 'Gsquare.csv'))
-            bic = pd.DataFrame(bic)
-            bic.to_csv(os.path.join(mypath, models[vx], 'BIC.csv'))
+            if models[vx] in quantile_fit.model_specs:
+                # all subjects and restarts on a pool of workers, see quantile_fit.py;
+                # the csv files are rewritten as each subject finishes
+                for subj_idx, thismodel, info in quantile_fit.iter_fits(mydata, models[vx],
+                        n_restarts=opts.restarts, n_workers=opts.n_workers or None, seed=trace_id):
+                    thismodel.update({'subj_idx':subj_idx}) # keep original subject number
+                    info.update({'subj_idx':subj_idx})
+                    subj_params.append(thismodel)
+                    bic.append(info)
+                    print("subject %s: Gsquare %f" %(subj_idx, info['gsquare']))
+                    pd.DataFrame(subj_params).sort_values('subj_idx').to_csv(os.path.join(mypath, models[vx], 'Gsquare.csv'))
+                    pd.DataFrame(bic).sort_values('subj_idx').to_csv(os.path.join(mypath, models[vx], 'BIC.csv'))
+            else:
+                for subj_idx, subj_data in mydata.groupby('subj_idx'):
+                    m_subj    = make_model(mypath, subj_data, models[vx], trace_id)
+                    # m_subj.find_starting_values() # this may help the fits
+                    thismodel = m_subj.optimize('gsquare')
+                    thismodel.update({'subj_idx':subj_idx}) # keep original subject number
+                    subj_params.append(thismodel)
+                    bic.append(m_subj.bic_info)
+
+                params = pd.DataFrame(subj_params)
+                params.to_csv(os.path.join(mypath, models[vx], 'Gsquare.csv'))
+                bic = pd.DataFrame(bic)
+                bic.to_csv(os.path.join(mypath, models[vx], 'BIC.csv'))
@@ -0,0 +1,212 @@
+#!/usr/bin/env python
+# encoding: utf-8
+
+"""
+Run the chains of b1_HDDM_run.py on one machine, instead of through a stopos
+pool and PBS jobs (HDDMstoposJob). Every chain is its own
+python b1_HDDM_run.py -r 1 -d <d> -v <v> -i <chain> -s <samples> -c <chains>
+process, for all combinations of the given datasets and models, with as
+many chains running at once as there are cores (minus one for the system).
+The output of each chain goes to a log file, and the modelfit-md*.model
+files of every model are listed at the end.
+
+Each chain records in the manifest of its model (chain_manifest.py) whether
+it finished or failed, and the last one to finish concatenates the chains.
+Chains that failed, or died before recording anything, are reported and
+run again, up to --retries times.
+
+Usage:
+    python b1b_HDDM_runLocal.py -d 0-4 -v 0,3 -s 10000
+    python b1b_HDDM_runLocal.py -p hddmparams     # the lines of a stopos pool file
+
+MIT License
+Copyright (c) Anne Urai, 2018
+anne.urai@gmail.com
+"""
+
+import os, sys, glob, time, subprocess, multiprocessing
+from multiprocessing.pool import ThreadPool
+import chain_manifest
+
+script = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'b1_HDDM_run.py')
+
+def parse_indices(s):
+    # '0-2,5' -> [0, 1, 2, 5]
+    out = []
+    for part in s.split(','):
+        if '-' in part:
+            first, last = part.split('-')
+            out += range(int(first), int(last) + 1)
+        elif part.strip():
+            out.append(int(part))
+    return out
+
+def read_pool(filename):
+    # (dataset, model, chain, samples) per line, as in the stopos pool files (hddmparams)
+    with open(filename) as f:
+        return [tuple(int(x) for x in line.split()) for line in f if line.strip()]
+
+# ============================================ #
+# running chains
+# ============================================ #
+
+def chain_command(d, v, trace_id, n_samples, n_chains):
+    return [sys.executable, script, '-r', '1', '-d', str(d), '-v', str(v), '-i', str(trace_id),
+        '-s', str(n_samples), '-c', str(n_chains)]
+
+def run_chain(args):
+
+    """
+    Run one chain, args = (d, v, trace_id, n_samples, n_chains, logdir).
+    Returns (d, v, trace_id, returncode, elapsed seconds).
+    """
+
+    d, v, trace_id, n_samples, n_chains, logdir = args
+    logname = os.path.join(logdir, 'd%d_v%d_md%d.log'%(d, v, trace_id))
+    starttime = time.time()
+    with open(logname, 'w') as log:
+        returncode = subprocess.call(chain_command(d, v, trace_id, n_samples, n_chains),
+            stdout=log, stderr=subprocess.STDOUT)
+    return d, v, trace_id, returncode, time.time() - starttime
+
+def make_tasks(dsets, versions, n_chains, n_samples):
+    # all chains of a model together, so its results come in early
+    return [(d, v, i, n_samples, n_chains) for d in dsets for v in versions for i in range(n_chains)]
+
+def run_chains(tasks, n_workers=None, logdir='logs'):
+
+    """
+    Run tasks, a list of (d, v, trace_id, n_samples, n_chains), on n_workers
+    chains at once (None for one per core, minus one). The chains are
+    separate processes, so the pool only needs threads to wait for them.
+    Returns a list of (d, v, trace_id, returncode, elapsed).
+    """
+
+    if n_workers is None:
+        n_workers = max(multiprocessing.cpu_count() - 1, 1)
+    chain_manifest.makedirs(logdir)
+    print('running %d chains, %d at a time'%(len(tasks), n_workers))
+
+    pool = ThreadPool(n_workers)
+    results = []
+    try:
+        for d, v, trace_id, returncode, elapsed in pool.imap_unordered(run_chain,
+                [task + (logdir,) for task in tasks]):
+            status = 'done' if returncode == 0 else 'FAILED (exit code %d)'%returncode
+            print('dataset %d, model %d, chain %d: %s after %.0f s'%(d, v, trace_id, status, elapsed))
+            results.append((d, v, trace_id, returncode, elapsed))
+        pool.close()
+    finally:
+        pool.terminate()
+        pool.join()
+    return results
+
+def model_folder(d, v):
+    # output folder of dataset d and model v, as in b1_HDDM_run.py
+    from hddm_models import models, datasets, dataset_path
+    return os.path.join(dataset_path(datasets[d]), models[v])
+
+def current_status(folder):
+    # status of the chains of the latest run of the model in folder
+    run = chain_manifest.current_run(folder)
+    return {} if run is None else chain_manifest.read(folder, run['run_id'])
+
+def unfinished(tasks, results):
+
+    """
+    Tasks whose chain did not finish: its last run failed, or the manifest
+    of the latest run does not say it is done (e.g. a chain that was killed).
+    """
+
+    returncode = dict((r[:3], r[3]) for r in results)
+    status = {}
+    out = []
+    for task in tasks:
+        d, v, trace_id = task[:3]
+        if (d, v) not in status:
+            status[(d, v)] = current_status(model_folder(d, v))
+        if returncode.get((d, v, trace_id)) != 0 or \
+                status[(d, v)].get(trace_id, {}).get('status') != 'done':
+            out.append(task)
+    return out
+
+def collect(d, v):
+
+    """
+    Model files of dataset d and model v: (combined, chains), the path of
+    modelfit-combined.model (or None) and those of the separate chains.
+    """
+
+    folder = model_folder(d, v)
+    combined = os.path.join(folder, 'modelfit-combined.model')
+    return (combined if os.path.isfile(combined) else None,
+        sorted(glob.glob(os.path.join(folder, 'modelfit-md*.model'))))
+
+if __name__ == '__main__':
+
+    from optparse import OptionParser
+    usage = "b1b_HDDM_runLocal.py [options]"
+    parser = OptionParser ( usage)
+    parser.add_option ( "-d", "--dataset",
+            default = '0-4',
+            type = "string",
+            help = "Which datasets, e.g. 0-4 or 1,3" )
+    parser.add_option ( "-v", "--version",
+            default = '0',
+            type = "string",
+            help = "Which models, e.g. 0-6 or 1,3" )
+    parser.add_option ( "-c", "--chains",
+            default = 15,
+            type = "int",
+            help = "Number of chains per model" )
+    parser.add_option ( "-s", "--samples",
+            default = 10000,
+            type = "int",
+            help = "How many samples to use per chain" )
+    parser.add_option ( "-p", "--pool",
+            default = None,
+            type = "string",
+            help = "Stopos pool file with lines 'dataset model chain samples', replaces -d, -v and -s" )
+    parser.add_option ( "-n", "--n_workers",
+            default = 0,
+            type = "int",
+            help = "Number of chains at once, 0 for one per core minus one" )
+    parser.add_option ( "-r", "--retries",
+            default = 2,
+            type = "int",
+            help = "How often to rerun chains that failed" )
+    parser.add_option ( "-l", "--logs",
+            default = 'logs',
+            type = "string",
+            help = "Folder for the output of each chain" )
+    opts, args = parser.parse_args()
+
+    if opts.pool is not None:
+        tasks = [task + (opts.chains,) for task in read_pool(opts.pool)]
+    else:
+        tasks = make_tasks(parse_indices(opts.dataset), parse_indices(opts.version), opts.chains, opts.samples)
+
+    # running all chains of a model ends its earlier run, so that the chains start a new one
+    for d, v, n_chains in set((t[0], t[1], t[4]) for t in tasks):
+        run = chain_manifest.current_run(model_folder(d, v))
+        if run is not None and set(t[2] for t in tasks if t[:2] == (d, v)) >= set(range(n_chains)):
+            chain_manifest.end_run(model_folder(d, v), run['run_id'], 'rerun')
+
+    results = run_chains(tasks, opts.n_workers or None, opts.logs)
+    for attempt in range(opts.retries):
+        failed = unfinished(tasks, results)
+        if not failed:
+            break
+        print('rerunning %d chains: %s'%(len(failed), ', '.join('dataset %d model %d chain %d'%t[:3] for t in failed)))
+        results += run_chains(failed, opts.n_workers or None, opts.logs)
+
+    # ============================================ #
+    # collect the outputs
+    # ============================================ #
+
+    remaining = unfinished(tasks, results)
+    for d, v in sorted(set((r[0], r[1]) for r in results)):
+        failed = [t[2] for t in remaining if t[:2] == (d, v)]
+        combined, chains = collect(d, v)
+        print('dataset %d, model %d: %s, %d chain files%s'%(d, v, combined or 'not concatenated', len(chains),
+            ', failed chains %s'%failed if failed else ''))
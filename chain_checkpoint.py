@@ -0,0 +1,178 @@
+#!/usr/bin/env python
+# encoding: utf-8
+
+"""
+Checkpoints of a chain of b1_HDDM_run.py, so that a chain that is killed
+(e.g. at the walltime of its job) continues where it was when it is started
+again with the same dataset, model and trace_id.
+
+run_model samples in segments (Checkpoint.sample). Every segment gets its
+own MCMC object and pickle database: m.sample only builds m.mc on its first
+call, so later calls would keep adding to the first database, and every
+segment would be saved with the trace of all segments before it. After
+every segment, the node values, the state of the random number generator
+and progress.json (how many samples are done, the run of the chain, see
+chain_manifest.py, and the model file of every segment after the burn-in)
+are written to <model folder>/checkpoints/md<trace_id>/, each through a
+temporary file, so a checkpoint is either complete or the previous one. At
+the end, the traces of all segments, deviance included, are concatenated
+(Checkpoint.chain) into modelfit-md<trace_id>.db, the database of
+modelfit-md<trace_id>.model, as for a chain sampled at once, so its DIC
+covers the whole chain. Then the checkpoint and the databases of the
+segments are removed. A segment lasts every samples, or less when the samples of the
+previous segment took long enough that the segment would take more than
+minutes. chain_checkpoint_check.py tests this with a small HDDM model.
+
+MIT License
+Copyright (c) Anne Urai, 2018
+anne.urai@gmail.com
+"""
+
+import os, glob, json, pickle, shutil
+import numpy as np
+from chain_manifest import makedirs
+
+def _write(filename, write, mode='w'):
+    # write through a temporary file, then rename over the old one
+    tmpname = '%s.%d.tmp'%(filename, os.getpid())
+    with open(tmpname, mode) as f:
+        write(f)
+    os.rename(tmpname, filename)
+
+def next_segment(progress, every=1000, minutes=60, end=None):
+
+    """
+    Number of samples of the next segment: at most every, fewer if the
+    previous speed says they would take longer than minutes, and never
+    past the end of the burn-in or of the chain (end, or n_samples). A
+    multiple of thin.
+    """
+
+    done, thin = progress['done'], progress['thin']
+    if end is None:
+        end = progress['n_samples']
+    if done < progress['burn']:
+        end = progress['burn']
+    n = every
+    if progress.get('seconds_per_sample'):
+        n = min(n, int(minutes * 60 / progress['seconds_per_sample']))
+    n = max(thin, n - n % thin)
+    return min(n, end - done)
+
+class Checkpoint(object):
+
+    """
+    Checkpoints of chain trace_id of the model in folder, in run run_id.
+    """
+
+    def __init__(self, folder, trace_id, run_id=0):
+        self.folder = folder
+        self.trace_id = trace_id
+        self.run_id = run_id
+        self.path = os.path.join(folder, 'checkpoints', 'md%d'%trace_id)
+
+    def segment_names(self, k):
+        # (db, model) file names of segment k; modelfit-md<trace_id>.db is the database of the whole chain
+        dbname = 'modelfit-md%d-seg%d.db'%(self.trace_id, k)
+        return os.path.join(self.folder, dbname), os.path.join(self.path, 'segment%d.model'%k)
+
+    def new_segment(self, k):
+        # (db, model) file names of segment k, without leftovers of a run that was killed during it
+        names = self.segment_names(k)
+        for filename in names:
+            if os.path.exists(filename):
+                os.remove(filename)
+        return names
+
+    def start(self, n_samples, burn, thin):
+        # a new chain, nothing sampled yet
+        makedirs(self.path)
+        return {'n_samples': n_samples, 'burn': burn, 'thin': thin, 'done': 0, 'segments': [],
+            'run_id': self.run_id}
+
+    def load(self, n_samples):
+
+        """
+        Progress of the last checkpoint, or None if there is none for a chain
+        of n_samples in this run (a checkpoint of another run, or of another
+        run length, is ignored).
+        """
+
+        filename = os.path.join(self.path, 'progress.json')
+        if not os.path.isfile(filename):
+            return None
+        with open(filename) as f:
+            progress = json.load(f)
+        if progress.get('run_id') != self.run_id:
+            print('ignoring the checkpoint in %s, which is of run %s'%(self.path, progress.get('run_id')))
+            return None
+        if progress['n_samples'] != n_samples:
+            print('ignoring the checkpoint in %s, which is for %d samples'%(self.path, progress['n_samples']))
+            return None
+        return progress
+
+    def sample(self, m, progress, n):
+
+        """
+        Sample the next n samples of m (a kabuki model) into a new MCMC
+        object and database, and add them to progress. Samples of the
+        burn-in are not kept; they go to the database of the first segment,
+        which the first segment after the burn-in replaces. Returns the model
+        file of the segment, None during the burn-in.
+        """
+
+        burn_in = progress['done'] < progress['burn']
+        dbname, segname = self.new_segment(len(progress['segments']))
+        m.mcmc(db='pickle', dbname=dbname)
+        m.mc.sample(n, burn=n if burn_in else 0, thin=progress['thin'])
+        m.sampled = True
+        progress['done'] += n
+        if burn_in:
+            return None
+        m.save(segname)
+        progress['segments'].append(segname)
+        return segname
+
+    def chain(self, progress):
+
+        """
+        The chain after the burn-in: the traces of all segments (pickle
+        databases of {trace name: {chain: values}}), deviance included, are
+        concatenated into modelfit-md<trace_id>.db, and the model of the last
+        segment is pointed at it, so that it is saved with that database.
+        """
+
+        import hddm
+        traces, state = {}, None
+        for k in range(len(progress['segments'])):
+            with open(self.segment_names(k)[0], 'rb') as f:
+                segment = pickle.load(f)
+            state = segment.pop('_state_', state)
+            for name, chains in segment.items():
+                traces.setdefault(name, []).extend(chains[c] for c in sorted(chains))
+        container = dict((name, {0: np.concatenate(values)}) for name, values in traces.items())
+        container['_state_'] = state
+        dbname = os.path.join(self.folder, 'modelfit-md%d.db'%self.trace_id)
+        _write(dbname, lambda f: pickle.dump(container, f, protocol=2), 'wb')
+        m = hddm.load(progress['segments'][-1])
+        m.load_db(dbname, db='pickle')
+        return m
+
+    def save(self, progress, m):
+        # node values and random state first, progress.json last: it says which segments are complete
+        state = {'values': m.values, 'random_state': np.random.get_state()}
+        _write(os.path.join(self.path, 'state.pickle'), lambda f: pickle.dump(state, f, protocol=2), 'wb')
+        _write(os.path.join(self.path, 'progress.json'), lambda f: json.dump(progress, f, indent=1))
+
+    def restore(self, m):
+        # continue the chain from the values and random state of the last checkpoint
+        with open(os.path.join(self.path, 'state.pickle'), 'rb') as f:
+            state = pickle.load(f)
+        m.set_values(state['values'])
+        np.random.set_state(state['random_state'])
+
+    def clear(self):
+        # once the chain is saved as a whole, the checkpoint and the segments are not needed
+        shutil.rmtree(self.path, ignore_errors=True)
+        for dbname in glob.glob(os.path.join(self.folder, 'modelfit-md%d-seg*.db'%self.trace_id)):
+            os.remove(dbname)
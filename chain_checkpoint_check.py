@@ -0,0 +1,79 @@
+#!/usr/bin/env python
+# encoding: utf-8
+
+"""
+Check of the checkpoints of chain_checkpoint.py with a small HDDM model, as
+run_model in b1_HDDM_run.py uses them: a chain is sampled in segments,
+killed after a checkpoint halfway (its model is thrown away) and resumed
+from the checkpoint in a new model. Every segment must only hold its own
+draws, and the concatenated chain exactly (n_samples - burn) / thin, also
+after it is saved and loaded again, deviance (and so the DIC) included.
+Needs hddm (python 2.7). Run as: python chain_checkpoint_check.py
+
+MIT License
+Copyright (c) Anne Urai, 2018
+anne.urai@gmail.com
+"""
+
+import os, shutil, tempfile
+import numpy as np
+import hddm
+import chain_checkpoint
+
+def n_draws(m, node='a'):
+    return len(m.nodes_db.node[node].trace())
+
+def sample_segments(m, checkpoint, progress, every, n_segments=None):
+    # as the loop of run_model, stopping after n_segments (None for the whole chain)
+    while progress['done'] < progress['n_samples'] and n_segments != 0:
+        n = chain_checkpoint.next_segment(progress, every)
+        segname = checkpoint.sample(m, progress, n)
+        if segname is not None:
+            assert n_draws(m) == n // progress['thin'], '%s holds the draws of earlier segments'%segname
+        checkpoint.save(progress, m)
+        if n_segments is not None:
+            n_segments -= 1
+    return progress
+
+if __name__ == '__main__':
+
+    np.random.seed(2018)
+    data, params = hddm.generate.gen_rand_data({'v': 1, 'a': 2, 't': 0.3}, size=100, subjs=3)
+    n_samples, burn, thin, every = 600, 200, 2, 100
+    folder = tempfile.mkdtemp()
+    try:
+        # two segments of burn-in and two after it, then the chain is killed
+        m = hddm.HDDM(data)
+        m.find_starting_values()
+        checkpoint = chain_checkpoint.Checkpoint(folder, 0)
+        progress = checkpoint.start(n_samples, burn, thin)
+        sample_segments(m, checkpoint, progress, every, n_segments=4)
+        del m
+
+        # the restarted chain continues from the checkpoint
+        m = hddm.HDDM(data)
+        checkpoint = chain_checkpoint.Checkpoint(folder, 0)
+        progress = checkpoint.load(n_samples)
+        assert progress is not None and progress['done'] == 4 * every
+        checkpoint.restore(m)
+        sample_segments(m, checkpoint, progress, every)
+
+        chain = checkpoint.chain(progress)
+        print('%d segments after the burn-in, %d draws (expected %d)'%(len(progress['segments']), n_draws(chain),
+            (n_samples - burn) // thin))
+        assert n_draws(chain) == (n_samples - burn) // thin
+
+        # saved as run_model does, the model loads the traces of the whole chain
+        model_filename = os.path.join(folder, 'modelfit-md0.model')
+        chain.save(model_filename)
+        checkpoint.clear()
+        m = hddm.load(model_filename)
+        deviance = m.mc.db.trace('deviance')()
+        print('reloaded: %d draws, %d deviance samples, DIC %.1f'%(n_draws(m), len(deviance), m.dic))
+        assert n_draws(m) == (n_samples - burn) // thin
+        assert len(deviance) == (n_samples - burn) // thin
+
+        # a chain of another run does not resume this checkpoint
+        assert chain_checkpoint.Checkpoint(folder, 0, run_id=1).load(n_samples) is None
+    finally:
+        shutil.rmtree(folder)
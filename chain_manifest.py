@@ -0,0 +1,219 @@
+#!/usr/bin/env python
+# encoding: utf-8
+
+"""
+Completion tracking for the chains of a model in b1_HDDM_run.py.
+
+All chains of a model that are run together form a run, with its own
+folder <model folder>/chains/run<run_id>/. The run manifest (run.json, the
+settings all chains share) is set up by whichever chain gets there first:
+makedirs accepts folders that another process has just created, and the
+manifest is written to a temporary file and then hard linked into place,
+which fails for all but the first chain. So chains can start at the same
+time, on any number of nodes, without waiting for each other. A chain
+joins the latest run, until that run has ended (end_run: its chains were
+concatenated, or b1b_HDDM_runLocal.py starts all chains again); the first
+chain after that starts the next run. So the status files and locks of an
+earlier run are never mixed up with those of a new one, also when chains
+are rerun through stopos. A chain started with other settings than the run
+it would join (e.g. another number of chains) fails instead.
+
+Each chain writes its status ('started', 'done' or 'failed') to its own file
+in the folder of its run, atomically (a temporary file renamed over the old
+one), so a status file is never read half written and chains never write
+to the same file. A chain that finishes checks whether all chains are done,
+and if so claims the concatenation with a lock file created with O_EXCL:
+only one process can create it, so the chains are concatenated exactly
+once, as soon as the last one finishes, and no process has to wait for the
+others. A lock file holds the host, pid and time of the process that
+claimed it, so that stale can tell when that process was killed.
+
+MIT License
+Copyright (c) Anne Urai, 2018
+anne.urai@gmail.com
+"""
+
+import os, json, glob, errno, socket, time
+
+def status_dir(folder):
+    return os.path.join(folder, 'chains')
+
+def run_dir(folder, run_id):
+    return os.path.join(status_dir(folder), 'run%d'%run_id)
+
+def status_file(folder, run_id, trace_id):
+    return os.path.join(run_dir(folder, run_id), 'md%d.json'%trace_id)
+
+def makedirs(path):
+    # several chains create the same folder at once
+    try:
+        os.makedirs(path)
+    except OSError as e:
+        if e.errno != errno.EEXIST:
+            raise
+
+# ============================================ #
+# run manifest
+# ============================================ #
+
+def create_once(path, name, **info):
+
+    """
+    Write info to <name>.json in folder path, unless another process
+    already did. Returns the info that is in place, which is this info for
+    the first process only.
+    """
+
+    makedirs(path)
+    filename = os.path.join(path, '%s.json'%name)
+    tmpname = '%s.%s.%d.tmp'%(filename, socket.gethostname(), os.getpid())
+    with open(tmpname, 'w') as f:
+        json.dump(info, f, indent=1)
+    try:
+        os.link(tmpname, filename) # atomic, and fails if the file exists
+    except OSError as e:
+        if e.errno != errno.EEXIST:
+            raise
+        with open(filename) as f:
+            info = json.load(f)
+    finally:
+        os.remove(tmpname)
+    return info
+
+def current_run(folder):
+    # manifest of the latest run, with its run_id, None before the first run
+    run_ids = [int(os.path.basename(os.path.dirname(f))[3:])
+        for f in glob.glob(os.path.join(status_dir(folder), 'run*', 'run.json'))]
+    if not run_ids:
+        return None
+    with open(os.path.join(run_dir(folder, max(run_ids)), 'run.json')) as f:
+        return json.load(f)
+
+def ended(folder, run_id):
+    return os.path.isfile(os.path.join(run_dir(folder, run_id), 'end.json'))
+
+def end_run(folder, run_id, reason):
+    # the next chain to start begins a new run
+    create_once(run_dir(folder, run_id), 'end', reason=reason, time=time.time())
+
+def create_run(folder, **info):
+
+    """
+    Manifest of the run a chain that starts now belongs to, with the
+    settings all its chains share (e.g. n_chains): the latest run, or a new
+    one with info if that has ended (or there is none). Raises ValueError
+    when the latest run has not ended and was started with other settings
+    than info, instead of mixing chains of both.
+    """
+
+    run = current_run(folder)
+    if run is None or ended(folder, run['run_id']):
+        run_id = 0 if run is None else run['run_id'] + 1
+        run = create_once(run_dir(folder, run_id), 'run', run_id=run_id, **info)
+    changed = sorted(k for k in info if run.get(k) != info[k])
+    if changed:
+        raise ValueError('run %d in %s was started with %s, not %s; end it with chain_manifest.end_run (or '
+            'rerun all its chains with b1b_HDDM_runLocal.py) to start a new run' %(run['run_id'],
+            status_dir(folder), ', '.join('%s=%s'%(k, run.get(k)) for k in changed),
+            ', '.join('%s=%s'%(k, info[k]) for k in changed)))
+    return run
+
+# ============================================ #
+# chain status
+# ============================================ #
+
+def record(folder, run_id, trace_id, status, **info):
+
+    """
+    Write the status of chain trace_id of run run_id, with any extra
+    information (e.g. the error message of a failed chain).
+    """
+
+    makedirs(run_dir(folder, run_id))
+    info.update({'trace_id': trace_id, 'status': status, 'time': time.time(),
+        'host': socket.gethostname(), 'pid': os.getpid()})
+    filename = status_file(folder, run_id, trace_id)
+    tmpname = '%s.%d.tmp'%(filename, os.getpid())
+    with open(tmpname, 'w') as f:
+        json.dump(info, f, indent=1)
+    os.rename(tmpname, filename)
+
+def read(folder, run_id):
+    # status of every chain of the run that has written one, by trace_id
+    out = {}
+    for filename in glob.glob(os.path.join(run_dir(folder, run_id), 'md*.json')):
+        with open(filename) as f:
+            info = json.load(f)
+        out[info['trace_id']] = info
+    return out
+
+def all_done(folder, run_id, n_chains):
+    status = read(folder, run_id)
+    return all(status.get(i, {}).get('status') == 'done' for i in range(n_chains))
+
+def not_done(folder, run_id, n_chains):
+    # chains that failed, have not finished or never started
+    status = read(folder, run_id)
+    return [i for i in range(n_chains) if status.get(i, {}).get('status') != 'done']
+
+# ============================================ #
+# run once
+# ============================================ #
+
+def claim(path, name='concat'):
+
+    """
+    True for the one process that creates the lock file <name>.lock in
+    folder path (e.g. run_dir), False for all others (and for later calls,
+    until release).
+    """
+
+    makedirs(path)
+    try:
+        fd = os.open(os.path.join(path, '%s.lock'%name), os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+    except OSError as e:
+        if e.errno == errno.EEXIST:
+            return False
+        raise
+    os.write(fd, ('%s %d %f\n'%(socket.gethostname(), os.getpid(), time.time())).encode())
+    os.close(fd)
+    return True
+
+def _alive(pid):
+    # whether process pid exists on this host
+    try:
+        os.kill(pid, 0)
+    except OSError as e:
+        return e.errno == errno.EPERM
+    return True
+
+def stale(path, name, max_age):
+
+    """
+    Whether the lock file <name>.lock in folder path was left behind by a
+    process that was killed: the process that claimed it ran on this host
+    and is gone, or the lock is older than max_age seconds (for a process
+    on another host).
+    """
+
+    filename = os.path.join(path, '%s.lock'%name)
+    try:
+        age = time.time() - os.path.getmtime(filename)
+        with open(filename) as f:
+            holder = f.read().split()
+    except (IOError, OSError) as e:
+        if e.errno == errno.ENOENT:
+            return False
+        raise
+    if age > max_age:
+        return True
+    # a lock that is still empty has just been created
+    return len(holder) >= 2 and holder[0] == socket.gethostname() and not _alive(int(holder[1]))
+
+def release(path, name='concat'):
+    # after a failure, so that another process can try again
+    try:
+        os.remove(os.path.join(path, '%s.lock'%name))
+    except OSError as e:
+        if e.errno != errno.ENOENT:
+            raise
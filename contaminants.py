@@ -0,0 +1,83 @@
+#!/usr/bin/env python
+# encoding: utf-8
+
+"""
+Contaminant (outlier) mixtures of predicted RT distributions, shared by the
+analytic fits of pso_ddm.py and the quantile fits of quantile_fit.py.
+
+All functions work in place on batched arrays (rows x time points, e.g. one
+row per particle, condition or subject) and only allocate per-row scalars,
+so they can be applied to every evaluation of an objective without copying
+the densities. Contaminant rates are a scalar or one value per row, which
+gives per-subject rates when the rows of a batch belong to different
+subjects.
+
+Two mixtures are used in this repository:
+add_contaminants = uniform between the fastest and slowest observed RT,
+                   renormalized to the original mass (add_contaminants.m)
+outlier_cdf, mix = uniform density w_outlier per response from RT 0 to
+                   0.5/w_outlier, mixed with weight p_outlier into the
+                   CDFs of quantile_fit.py (HDDM, as p_outlier in
+                   hddm_models.py)
+
+MIT License
+Copyright (c) Anne Urai, 2018
+anne.urai@gmail.com
+"""
+
+import numpy as np
+
+w_outlier = 0.1 # density of the outlier distribution per response, as in HDDM
+
+def _per_row(x, a):
+    # scalar or one value per row of a, shaped to broadcast over its other axes
+    return np.broadcast_to(np.asarray(x, dtype=float), a.shape[:1]).reshape((-1,) + (1,) * (a.ndim - 1))
+
+# ============================================ #
+# add_contaminants.m
+# ============================================ #
+
+def add_contaminants(gC, gE, ts, min_rt, max_rt, C):
+
+    """
+    Add a uniform distribution of contaminants between min_rt and max_rt to
+    the densities of each row of gC and gE (rows x ts, ts sorted) and
+    renormalize each row to its original mass, as in add_contaminants.m.
+    C is the contaminant rate, a scalar or one per row. Changes gC and gE
+    in place and returns them.
+    """
+
+    start, stop = np.searchsorted(ts, min_rt, side='left'), np.searchsorted(ts, max_rt, side='right')
+    if stop <= start:
+        return gC, gE
+    added = _per_row(C, gC) / (2.0 * (stop - start))
+    for g in [gC, gE]:
+        mass = g.sum(axis=1, keepdims=True)
+        g[:, start:stop] += added
+        # the window adds C/2 to the mass of every row
+        with np.errstate(invalid='ignore', divide='ignore'):
+            scale = np.where(mass > 0, mass / (mass + added * (stop - start)), 1)
+        g *= scale
+    return gC, gE
+
+# ============================================ #
+# HDDM outliers
+# ============================================ #
+
+def outlier_cdf(rt, w=w_outlier):
+    # defective CDF of the outlier distribution of one response at RTs rt (s)
+    return w * np.clip(rt, 0, 0.5 / w)
+
+def mix(values, outlier, p_outlier):
+
+    """
+    (1 - p_outlier) * values + p_outlier * outlier in place, for arrays of
+    the same shape (rows x ...) and p_outlier a scalar or one per row. Use
+    with outlier_cdf, computed once for fixed time points, to mix CDFs or
+    the probabilities of RT bins. Returns values.
+    """
+
+    values -= outlier
+    values *= 1 - _per_row(p_outlier, values)
+    values += outlier
+    return values
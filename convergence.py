@@ -0,0 +1,181 @@
+#!/usr/bin/env python
+# encoding: utf-8
+
+"""
+Convergence diagnostics across chains, and the adaptive sampling of
+b1_HDDM_run.py (--adaptive 1): chains sample in rounds, and after every
+round each chain shares its group traces so far. A chain that finds that
+all chains have shared a round computes split-R-hat and the effective
+sample size of every group node over all chains, truncated to the shortest
+one, and once both meet their targets, it writes the stop marker with the
+number of samples at which all chains stop: one round beyond the longest
+chain, so that every chain can reach it and all chains have the same
+length when they are concatenated. Without convergence, chains stop at
+their maximum number of samples. The shared traces and the stop marker are
+kept in the folder of the run (chain_manifest.run_dir), so a new run never
+stops at the marker of an earlier one.
+
+split_rhat and ess follow Gelman et al. (2013) Bayesian Data Analysis, 3rd
+ed., ch. 11.4-11.5: chains are split in halves, and the autocorrelations
+are summed in pairs for as long as the pairs are positive (Geyer's initial
+monotone sequence), as in Stan.
+
+MIT License
+Copyright (c) Anne Urai, 2018
+anne.urai@gmail.com
+"""
+
+import os, json
+import numpy as np
+import pandas as pd
+import chain_manifest
+
+# ============================================ #
+# diagnostics
+# ============================================ #
+
+def split_chains(x):
+    # chains x draws (x ...) -> 2 chains x draws/2 (x ...), dropping the middle draw of odd lengths
+    half = x.shape[1] // 2
+    return np.concatenate([x[:, :half], x[:, x.shape[1] - half:]], axis=0)
+
+def split_rhat(x):
+
+    """
+    Potential scale reduction factor of x (chains x draws, or chains x draws
+    x parameters) from the split chains.
+    """
+
+    x = split_chains(np.asarray(x, dtype=float))
+    n = x.shape[1]
+    W = x.var(axis=1, ddof=1).mean(axis=0)
+    B = n * x.mean(axis=1).var(axis=0, ddof=1)
+    var_plus = (n - 1.) / n * W + B / n
+    return np.sqrt(var_plus / W)
+
+def autocovariance(x):
+    # of each chain along axis 1 (biased, divided by the number of draws), via the FFT
+    n = x.shape[1]
+    x = x - x.mean(axis=1, keepdims=True)
+    nfft = 2 ** int(np.ceil(np.log2(2 * n)))
+    f = np.fft.rfft(x, nfft, axis=1)
+    return np.fft.irfft(f * np.conj(f), nfft, axis=1)[:, :n] / n
+
+def ess(x):
+
+    """
+    Effective sample size of x (chains x draws, or chains x draws x
+    parameters) over all chains, from the split chains.
+    """
+
+    x = split_chains(np.asarray(x, dtype=float))
+    shape = x.shape[2:]
+    x = x.reshape(x.shape[:2] + (-1,))
+    m, n = x.shape[:2]
+    acov = autocovariance(x)
+    mean_var = (acov[:, 0] * n / (n - 1.)).mean(axis=0)
+    var_plus = mean_var * (n - 1.) / n + x.mean(axis=1).var(axis=0, ddof=1)
+    rho = 1 - (mean_var - acov.mean(axis=0)) / var_plus # lags x parameters
+    rho[0] = 1
+
+    out = np.zeros(rho.shape[1])
+    for p in range(rho.shape[1]):
+        pairs = rho[:n - n % 2, p].reshape(-1, 2).sum(axis=1)
+        negative = np.flatnonzero(pairs <= 0)
+        pairs = pairs[:negative[0] if negative.size else pairs.size]
+        pairs = np.minimum.accumulate(pairs) # monotone
+        tau = -1 + 2 * pairs.sum()
+        out[p] = m * n / max(tau, 1. / np.log10(m * n)) # at most m*n*log10(m*n), as in Stan
+    return out.reshape(shape)
+
+def diagnose(traces):
+
+    """
+    split-R-hat and ESS per column of traces, a list of one DataFrame per
+    chain (draws x nodes, e.g. m.get_group_traces()), truncated to the
+    shortest chain. Returns a DataFrame with rhat and ess per node.
+    """
+
+    n = min(len(t) for t in traces)
+    nodes = list(traces[0].columns)
+    x = np.stack([t[nodes].values[:n] for t in traces])
+    return pd.DataFrame({'rhat': split_rhat(x), 'ess': ess(x)}, index=nodes)
+
+# ============================================ #
+# adaptive sampling across chains
+# ============================================ #
+
+def trace_file(folder, run_id, trace_id):
+    return os.path.join(chain_manifest.run_dir(folder, run_id), 'traces-md%d.csv'%trace_id)
+
+def share_traces(folder, run_id, trace_id, traces, segment):
+
+    """
+    Add the group traces of one segment (round) to those shared by this
+    chain, atomically. A segment that was shared before, by a chain that was
+    restarted from an earlier checkpoint, is replaced.
+    """
+
+    chain_manifest.makedirs(chain_manifest.run_dir(folder, run_id))
+    filename = trace_file(folder, run_id, trace_id)
+    traces = traces.assign(segment=segment)
+    if os.path.isfile(filename):
+        shared = pd.read_csv(filename)
+        traces = pd.concat([shared[shared.segment < segment], traces], ignore_index=True)
+    tmpname = '%s.%d.tmp'%(filename, os.getpid())
+    traces.to_csv(tmpname, index=False)
+    os.rename(tmpname, filename)
+
+def check(folder, run_id, n_chains, min_draws=20):
+
+    """
+    Diagnostics over the shared traces, once all n_chains have shared at
+    least min_draws. Returns (diagnostics, draws of the longest chain), or
+    None while chains are missing.
+    """
+
+    filenames = [trace_file(folder, run_id, i) for i in range(n_chains)]
+    if not all(os.path.isfile(f) for f in filenames):
+        return None
+    traces = [pd.read_csv(f).drop('segment', axis=1) for f in filenames]
+    if min(len(t) for t in traces) < min_draws:
+        return None
+    return diagnose(traces), max(len(t) for t in traces)
+
+def converged(diagnostics, rhat=1.02, min_ess=400):
+    # every node has split-R-hat below rhat and an ESS of at least min_ess
+    return bool((diagnostics.rhat < rhat).all() and (diagnostics.ess >= min_ess).all())
+
+def stop(folder, run_id, n_samples, diagnostics):
+
+    """
+    Write the stop marker, unless another chain already did, telling all
+    chains to stop at n_samples. Returns the number of samples of the
+    marker that is in place.
+    """
+
+    info = chain_manifest.create_once(chain_manifest.run_dir(folder, run_id), 'stop', n_samples=int(n_samples),
+        rhat=diagnostics.rhat.to_dict(), ess=diagnostics.ess.to_dict())
+    return info['n_samples']
+
+def stop_target(folder, run_id):
+    # number of samples at which all chains of the run stop, None before convergence
+    filename = os.path.join(chain_manifest.run_dir(folder, run_id), 'stop.json')
+    if not os.path.isfile(filename):
+        return None
+    with open(filename) as f:
+        return json.load(f)['n_samples']
+
+if __name__ == '__main__':
+
+    # AR(1) chains with a known ESS of n*(1-phi)/(1+phi) per chain
+    rng = np.random.default_rng(1)
+    m, n, phi = 4, 4000, 0.9
+    x = np.zeros((m, n, 2))
+    eps = rng.standard_normal((m, n, 2))
+    for t in range(1, n):
+        x[:, t] = phi * x[:, t - 1] + np.sqrt(1 - phi ** 2) * eps[:, t]
+    print('ESS {} (expected about {:.0f}), split-R-hat {}'.format(np.round(ess(x)), m * n * (1 - phi) / (1 + phi),
+        np.round(split_rhat(x), 4)))
+    x[0] += 1 # one chain elsewhere
+    print('with one chain off: split-R-hat {}'.format(np.round(split_rhat(x), 3)))
@@ -0,0 +1,440 @@
+#!/usr/bin/env python
+# encoding: utf-8
+
+"""
+Drift diffusion simulators for the collapsing bounds simulations in
+sim_ddm_collapsing_bounds.py
+
+All trials of one condition are simulated in lock-step: every Euler step
+updates the decision variable of all still-active trials as one array, and
+trials are dropped from the active set as soon as they hit a bound. The
+model variants only differ in their boundary functions of time.
+
+MIT License
+Copyright (c) Anne Urai, 2018
+anne.urai@gmail.com
+"""
+
+import numpy as np
+
+# increase whenever the simulated trials for a given seed change,
+# this invalidates the results stored by sim_cache.py
+engine_version = 7
+
+# ============================================ #
+# boundary functions
+# ============================================ #
+
+# Each of these returns a function of time (in seconds, vectorized over t)
+# that gives the (upper, lower) bounds. Instead of a function, simulate also
+# accepts a precomputed (upper, lower) tuple of per-step arrays.
+
+def static_bounds(a):
+    return lambda t: (np.ones_like(t) * a, np.zeros_like(t))
+
+def shifting_bounds(a, dc):
+    # both bounds move down at rate dc, same as DDM2
+    return lambda t: (a - dc * t, 0 - dc * t)
+
+def shifting_upper_bound(a, dc):
+    # only the upper bound moves down at rate dc, same as DDM3
+    return lambda t: (a - dc * t, np.zeros_like(t))
+
+def asymmetric_bounds(a, upper_slope=0, lower_slope=0):
+    # each bound moves linearly at its own rate (positive = downwards)
+    return lambda t: (a - upper_slope * t, 0 - lower_slope * t)
+
+def linear_collapse(a, slope):
+    # both bounds collapse towards a/2 at rate slope, and stay there
+    def bounds(t):
+        half = np.maximum(a / 2.0 - slope * t, 0)
+        return (a / 2.0 + half, a / 2.0 - half)
+    return bounds
+
+def weibull_collapse(a, lam, k, a_final=0):
+    # Weibull collapse from separation a to a_final, Hawkins et al. (2015) J Neurosci
+    def bounds(t):
+        half = a / 2.0 - (1 - np.exp(-(t / float(lam)) ** k)) * (a - a_final) / 2.0
+        return (a / 2.0 + half, a / 2.0 - half)
+    return bounds
+
+def urgency_bounds(a, urgency):
+    # linearly increasing gain on the evidence, expressed as bounds
+    # that shrink around a/2 by 1 / (1 + urgency * t)
+    def bounds(t):
+        half = (a / 2.0) / (1 + urgency * t)
+        return (a / 2.0 + half, a / 2.0 - half)
+    return bounds
+
+def bound_schedule(bounds, first_step, n_steps, dt):
+
+    """
+    Upper and lower bound for steps first_step ... first_step+n_steps-1.
+    A trial is checked against the bounds at the end of each step, so step i
+    uses the bounds at t = (i+1)*dt. Precomputed arrays hold their last value.
+    """
+
+    steps = np.arange(first_step, first_step + n_steps)
+    if callable(bounds):
+        upper, lower = bounds((steps + 1) * dt)
+    else:
+        upper = np.asarray(bounds[0], dtype=float)
+        lower = np.asarray(bounds[1], dtype=float)
+        upper = upper[np.minimum(steps, upper.size - 1)]
+        lower = lower[np.minimum(steps, lower.size - 1)]
+    return (np.broadcast_to(upper, steps.shape), np.broadcast_to(lower, steps.shape))
+
+# ============================================ #
+# simulator core
+# ============================================ #
+
+class NoiseBlock(object):
+
+    """
+    Standard normal draws from a np.random.Generator, generated block_size
+    at a time into a pre-allocated buffer and handed out in order
+    """
+
+    def __init__(self, rng, block_size=2**20):
+        self.rng = rng
+        self.buffer = np.empty(block_size)
+        self.pos = block_size
+
+    def draw(self, n):
+        if self.pos + n > self.buffer.size: # refill in place
+            if n > self.buffer.size:
+                self.buffer = np.empty(n)
+            self.rng.standard_normal(out=self.buffer)
+            self.pos = 0
+        self.pos += n
+        return self.buffer[self.pos - n:self.pos]
+
+def simulate(drift, a, z, bounds=None, nr_trials=1000, dt=0.01, block_steps=1000, rng=None,
+    noise_block=2**20, verbose=False):
+
+    """
+    Simulate nr_trials diffusion traces at once.
+    drift       = drift rate for all trials
+    a, z        = boundary separation and relative starting point, dv starts at z*a
+    bounds      = boundary function of time or (upper, lower) per-step arrays,
+                  defaults to static bounds at a and 0
+    block_steps = number of steps for which the bound schedule is computed at once
+    rng         = np.random.Generator to draw the noise from
+    noise_block = maximum number of noise samples drawn from rng at once
+
+    Returns (rt, response), with rt in time steps as in the original loops.
+    """
+
+    if bounds is None:
+        bounds = static_bounds(a)
+    if rng is None:
+        rng = np.random.default_rng()
+    noise = NoiseBlock(rng, min(noise_block, 16 * nr_trials))
+
+    # scaling constants, noise is N(0,1) / sqrt(0.01) per unit time
+    drift_step = drift * dt
+    noise_step = dt / np.sqrt(0.01)
+
+    # Setup all variables:
+    rt = np.zeros(nr_trials)
+    response = np.zeros(nr_trials)
+    active = np.arange(nr_trials) # trials that have not hit a bound yet
+    dv = np.ones(nr_trials) * z * a
+
+    # Run the traces:
+    time = 0
+    while active.size > 0:
+        if time % block_steps == 0:
+            upper_bounds, lower_bounds = bound_schedule(bounds, time, block_steps, dt)
+        if verbose:
+            print('step {}: {} active trials'.format(time, active.size))
+
+        # update dv:
+        eps = noise.draw(active.size)
+        eps *= noise_step
+        dv += eps
+        dv += drift_step
+
+        # Check if one of the thresholds is crossed:
+        upper = dv >= upper_bounds[time % block_steps]
+        done = upper | (dv <= lower_bounds[time % block_steps])
+        if done.any():
+            rt[active[done]] = time
+            response[active[upper]] = 1
+            active = active[~done]
+            dv = dv[~done]
+
+        # update time:
+        time += 1
+
+    return(rt, response)
+
+# ============================================ #
+# adaptive time steps
+# ============================================ #
+
+def bounds_at(bounds, n, dt):
+    # upper and lower bound after n steps (t = n*dt), for an array of step counts
+    if callable(bounds):
+        upper, lower = bounds(n * dt)
+    else:
+        upper = np.asarray(bounds[0], dtype=float)
+        lower = np.asarray(bounds[1], dtype=float)
+        upper = upper[np.clip(n - 1, 0, upper.size - 1)]
+        lower = lower[np.clip(n - 1, 0, lower.size - 1)]
+    return (np.broadcast_to(upper, n.shape), np.broadcast_to(lower, n.shape))
+
+def simulate_adaptive(drift, a, z, bounds=None, nr_trials=1000, dt=0.01, tol=1e-3, max_multiple=64,
+    rng=None, noise_block=2**20, return_updates=False, verbose=False):
+
+    """
+    Same as simulate, but each trial takes steps of m*dt, with m a power of 2
+    up to max_multiple, as long as it is far enough from both bounds: m is
+    chosen such that the chance of reaching a bound within the step is below
+    tol. Close to the bounds m=1, which gives the same steps as simulate.
+
+    A large step is refined when it ends beyond a bound, or when the Brownian
+    bridge probability exp(-2*d0*d1/(sigma^2*h)) of a crossing in between is
+    above tol (d0, d1 = distances to the bound at the start and end of the
+    step, exact for linear bounds). Refining draws the intermediate steps of
+    size dt from the discrete Brownian bridge between the start and end
+    point, so refined steps have the same distribution as m steps of simulate.
+
+    tol          = maximum probability of a crossing within one large step
+    max_multiple = largest step, in multiples of dt
+    The step size is chosen using the bounds now and max_multiple steps ahead,
+    so bounds should be monotone over max_multiple*dt.
+
+    Each update costs several times more than a step of simulate, so this
+    only pays off at small dt: 2-5x faster wall-clock at dt=0.001, but up
+    to 3x slower at dt=0.01 (see sim_ddm_adaptive_check.py).
+
+    Returns (rt, response), with rt in time steps as simulate, and the number
+    of updates of each trial if return_updates.
+    """
+
+    if bounds is None:
+        bounds = static_bounds(a)
+    if rng is None:
+        rng = np.random.default_rng()
+    noise = NoiseBlock(rng, min(noise_block, 16 * nr_trials))
+
+    # scaling constants, noise is N(0,1) / sqrt(0.01) per unit time
+    drift_step = drift * dt
+    noise_step = dt / np.sqrt(0.01)
+    # Gaussian tail bound, P(max excursion > c*sd) < tol
+    c = np.sqrt(2 * np.log(2.0 / tol))
+
+    # Setup all variables:
+    rt = np.zeros(nr_trials)
+    response = np.zeros(nr_trials)
+    updates = np.zeros(nr_trials, dtype=int)
+    active = np.arange(nr_trials)
+    dv = np.ones(nr_trials) * z * a
+    n = np.zeros(nr_trials, dtype=int) # completed steps of size dt
+
+    while active.size > 0:
+        if verbose:
+            print('{} active trials'.format(active.size))
+
+        # largest step for which the distance to the nearest bound is larger than
+        # |drift|*m + c*sd*sqrt(m), both now and max_multiple steps ahead
+        upper0, lower0 = bounds_at(bounds, n, dt)
+        upper_ahead, lower_ahead = bounds_at(bounds, n + max_multiple, dt)
+        d = np.minimum(np.minimum(upper0, upper_ahead) - dv, dv - np.maximum(lower0, lower_ahead))
+        d = np.maximum(d, 0)
+        cs = c * noise_step
+        if drift_step == 0:
+            m = (d / cs) ** 2
+        else:
+            m = ((np.sqrt(cs**2 + 4 * abs(drift_step) * d) - cs) / (2 * abs(drift_step))) ** 2
+        m = 2 ** np.floor(np.log2(np.clip(m, 1, max_multiple))).astype(int)
+
+        # update dv:
+        eps = noise.draw(active.size) * np.sqrt(m)
+        eps *= noise_step
+        dv0 = dv.copy()
+        dv += eps
+        dv += drift_step * m
+        n += m
+        updates[active] += 1
+
+        # Check if one of the thresholds is crossed at the end of the step:
+        upper1, lower1 = bounds_at(bounds, n, dt)
+        upper = dv >= upper1
+        done = upper | (dv <= lower1)
+        crossed = n - 1
+
+        # refine large steps that may have crossed in between
+        large = np.flatnonzero(m > 1)
+        if large.size > 0:
+            var = m[large] * noise_step**2
+            p = np.exp(-2 * np.maximum(upper0[large] - dv0[large], 0) * np.maximum(upper1[large] - dv[large], 0) / var) + \
+                np.exp(-2 * np.maximum(dv0[large] - lower0[large], 0) * np.maximum(dv[large] - lower1[large], 0) / var)
+            refine = large[done[large] | (p > tol)]
+            if refine.size > 0:
+                hit, hit_upper, k = bridge_crossings(dv0[refine], dv[refine], n[refine] - m[refine],
+                    m[refine], bounds, dt, noise_step, noise)
+                updates[active[refine]] += m[refine] - 1
+                done[refine] = hit
+                upper[refine] = hit_upper
+                crossed[refine] = n[refine] - m[refine] + k - 1
+
+        if done.any():
+            rt[active[done]] = crossed[done]
+            response[active[upper & done]] = 1
+            active = active[~done]
+            dv = dv[~done]
+            n = n[~done]
+
+    if return_updates:
+        return(rt, response, updates)
+    return(rt, response)
+
+def bridge_crossings(x0, x1, n0, m, bounds, dt, noise_step, noise):
+
+    """
+    Fill in the m-1 intermediate steps between x0 (after n0 steps) and x1
+    (after n0+m steps) from the discrete Brownian bridge, and check each step
+    against the bounds. Returns whether a bound was hit, whether that was the
+    upper one, and the number of steps k (1...m) after n0 at which it was hit.
+    """
+
+    k = np.arange(1, m.max() + 1)
+    frac = k / m[:, None].astype(float)
+    walk = np.cumsum(noise.draw(m.size * k.size).reshape(m.size, k.size), axis=1) * noise_step
+    walk_end = walk[np.arange(m.size), m - 1]
+    path = x0[:, None] + frac * (x1 - x0)[:, None] + walk - frac * walk_end[:, None]
+    path[:, -1] = np.where(m == k[-1], x1, path[:, -1]) # no rounding error at the end point
+
+    upper, lower = bounds_at(bounds, n0[:, None] + k, dt)
+    in_step = k <= m[:, None]
+    hit_upper = (path >= upper) & in_step
+    crossed = hit_upper | ((path <= lower) & in_step)
+    first = np.argmax(crossed, axis=1)
+    rows = np.arange(m.size)
+    hit = crossed[rows, first]
+    return hit, hit & hit_upper[rows, first], first + 1
+
+# ============================================ #
+# exact sampler for static bounds
+# ============================================ #
+
+def lower_bound_cdf(t, drift, a, x0, sigma, n_terms):
+
+    """
+    Defective cumulative distribution of first passage times through the lower
+    bound (at 0, upper bound at a, starting at x0), large-time series as in
+    analyticalDDM/DDM/sim_G.m (Ratcliff & Tuerlinckx, 2002)
+    """
+
+    if abs(drift) < 1e-10:
+        p_lower = 1 - x0 / float(a)
+    else:
+        p_lower = (np.exp(-2 * drift * a / sigma**2) - np.exp(-2 * drift * x0 / sigma**2)) / \
+            (np.exp(-2 * drift * a / sigma**2) - 1)
+    k = np.arange(1, n_terms + 1)
+    lam = (drift**2 / sigma**2) + (np.pi**2 * k**2 * sigma**2 / a**2)
+    terms = 2 * k * np.sin(k * np.pi * x0 / a) / lam
+    series = np.exp(-0.5 * np.outer(t, lam)).dot(terms)
+    cdf = p_lower - (np.pi * sigma**2 / a**2) * np.exp(-drift * x0 / sigma**2) * series
+    cdf[t <= 0] = 0 # the series does not converge at t=0
+    return p_lower, cdf
+
+def sample_fpt(drift, a, z, nr_trials=1000, dt=0.01, rng=None, n_grid=4000):
+
+    """
+    Draw choices and first passage times directly from the first passage time
+    distribution of a diffusion between static bounds at a and 0, starting at
+    z*a. Uses the same noise as simulate (variance dt/0.01 per unit time), and
+    inverts the conditional distribution of each bound on a grid of n_grid
+    time points that covers all but ~1e-11 of the probability mass.
+
+    Returns (rt, response), with rt in (fractional) time steps of size dt,
+    counted as in simulate: a passage at t gives rt = t/dt - 1.
+    """
+
+    if rng is None:
+        rng = np.random.default_rng()
+    sigma = np.sqrt(dt / 0.01)
+
+    # slowest decaying term of the series sets the time range,
+    # the first grid point sets the number of terms needed
+    lam1 = 0.5 * ((drift**2 / sigma**2) + (np.pi**2 * sigma**2 / a**2))
+    t_grid = np.linspace(0, 25 / lam1, n_grid)
+    n_terms = int(np.ceil(np.sqrt(2 * a**2 * 28 / (np.pi**2 * sigma**2 * t_grid[1])))) + 1
+
+    rt = np.zeros(nr_trials)
+    p_lower, cdf_lower = lower_bound_cdf(t_grid, drift, a, z * a, sigma, n_terms)
+    p_upper, cdf_upper = lower_bound_cdf(t_grid, -drift, a, a - z * a, sigma, n_terms)
+    response = np.array(rng.random(nr_trials) >= p_lower, dtype=float)
+
+    # inverse cdf sampling per bound
+    for resp, cdf in [(0, cdf_lower), (1, cdf_upper)]:
+        cdf = np.maximum.accumulate(np.maximum(cdf, 0))
+        if cdf[-1] > 0:
+            idx = np.flatnonzero(response == resp)
+            rt[idx] = np.interp(rng.random(idx.size) * cdf[-1], cdf, t_grid) / dt - 1
+    return(rt, response)
+
+def DDM(v=1, a=1, z=0.5, dc=0, stim=0, nr_trials=1000, dt=0.01, rng=None, method='euler', tol=1e-3,
+    verbose=False):
+
+    """
+    DDM, static bounds with drift criterion dc added to the drift.
+    method='euler' simulates the traces, as DDM2 and DDM3 do, so that the
+    models of one sweep share the discretization, method='adaptive'
+    simulates them with adaptive steps (see simulate_adaptive) and
+    method='exact' samples from the first passage time distribution, without
+    the bias of the Euler steps. method='adaptive' is only faster at small dt
+    (e.g. 0.001); at dt=0.01 it is up to 3x slower than 'euler'.
+    """
+
+    if stim == 1:
+        drift = v + dc
+    else:
+        drift = -v + dc
+    if method == 'exact':
+        return sample_fpt(drift, a, z, nr_trials=nr_trials, dt=dt, rng=rng)
+    if method == 'adaptive':
+        return simulate_adaptive(drift, a, z, nr_trials=nr_trials, dt=dt, tol=tol, rng=rng, verbose=verbose)
+    return simulate(drift, a, z, nr_trials=nr_trials, dt=dt, rng=rng, verbose=verbose)
+
+def DDM2(v=1, a=1, z=0.5, dc=0, stim=0, nr_trials=1000, dt=0.01, rng=None, method='euler', tol=1e-3,
+    verbose=False):
+
+    """
+    DDM, both bounds shift down by dc*dt every step
+    method='adaptive' is only faster at small dt (e.g. 0.001), see DDM
+    """
+
+    if stim == 1:
+        drift = v
+    else:
+        drift = -v
+    if method == 'adaptive':
+        return simulate_adaptive(drift, a, z, bounds=shifting_bounds(a, dc), nr_trials=nr_trials,
+            dt=dt, tol=tol, rng=rng, verbose=verbose)
+    return simulate(drift, a, z, bounds=shifting_bounds(a, dc), nr_trials=nr_trials,
+        dt=dt, rng=rng, verbose=verbose)
+
+def DDM3(v=1, a=1, z=0.5, dc=0, stim=0, nr_trials=1000, dt=0.01, rng=None, method='euler', tol=1e-3,
+    verbose=False):
+
+    """
+    DDM, only the upper bound shifts down by dc*dt every step
+    method='adaptive' is only faster at small dt (e.g. 0.001), see DDM
+    """
+
+    if stim == 1:
+        drift = v
+    else:
+        drift = -v
+    if method == 'adaptive':
+        return simulate_adaptive(drift, a, z, bounds=shifting_upper_bound(a, dc), nr_trials=nr_trials,
+            dt=dt, tol=tol, rng=rng, verbose=verbose)
+    return simulate(drift, a, z, bounds=shifting_upper_bound(a, dc), nr_trials=nr_trials,
+        dt=dt, rng=rng, verbose=verbose)
+
+# look up the simulators by name, e.g. in sim_sweep.py
+models = {'DDM': DDM, 'DDM2': DDM2, 'DDM3': DDM3}
@@ -0,0 +1,273 @@
+#!/usr/bin/env python
+# encoding: utf-8
+
+"""
+First passage time densities of the drift diffusion model, a vectorized port
+of analyticalDDM/DDM/fpt_regular_DDM.m (with sim_G.m, sim_Pe.m and lgwt.m).
+
+The MATLAB code loops over time points and quadrature nodes, one parameter
+set at a time. Here the defective cumulative distributions are computed for
+a batch of parameter sets, all time points and all quadrature nodes at once
+(arrays of sets x nodes x time points), summing the series until it has
+converged everywhere. Early time points use the small-time series instead
+of sim_G.m's, which cancels against Pe there and loses all precision for
+extreme drift rates. Only the final spline interpolation to 1 ms is done
+per group of parameter sets that share the same time grid.
+
+Parameters follow the MATLAB code: pm = [v, Ter, a, eta, z] per row, with
+noise s = 0.1, z the absolute starting point and z = a/2 if pm has only the
+four columns of the PSO fits.
+
+MIT License
+Copyright (c) Anne Urai, 2018
+anne.urai@gmail.com
+"""
+
+import numpy as np
+from scipy.interpolate import CubicSpline
+from scipy.special import log_ndtr
+
+# ============================================ #
+# building blocks, as in sim_Pe.m, sim_G.m and lgwt.m
+# ============================================ #
+
+def sim_pe(v, a, z, s=0.1):
+    # probability of hitting the lower (error) bound
+    with np.errstate(over='ignore', invalid='ignore', divide='ignore'):
+        pe = (np.exp(-2 * v * a / s**2) - np.exp(-2 * v * z / s**2)) / (np.exp(-2 * v * a / s**2) - 1)
+    return np.where(np.abs(v) < 1e-10, 1 - z / a, pe)
+
+def sim_g(t, v, a, z, s, pe, tol=10e-29, max_terms=10000):
+
+    """
+    Defective cumulative distribution of lower bound crossings at times t,
+    broadcasting over all inputs. Terms of the series are added until the
+    last two changed the sum by at most tol (relative), as in sim_G.m.
+    """
+
+    t, v, a, z, pe = np.broadcast_arrays(*[np.asarray(x, dtype=float) for x in [t, v, a, z, pe]])
+    shape = t.shape
+    v_all, a_all, z_all, pe = [x.ravel() for x in [v, a, z, pe]]
+    t, v, a, z = t.ravel(), v_all, a_all, z_all
+    sum_term = np.zeros(t.size)
+
+    # only elements that have not converged yet are updated,
+    # these are mostly the earliest time points
+    active = np.arange(t.size)
+    last_small = np.zeros(t.size, dtype=bool)
+    for k in range(1, max_terms + 1):
+        lam = v**2 / s**2 + np.pi**2 * k**2 * s**2 / a**2
+        term = 2 * k * np.sin(k * np.pi * z / a) * np.exp(-0.5 * lam * t) / lam
+        small = np.abs(term) <= np.abs(sum_term[active]) * tol
+        sum_term[active] += term
+        converged = small & last_small
+        if converged.any():
+            keep = ~converged
+            active, t, v, a, z = active[keep], t[keep], v[keep], a[keep], z[keep]
+            small = small[keep]
+            if active.size == 0:
+                break
+        last_small = small
+
+    with np.errstate(over='ignore', invalid='ignore'):
+        g = pe - (np.pi * s**2 / a_all**2) * np.exp(-v_all * z_all / s**2) * sum_term
+    return g.reshape(shape)
+
+def sim_g_small(t, v, a, z, s, n_terms=8):
+
+    """
+    Same as sim_g, from the small-time series (Blurton, Kesselmeier & Gondan,
+    2012): the first passage times of the mirror images of the starting point
+    at z + 2ka, k = -n_terms...n_terms, integrated term by term. For
+    t < (a/s)^2 the terms fall off at least as exp(-(2|k|-1)^2 / 2), and
+    they never cancel against Pe, which sim_g does at early t.
+    """
+
+    t, v, a, z = np.broadcast_arrays(*[np.asarray(x, dtype=float) for x in [t, v, a, z]])
+    v, a, z = v / s, a / s, z / s # unit noise
+    sqrt_t = np.sqrt(np.maximum(t, 1e-300))
+    g = np.zeros(t.shape)
+    for k in range(-n_terms, n_terms + 1):
+        x = z + 2 * k * a
+        sign, x = np.sign(x), np.abs(x)
+        # P(reaching x before t) of a diffusion with drift -sign*v towards it, times exp(2vka),
+        # in logs so that neither factor overflows
+        g += sign * (np.exp(2 * v * k * a + log_ndtr((-x - sign * v * t) / sqrt_t)) +
+            np.exp(2 * v * k * a - 2 * sign * v * x + log_ndtr((sign * v * t - x) / sqrt_t)))
+    g[t <= 0] = 0
+    return g
+
+def lower_cdf(t, v, a, z, s, pe):
+
+    """
+    Defective cumulative distribution of lower bound crossings, from the
+    small-time series (sim_g_small) before t = (a/s)^2 and from the
+    large-time series (sim_g) after. Both converge quickly on their side, and
+    there the terms of sim_g are at most ~exp(1/2) times Pe, so it loses no
+    precision to cancellation.
+    """
+
+    t, v, a, z, pe = np.broadcast_arrays(*[np.asarray(x, dtype=float) for x in [t, v, a, z, pe]])
+    g = np.zeros(t.shape)
+    early = t * s**2 < a**2
+    if early.any():
+        g[early] = sim_g_small(t[early], v[early], a[early], z[early], s)
+    if not early.all():
+        late = ~early
+        g[late] = sim_g(t[late], v[late], a[late], z[late], s, pe[late])
+    return g
+
+def lgwt(n, a, b):
+
+    """
+    Legendre-Gauss nodes and weights on [a, b], as in lgwt.m.
+    a and b can be arrays, the nodes are then along the last axis.
+    """
+
+    n = n - 1
+    n1, n2 = n + 1, n + 2
+    xu = np.linspace(-1, 1, n1)
+    y = np.cos((2 * np.arange(n + 1) + 1) * np.pi / (2 * n + 2)) + (0.27 / n1) * np.sin(np.pi * xu * n / n2)
+    y0 = 2
+    while np.max(np.abs(y - y0)) > np.finfo(float).eps:
+        L = [np.ones(n1), y]
+        for k in range(2, n1 + 1):
+            L.append(((2 * k - 1) * y * L[k - 1] - (k - 1) * L[k - 2]) / k)
+        lp = n2 * (L[n1 - 1] - y * L[n1]) / (1 - y**2)
+        y0 = y
+        y = y0 - L[n1] / lp
+    a = np.asarray(a, dtype=float)[..., None]
+    b = np.asarray(b, dtype=float)[..., None]
+    x = (a * (1 - y) + b * (1 + y)) / 2
+    w = (b - a) / ((1 - y**2) * lp**2) * (n2 / float(n1))**2
+    return x, w
+
+def n_nodes(eta):
+    # number of quadrature nodes for drift rate variability eta, as in fpt_regular_DDM.m
+    return np.select([eta <= 0.025, eta <= 0.05, eta <= 0.1, eta <= 0.175, eta <= 0.225],
+        [7, 8, 13, 15, 17], 21)
+
+# ============================================ #
+# quadrature over the drift rate distribution
+# ============================================ #
+
+# canonical nodes and weights per number of nodes, filled on first use
+_quadrature_cache = {}
+
+def drift_quadrature(n):
+
+    """
+    Nodes y on [-1, 1] and weights for integrating over a normal drift rate
+    distribution with n nodes. The drift rates are v + 4*eta*y; the weights
+    already include the normal density and the interval length, which cancel
+    eta, so they are the same for every v and eta.
+    """
+
+    if n not in _quadrature_cache:
+        y, w = lgwt(n, -1, 1)
+        y, w = y.ravel(), w.ravel()
+        # w * (8*eta / 2) * exp(-(4*eta*y)^2 / (2*eta^2)) / sqrt(2*pi*eta^2)
+        _quadrature_cache[n] = (y, w * 4 * np.exp(-8 * y**2) / np.sqrt(2 * np.pi))
+    return _quadrature_cache[n]
+
+def drift_nodes(v, eta):
+
+    """
+    Drift rates and quadrature weights (sets x nodes) for each parameter set.
+    Sets with fewer nodes than the batch maximum get nodes with zero weight,
+    sets without drift rate variability a single node at v with weight 1.
+    """
+
+    nodes = n_nodes(eta) * (eta > 0) + (eta <= 0)
+    x = np.tile(v[:, None], (1, nodes.max()))
+    w = np.zeros(x.shape)
+    w[eta <= 0, 0] = 1
+    for n in np.unique(nodes[eta > 0]):
+        which = (eta > 0) & (nodes == n)
+        y, w_n = drift_quadrature(n)
+        x[which, :n] = v[which, None] + 4 * eta[which, None] * y
+        w[which, :n] = w_n
+    return x, w
+
+# ============================================ #
+# densities
+# ============================================ #
+
+def defective_cdfs(pm, t, s=0.1):
+
+    """
+    Defective cumulative distributions (gC, gE) of correct and error responses
+    at decision times t (time points along the last axis), for each row of pm.
+    With eta > 0, integrates over the drift rate distribution by Gaussian
+    quadrature on v +- 4*eta; parameter sets with fewer nodes than the batch
+    maximum get nodes with zero weight.
+    """
+
+    pm = np.atleast_2d(np.asarray(pm, dtype=float))
+    v, ter, a, eta = pm[:, 0], pm[:, 1], pm[:, 2], pm[:, 3]
+    z = pm[:, 4] if pm.shape[1] > 4 else a / 2.0
+
+    x, w = drift_nodes(v, eta)
+
+    # sets x nodes x time points
+    t = np.asarray(t, dtype=float)
+    t = t.reshape((pm.shape[0], 1, -1)) if t.ndim > 1 else t[None, None, :]
+    a3, z3, x3 = a[:, None, None], z[:, None, None], x[:, :, None]
+    pe = sim_pe(x3, a3, z3, s)
+    g_error = lower_cdf(t, x3, a3, z3, s, pe)
+    g_correct = lower_cdf(t, -x3, a3, a3 - z3, s, 1 - pe)
+    return (np.sum(g_correct * w[:, :, None], axis=1), np.sum(g_error * w[:, :, None], axis=1))
+
+def fpt_regular_ddm(pm, tmax, dt=0.01, s=0.1):
+
+    """
+    Densities of correct and error RTs at 1 ms resolution from 0 to tmax,
+    same steps as fpt_regular_DDM.m. pm is one parameter vector or a
+    sets x parameters array; returns (gC, gE, ts) with gC and gE of shape
+    sets x len(ts), or 1d for a single parameter vector.
+    """
+
+    single = np.ndim(pm) == 1
+    pm = np.atleast_2d(np.asarray(pm, dtype=float))
+    ter = pm[:, 1]
+
+    # decision times dt:dt:ceil((tmax-Ter)*1000)/1000, per set
+    t_end = np.ceil(np.round((tmax - ter) * 1000, 6)) / 1000
+    n_t = np.floor(np.round(t_end / dt, 6)).astype(int)
+    t = dt * np.arange(1, n_t.max() + 1)
+    g_correct, g_error = defective_cdfs(pm, t, s)
+
+    ts = np.arange(int(np.floor(np.round(tmax / 0.001, 6))) + 1) * 0.001
+    gC = np.zeros((pm.shape[0], ts.size))
+    gE = np.zeros((pm.shape[0], ts.size))
+    ter_ms = np.round(ter * 1000) / 1000
+
+    # sets with the same time grid are interpolated together
+    grids = np.stack([n_t, np.round(ter_ms * 1000)], axis=1)
+    for grid in np.unique(grids, axis=0):
+        which = np.flatnonzero(np.all(grids == grid, axis=1))
+        n = int(grid[0])
+        dens = []
+        for g in [g_correct[which, :n], g_error[which, :n]]:
+            # cumulative to density, starting at zero
+            g = np.diff(np.hstack([np.zeros((which.size, 1)), g]), axis=1) / (dt * 1000)
+            if n > 1:
+                first_high = g[:, 0] > g[:, 1]
+                g[first_high, 0] = g[first_high, 1]
+            g[g < 0] = 0
+            dens.append(g)
+
+        # pad with zeros from 0 up to the first time point after Ter
+        t_first = dt + ter_ms[which[0]]
+        n_pad = 1 + int(np.floor(np.round((t_first - dt) / dt, 6)))
+        ts_extra = np.hstack([dt * np.arange(n_pad), ter_ms[which[0]] + dt * np.arange(1, n + 1)])
+        for g, out in zip(dens, [gC, gE]):
+            g = np.hstack([np.zeros((which.size, n_pad)), g])
+            out[which] = CubicSpline(ts_extra, g, axis=1)(ts)
+
+    # everything before Ter and negative values from the spline are set to zero
+    for out in [gC, gE]:
+        out[(ts[None, :] < ter[:, None]) | (out < 0)] = 0
+    if single:
+        return gC[0], gE[0], ts
+    return gC, gE, ts
@@ -0,0 +1,213 @@
+#!/usr/bin/env python
+# encoding: utf-8
+
+"""
+Parity check of fpt_ddm.py against a line-by-line transliteration of
+analyticalDDM/DDM/fpt_regular_DDM.m, sim_G.m, sim_Pe.m and lgwt.m, for
+random parameter sets in the ranges of FIT_regular_DDM_PSO.m. Also reports
+the speedup of the vectorized engine. Run as: python fpt_ddm_parity.py
+
+For extreme drift rates, the series of sim_G.m cancels against Pe at early
+time points, and in double precision returns rounding noise there. The
+reference therefore sums the same series in 120-digit decimal arithmetic
+(sim_G_decimal), which makes it exact for every parameter set; the double
+precision transliteration is only timed. This takes a few minutes.
+
+MIT License
+Copyright (c) Anne Urai, 2018
+anne.urai@gmail.com
+"""
+
+import time
+from decimal import Decimal, localcontext
+import numpy as np
+from scipy.interpolate import CubicSpline
+import fpt_ddm
+
+# ============================================ #
+# transliteration of the MATLAB code
+# ============================================ #
+
+def sim_Pe(v, a, z, s):
+    return (np.exp(-2*v*a/(s**2))-np.exp(-2*v*z/(s**2)))/(np.exp(-2*v*a/(s**2))-1)
+
+def sim_G(t, v, a, z, s, Pe):
+    tol = 10e-29
+    sum_term = [0, 0]
+    diff_term = [1, 1]
+    k = 0
+    while True:
+        k = k+1
+        lam = ((v**2)/(s**2))+((np.pi**2)*(k**2)*(s**2)/(a**2))
+        sum_term.append(sum_term[-1]+((2*k*np.sin(k*np.pi*z/a)*np.exp(-0.5*(lam*t)))/lam))
+        diff_term.append(sum_term[-1]-sum_term[-2])
+        if abs(diff_term[-1]) <= sum_term[-2]*tol and abs(diff_term[-2]) <= sum_term[-3]*tol:
+            break
+        elif sum_term[-2] < 0 and sum_term[-3] < 0 and abs(diff_term[-1]) < abs(sum_term[-2])*tol \
+            and abs(diff_term[-2]) < abs(sum_term[-3])*tol:
+            break
+    return Pe-((((np.pi*(s**2))/(a**2))*np.exp(-(v*z/(s**2))))*sum_term[-1])
+
+def decimal_pi():
+    # as in the recipes of the decimal module
+    lasts, t, s, n, na, d, da = 0, Decimal(3), 3, 1, 0, 0, 24
+    while s != lasts:
+        lasts = s
+        n, na = n + na, na + 8
+        d, da = d + da, da + 32
+        t = (t * n) / d
+        s += t
+    return +s
+
+def decimal_sin_cos(x):
+    # Taylor series, for 0 <= x <= pi
+    sin, cos, term, i = Decimal(0), Decimal(0), Decimal(1), 0
+    while True:
+        new = cos + term if i % 4 == 0 else cos - term if i % 4 == 2 else cos
+        new_sin = sin + term if i % 4 == 1 else sin - term if i % 4 == 3 else sin
+        if new == cos and new_sin == sin and i > 1:
+            return sin, cos
+        sin, cos = new_sin, new
+        i += 1
+        term = term * x / i
+
+with localcontext() as ctx:
+    ctx.prec = 120
+    pi_120 = decimal_pi()
+
+def sim_G_decimal(t, v, a, z, s, Pe=None):
+    # sim_G with the stopping rule of sim_G.m, in 120 digits, with Pe computed at that precision too
+    with localcontext() as ctx:
+        ctx.prec = 120
+        t, v, a, z, s = [Decimal(float(x)) for x in [t, v, a, z, s]]
+        pi = pi_120
+        if abs(v) < Decimal('1e-10'):
+            Pe = 1 - z / a
+        else:
+            Pe = ((-2*v*a/s**2).exp()-(-2*v*z/s**2).exp())/((-2*v*a/s**2).exp()-1)
+        # sin(k*theta) and exp(-0.5*lam*t) by recurrences over k
+        sin1, cos1 = decimal_sin_cos(pi*z/a)
+        sin_k, sin_prev = sin1, Decimal(0)
+        lam0, c = v**2/s**2, pi**2*s**2/a**2
+        E0, q = (-lam0*t/2).exp(), (-c*t/2).exp()
+        qk2, q_step = q, q # q^(k^2), q^(2k-1)
+        sum_term = [Decimal(0), Decimal(0)]
+        diff_term = [Decimal(1), Decimal(1)]
+        tol = Decimal('10e-29')
+        k = 0
+        while True:
+            k = k+1
+            if k > 1:
+                sin_k, sin_prev = 2*cos1*sin_k-sin_prev, sin_k
+                q_step = q_step*q*q
+                qk2 = qk2*q_step
+            lam = lam0+c*k**2
+            sum_term.append(sum_term[-1]+2*k*sin_k*E0*qk2/lam)
+            diff_term.append(sum_term[-1]-sum_term[-2])
+            if abs(diff_term[-1]) <= sum_term[-2]*tol and abs(diff_term[-2]) <= sum_term[-3]*tol:
+                break
+            elif sum_term[-2] < 0 and sum_term[-3] < 0 and abs(diff_term[-1]) < abs(sum_term[-2])*tol \
+                and abs(diff_term[-2]) < abs(sum_term[-3])*tol:
+                break
+        return float(Pe-(pi*s**2/a**2)*(-v*z/s**2).exp()*sum_term[-1])
+
+def lgwt(N, a, b):
+    N = N-1
+    N1 = N+1; N2 = N+2
+    xu = np.linspace(-1, 1, N1)
+    y = np.cos((2*np.arange(N+1)+1)*np.pi/(2*N+2))+(0.27/N1)*np.sin(np.pi*xu*N/N2)
+    L = np.zeros((N1, N2))
+    y0 = 2
+    while np.max(np.abs(y-y0)) > np.finfo(float).eps:
+        L[:, 0] = 1
+        L[:, 1] = y
+        for k in range(2, N1+1):
+            L[:, k] = ((2*k-1)*y*L[:, k-1]-(k-1)*L[:, k-2])/k
+        Lp = (N2)*(L[:, N1-1]-y*L[:, N2-1])/(1-y**2)
+        y0 = y
+        y = y0-L[:, N2-1]/Lp
+    x = (a*(1-y)+b*(1+y))/2
+    w = (b-a)/((1-y**2)*Lp**2)*(float(N2)/N1)**2
+    return x, w
+
+def matlab_colon(start, step, stop):
+    return start + step * np.arange(int(np.floor(np.round((stop - start) / step, 6))) + 1)
+
+def fpt_regular_DDM(pm, tmax, sim_G=sim_G):
+    v = pm[0]; Ter = pm[1]; a = pm[2]; eta = pm[3]
+    z = pm[4] if len(pm) > 4 else a / 2.0
+    s = 0.1
+    dt = 0.01
+    t_all = matlab_colon(dt, dt, np.ceil(np.round((tmax-Ter)*1000, 6))/1000)
+    ts = t_all.copy()
+    gC = [0]; gE = [0]
+    if eta == 0:
+        Pe = sim_Pe(v, a, z, s)
+        for t in t_all:
+            gE.append(sim_G(t, v, a, z, s, Pe))
+            gC.append(sim_G(t, -v, a, a-z, s, 1-Pe))
+    else:
+        if eta <= 0.025: n_nodes = 7
+        elif eta <= 0.05: n_nodes = 8
+        elif eta <= 0.1: n_nodes = 13
+        elif eta <= 0.175: n_nodes = 15
+        elif eta <= 0.225: n_nodes = 17
+        else: n_nodes = 21
+        x, w = lgwt(n_nodes, v-(4*eta), v+(4*eta))
+        for t in t_all:
+            Fe = np.zeros(len(x)); Fc = np.zeros(len(x))
+            for epsi in range(len(x)):
+                Pe = sim_Pe(x[epsi], a, z, s)
+                pdf = (1/np.sqrt(2*np.pi*(eta**2)))*(np.exp(-(((v-x[epsi])**2)/(2*(eta**2)))))
+                Fe[epsi] = sim_G(t, x[epsi], a, z, s, Pe)*pdf
+                Fc[epsi] = sim_G(t, -x[epsi], a, a-z, s, 1-Pe)*pdf
+            gE.append(np.sum(Fe*w))
+            gC.append(np.sum(Fc*w))
+    gE = np.diff(gE)/(dt*1000)
+    gC = np.diff(gC)/(dt*1000)
+    if gE[0] > gE[1]: gE[0] = gE[1]
+    if gC[0] > gC[1]: gC[0] = gC[1]
+    gE[gE < 0] = 0; gC[gC < 0] = 0
+    ts = ts+(np.round(Ter*1000))/1000
+    pad = np.hstack([0, matlab_colon(dt, dt, np.min(ts)-dt)])
+    gC = np.hstack([np.zeros(len(pad)), gC])
+    gE = np.hstack([np.zeros(len(pad)), gE])
+    ts_extra = np.hstack([pad, ts])
+    ts = matlab_colon(np.min(ts_extra), 0.001, tmax)
+    gC = CubicSpline(ts_extra, gC)(ts) # interp1(..., 'spline') is a not-a-knot spline
+    gE = CubicSpline(ts_extra, gE)(ts)
+    gC[(ts < Ter) | (gC < 0)] = 0; gE[(ts < Ter) | (gE < 0)] = 0
+    return gC, gE, ts
+
+# ============================================ #
+# compare
+# ============================================ #
+
+if __name__ == '__main__':
+
+    rng = np.random.default_rng(2018)
+    n_sets = 40
+    # ranges from FIT_regular_DDM_PSO.m, some without drift rate variability
+    pm = np.column_stack([rng.uniform(0.005, 0.8, n_sets), rng.uniform(0.06, 0.9, n_sets),
+        rng.uniform(0.03, 0.6, n_sets), rng.uniform(0.0001, 0.7, n_sets)])
+    pm[::4, 3] = 0
+    pm5 = np.column_stack([pm, pm[:, 2] * rng.uniform(0.3, 0.7, n_sets)])
+
+    for params, tmax in [(pm, 1.4), (pm5, 2.5)]:
+        starttime = time.time()
+        for p in params:
+            fpt_regular_DDM(p, tmax)
+        t_loop = time.time() - starttime
+        starttime = time.time()
+        gC, gE, ts = fpt_ddm.fpt_regular_ddm(params, tmax)
+        t_vec = time.time() - starttime
+        ref = [fpt_regular_DDM(p, tmax, sim_G_decimal) for p in params]
+
+        max_err = 0
+        for i, (rC, rE, rts) in enumerate(ref):
+            assert np.allclose(rts, ts)
+            scale = max(rC.max(), rE.max(), 1e-3)
+            max_err = max(max_err, np.abs(gC[i] - rC).max() / scale, np.abs(gE[i] - rE).max() / scale)
+        print('{} parameters, tmax={}: max relative difference {:.2e} over all {} sets, loops {:.2f} s, '
+            'vectorized {:.2f} s'.format(params.shape[1], tmax, max_err, len(params), t_loop, t_vec))
+        assert max_err < 1e-8
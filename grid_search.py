@@ -0,0 +1,395 @@
+#!/usr/bin/env python
+# encoding: utf-8
+
+"""
+Coarse-to-fine grid search on a pool of worker processes, for the leaky
+accumulator fits of analyticalDDM/LeakyAccumulator/FIT_2acc.m.
+
+The coarse grid (all combinations of the values on each parameter axis) is
+split into chunks that are evaluated in parallel; the objective is called with
+a whole chunk of cells at once, so it can simulate them as one batch. Around
+the best cells, finer local grids are evaluated, halving the spacing at every
+level. Objective values are memoized on disk per cell, keyed on the objective,
+so rerunning with an extended or refined grid only evaluates the new cells.
+
+get_param_mat and get_grid_min are ports of the MATLAB functions of the same
+name: the parameter constraint matrix, and the best combinations of grid cells
+across conditions given the parameters that are fixed across conditions.
+
+MIT License
+Copyright (c) Anne Urai, 2018
+anne.urai@gmail.com
+"""
+
+import os, glob, itertools, multiprocessing
+import numpy as np
+from scipy.special import gammaln, xlogy
+from sim_cache import cache_key
+import sim_lca
+
+# ============================================ #
+# memoized objective values
+# ============================================ #
+
+class GridMemo(object):
+
+    """
+    Objective values per grid cell, stored as .npz shards of (cells, values)
+    in a folder per objective key. Each evaluated chunk is written as its own
+    shard (to a temporary file first), so an interrupted search keeps what it
+    has evaluated, and parallel searches never write to the same file.
+    """
+
+    def __init__(self, path, key, decimals=10):
+        self.path = os.path.join(path, key)
+        self.decimals = decimals
+        self.values = {}
+        self.n_shards = 0
+        try:
+            os.makedirs(self.path)
+        except OSError:
+            if not os.path.isdir(self.path):
+                raise
+        for fl in sorted(glob.glob(os.path.join(self.path, '*.npz'))):
+            if fl.endswith('.tmp.npz'):
+                continue
+            try:
+                with np.load(fl) as f:
+                    self._add(f['cells'], f['values'])
+            except (IOError, OSError, ValueError, KeyError):
+                continue # a shard that was not written completely
+            self.n_shards += 1
+
+    def _keys(self, cells):
+        return [tuple(c) for c in np.round(cells, self.decimals) + 0.0] # + 0.0 turns -0.0 into 0.0
+
+    def _add(self, cells, values):
+        self.values.update(zip(self._keys(cells), values))
+
+    def lookup(self, cells):
+        # (values, found), with None for cells that were not evaluated before
+        values = [self.values.get(k) for k in self._keys(cells)]
+        found = np.array([v is not None for v in values], dtype=bool)
+        return values, found
+
+    def put(self, cells, values):
+        name = '%d_%d_%d'%(os.getpid(), id(self), self.n_shards)
+        tmpname = os.path.join(self.path, name + '.tmp.npz')
+        np.savez(tmpname, cells=cells, values=values)
+        os.rename(tmpname, os.path.join(self.path, name + '.npz'))
+        self.n_shards += 1
+        self._add(cells, values)
+
+# ============================================ #
+# evaluation on a pool of workers
+# ============================================ #
+
+_objective = None
+
+def _init_worker(objective):
+    global _objective
+    _objective = objective
+
+def _evaluate_chunk(args):
+    # runs in the worker processes
+    start, cells = args
+    return start, cells, np.asarray(_objective(cells), dtype=float)
+
+def evaluate(objective, cells, memo=None, n_workers=1, chunk_size=32, verbose=False):
+
+    """
+    Objective values of all cells (cells x parameters). objective takes a
+    chunk of cells and returns one value per cell, or a row of values per cell
+    (e.g. one per condition). Cells found in the memo are not evaluated again.
+    Use n_workers=None for one worker per core.
+    """
+
+    cells = np.atleast_2d(np.asarray(cells, dtype=float))
+    values = [None] * len(cells)
+    if memo is not None:
+        found_values, found = memo.lookup(cells)
+        for i in np.flatnonzero(found):
+            values[i] = found_values[i]
+    todo = np.flatnonzero([v is None for v in values])
+    chunks = [(start, cells[todo[start:start + chunk_size]]) for start in range(0, len(todo), chunk_size)]
+    if verbose:
+        print('evaluating {} of {} cells, {} from the memo'.format(len(todo), len(cells), len(cells) - len(todo)))
+
+    if n_workers == 1 or len(chunks) < 2:
+        pool = None
+        _init_worker(objective)
+        results = (_evaluate_chunk(chunk) for chunk in chunks)
+    else:
+        # fork, so that the objective does not need to be pickled
+        if 'fork' in multiprocessing.get_all_start_methods():
+            pool = multiprocessing.get_context('fork').Pool(n_workers, _init_worker, (objective,))
+        else:
+            pool = multiprocessing.Pool(n_workers, _init_worker, (objective,))
+        results = pool.imap_unordered(_evaluate_chunk, chunks)
+
+    try:
+        for start, chunk, chunk_values in results:
+            if memo is not None:
+                memo.put(chunk, chunk_values)
+            for i, v in zip(todo[start:start + chunk_size], chunk_values):
+                values[i] = v
+        if pool is not None:
+            pool.close()
+    finally:
+        if pool is not None:
+            pool.terminate()
+            pool.join()
+    return np.array(values)
+
+# ============================================ #
+# coarse to fine
+# ============================================ #
+
+def make_grid(axes):
+    # all combinations of the values on each axis, cells x parameters
+    return np.array(list(itertools.product(*axes)), dtype=float)
+
+def refine(centres, steps, lower, upper, points=3):
+
+    """
+    Local grids around each of the centres (cells x parameters), spanning
+    +- steps/2 with the given number of points per axis, clipped to
+    [lower, upper]. Returns the unique cells and the steps of the new grids.
+    """
+
+    offsets = make_grid([np.linspace(-h / 2., h / 2., points) if h > 0 else [0] for h in steps])
+    cells = (np.asarray(centres)[:, None, :] + offsets[None, :, :]).reshape(-1, len(steps))
+    cells = np.clip(cells, lower, upper)
+    return np.unique(np.round(cells, 10), axis=0), np.asarray(steps) / float(points - 1)
+
+def score(values):
+    # total objective per cell, e.g. summed over conditions
+    values = np.asarray(values)
+    return values.sum(axis=1) if values.ndim > 1 else values
+
+def best_cells(cells, values, n_best):
+    # the n_best cells with the lowest score
+    order = np.argsort(score(values), kind='stable')
+    return cells[order[:n_best]]
+
+def search(objective, axes, lower=None, upper=None, n_levels=3, n_best=10, points=3, select=best_cells,
+    memo=None, n_workers=1, chunk_size=32, verbose=False):
+
+    """
+    Evaluate the grid of axes (one list of values per parameter), then
+    n_levels-1 times a finer grid around the best cells.
+    lower, upper = parameter ranges, default to the range of each axis
+    select       = function (cells, values, n_best) -> cells to refine around,
+                   defaults to the n_best cells with the lowest summed objective
+    points       = points per axis of each local grid, the spacing shrinks by
+                   a factor points-1 per level
+
+    Returns (cells, values) of all evaluated cells, best first.
+    """
+
+    axes = [np.unique(np.asarray(ax, dtype=float)) for ax in axes]
+    lower = np.array([ax.min() for ax in axes]) if lower is None else np.asarray(lower, dtype=float)
+    upper = np.array([ax.max() for ax in axes]) if upper is None else np.asarray(upper, dtype=float)
+    steps = np.array([np.median(np.diff(ax)) if ax.size > 1 else 0 for ax in axes])
+
+    cells = make_grid(axes)
+    all_cells, all_values = cells, evaluate(objective, cells, memo, n_workers, chunk_size, verbose)
+    for level in range(1, n_levels):
+        centres = select(all_cells, all_values, n_best)
+        cells, steps = refine(centres, steps, lower, upper, points)
+        # only cells that were not evaluated at an earlier level
+        seen = set(map(tuple, np.round(all_cells, 10)))
+        cells = cells[[tuple(c) not in seen for c in cells]]
+        if verbose:
+            print('level {}: {} new cells around {} best'.format(level, len(cells), len(centres)))
+        if len(cells) == 0:
+            break
+        values = evaluate(objective, cells, memo, n_workers, chunk_size, verbose)
+        all_cells = np.concatenate([all_cells, cells])
+        all_values = np.concatenate([all_values, values])
+
+    order = np.argsort(score(all_values), kind='stable')
+    return all_cells[order], all_values[order]
+
+# ============================================ #
+# leaky accumulator fits, as in FIT_2acc.m
+# ============================================ #
+
+param_names = ['beta', 'sigmaA', 'theta', 'leak']
+
+# grid of FIT_2acc.m; theta in percentiles of the maximum noise-only activity
+grid_p = {'beta': np.arange(0.2, 1.01, 0.2), 'sigmaA': np.r_[np.arange(0, 0.211, 0.03), 0.26, 0.31],
+    'theta': np.arange(0.4, 0.941, 0.06), 'leak': np.r_[np.arange(0, 0.181, 0.02), 0.2, 0.25, 0.3]}
+range_p = {'beta': (0.05, 1), 'sigmaA': (0, 0.5), 'theta': (0.01, 0.99), 'leak': (0, 0.5)}
+
+def get_param_mat(set_p, nsets):
+
+    """
+    Parameter constraint matrix (nsets x parameters) as in get_param_mat.m:
+    1 for all conditions if the parameter is fixed across conditions ('fi'),
+    1..nsets if it is free per condition ('fr'), 0 if it is fixed at zero ('no')
+    """
+
+    param_mat = np.zeros((nsets, len(param_names)), dtype=int)
+    for p, name in enumerate(param_names):
+        if set_p[name] == 'fi':
+            param_mat[:, p] = 1
+        elif set_p[name] == 'fr':
+            param_mat[:, p] = np.arange(1, nsets + 1)
+    return param_mat
+
+def get_grid_min(grid_sets, grid_nll, set_p, n_opt=10):
+
+    """
+    The n_opt best combinations of one grid cell per condition, as in
+    get_grid_min.m, for any number of conditions. grid_sets are the cells
+    (cells x parameters), grid_nll their negative log likelihood per condition
+    (cells x conditions). Cells combined across conditions have the same value
+    for all parameters that are fixed ('fi') in set_p.
+
+    Returns (best_ps, best_nll): n_opt x conditions x parameters, and the
+    summed negative log likelihood of each combination.
+    """
+
+    grid_sets, grid_nll = np.asarray(grid_sets, dtype=float), np.asarray(grid_nll, dtype=float)
+    fixed = [p for p, name in enumerate(param_names) if set_p[name] == 'fi']
+    groups = np.unique(np.round(grid_sets[:, fixed], 10), axis=0, return_inverse=True)[1].ravel()
+
+    best_ps, best_nll = [], []
+    for g in np.unique(groups):
+        rows = np.flatnonzero(groups == g)
+        # best combinations over the first c conditions, adding one condition at a time
+        nll, combs = grid_nll[rows, 0], rows[:, None]
+        for c in range(1, grid_nll.shape[1]):
+            total = nll[:, None] + grid_nll[rows, c][None, :]
+            keep = np.argsort(total, axis=None, kind='stable')[:n_opt]
+            i, j = np.unravel_index(keep, total.shape)
+            nll, combs = total[i, j], np.column_stack([combs[i], rows[j]])
+        keep = np.argsort(nll, kind='stable')[:n_opt]
+        best_ps.append(grid_sets[combs[keep]])
+        best_nll.append(nll[keep])
+    best_ps, best_nll = np.concatenate(best_ps), np.concatenate(best_nll)
+    keep = np.argsort(best_nll, kind='stable')[:n_opt]
+    return best_ps[keep], best_nll[keep]
+
+def l2acc(data, rate):
+    # negative log of the binomial likelihood in L2acc.m, data = [n trials, n hits or false alarms]
+    n, k = data[..., 0], data[..., 1]
+    with np.errstate(divide='ignore'):
+        return -(gammaln(n + 1) - gammaln(n - k + 1) - gammaln(k + 1) + xlogy(k, rate) + xlogy(n - k, 1 - rate))
+
+def hazen_quantile(sorted_rows, p):
+    # MATLAB's quantile on each row of sorted_rows, p one value per row
+    n = sorted_rows.shape[1]
+    pos = np.clip(np.asarray(p) * n - 0.5, 0, n - 1)
+    lo = np.floor(pos).astype(int)
+    hi = np.minimum(lo + 1, n - 1)
+    rows = np.arange(sorted_rows.shape[0])
+    return sorted_rows[rows, lo] + (pos - lo) * (sorted_rows[rows, hi] - sorted_rows[rows, lo])
+
+class LCAObjective(object):
+
+    """
+    Negative log likelihood per condition of grid cells [beta, sigmaA,
+    theta, leak] for the two-accumulator model, as in the grid search of
+    FIT_2acc.m. theta is a percentile of the maximum noise-only activity, from
+    which the false alarm rate follows; hit rates are simulated with sim_lca.
+    data_fa  = conditions x [Nnoise Nfa]
+    data_hit = conditions x strengths x durations x [Nsignal Nhit]
+    Every call uses the same seed, so all cells are simulated with the same
+    noise and the value of a cell does not depend on the chunk it is in.
+    """
+
+    def __init__(self, data_fa, data_hit, strs, durs, nsims_hit=10000, nsims_fa=10000, ter=0.6, seed=None):
+        self.data_fa = np.asarray(data_fa, dtype=float)
+        self.data_hit = np.asarray(data_hit, dtype=float)
+        self.strs, self.durs = np.asarray(strs, dtype=float), np.asarray(durs, dtype=float)
+        self.nsims_hit, self.nsims_fa, self.ter = nsims_hit, nsims_fa, ter
+        self.seed = np.random.SeedSequence(seed).entropy
+        if seed is None:
+            print('objective seed: {}'.format(self.seed)) # pass this as seed to reuse the memo
+        self.key = cache_key(objective='LCAObjective', lca_engine=sim_lca.engine_version,
+            data_fa=self.data_fa.tolist(), data_hit=self.data_hit.tolist(), strs=self.strs.tolist(),
+            durs=self.durs.tolist(), nsims_hit=nsims_hit, nsims_fa=nsims_fa, ter=ter, seed=str(self.seed))
+
+    def thresholds(self, cells):
+        # absolute bounds from the percentiles, per unique beta, sigmaA and leak
+        triples, inverse = np.unique(cells[:, [0, 1, 3]], axis=0, return_inverse=True)
+        peak = sim_lca.sim2acc_no_bound(np.column_stack([triples, np.full(len(triples), self.ter)]),
+            self.nsims_fa, rng=np.random.default_rng(self.seed))
+        return hazen_quantile(np.sort(peak, axis=1)[inverse.ravel()], cells[:, 2])
+
+    def __call__(self, cells):
+        cells = np.atleast_2d(cells)
+        theta = self.thresholds(cells)
+        nll = l2acc(self.data_fa[None, :, :], 1 - cells[:, 2, None]) # false alarms, cells x conditions
+
+        # all cells, strengths and durations as one batch
+        pm = np.column_stack([cells[:, :2], theta, cells[:, 3], np.full(len(cells), self.ter)])
+        s, d = np.meshgrid(self.strs, self.durs, indexing='ij')
+        n_sd = s.size
+        acc = sim_lca.sim2acc(np.tile(pm, (n_sd, 1)), np.repeat(s.ravel(), len(cells)),
+            np.repeat(d.ravel(), len(cells)), self.nsims_hit, rng=np.random.default_rng(self.seed))
+        rate = sim_lca.response_rate(acc, 1).reshape(s.shape + (len(cells),))
+        hits = self.data_hit[:, :, :, None, :] # conditions x strengths x durations x cells
+        nll += np.sum(l2acc(hits, rate[None]), axis=(1, 2)).T
+        return nll
+
+def lca_select(set_p):
+    # refine around the cells of the best combinations across conditions
+    def select(cells, values, n_best):
+        best_ps = get_grid_min(cells, values, set_p, n_best)[0]
+        return np.unique(best_ps.reshape(-1, cells.shape[1]), axis=0)
+    return select
+
+def fit_grid(objective, set_p, grid=None, n_levels=3, n_opt=10, memo_path=None, n_workers=1, chunk_size=32,
+    verbose=False):
+
+    """
+    Grid search stage of FIT_2acc.m for the constraints in set_p (dict of
+    'fi'/'fr'/'no' per parameter): the coarse grid (defaults to grid_p),
+    refined n_levels-1 times.
+    Returns (best_ps, best_nll) as get_grid_min, with theta in percentiles.
+    """
+
+    if grid is None:
+        grid = grid_p
+    axes = [grid[name] for name in param_names]
+    lower = [range_p[name][0] for name in param_names]
+    upper = [range_p[name][1] for name in param_names]
+    if set_p['leak'] == 'no':
+        axes[3], lower[3], upper[3] = [0], 0, 0
+    memo = GridMemo(memo_path, objective.key) if memo_path is not None else None
+    cells, values = search(objective, axes, lower, upper, n_levels, n_opt, select=lca_select(set_p),
+        memo=memo, n_workers=n_workers, chunk_size=chunk_size, verbose=verbose)
+    return get_grid_min(cells, values, set_p, n_opt)
+
+if __name__ == '__main__':
+
+    import time, tempfile
+
+    # recover the parameters of simulated data, on a reduced grid
+    strs, durs, n_trials = [0.1, 0.2], [0.15, 0.45, 0.9], 200
+    true_ps = np.array([[0.6, 0.09, 0.7, 0.04], [0.6, 0.09, 0.82, 0.04]]) # theta as percentile
+    sim = LCAObjective(np.zeros((2, 2)), np.zeros((2, 2, 3, 2)), strs, durs, 20000, 20000, seed=1)
+    theta = sim.thresholds(true_ps)
+    pm = np.column_stack([true_ps[:, :2], theta, true_ps[:, 3], [0.6, 0.6]])
+    rng = np.random.default_rng(2)
+    data_fa = np.column_stack([[n_trials] * 2, rng.binomial(n_trials, 1 - true_ps[:, 2])])
+    data_hit = np.zeros((2, len(strs), len(durs), 2))
+    for i, s in enumerate(strs):
+        for j, d in enumerate(durs):
+            rate = sim_lca.response_rate(sim_lca.sim2acc(pm, s, d, 20000, rng=rng), 1)
+            data_hit[:, i, j] = np.column_stack([[n_trials] * 2, rng.binomial(n_trials, rate)])
+
+    objective = LCAObjective(data_fa, data_hit, strs, durs, 1000, 1000, seed=3)
+    set_p = {'beta': 'fi', 'sigmaA': 'fi', 'theta': 'fr', 'leak': 'fi'}
+    grid = {'beta': [0.4, 0.6, 0.8], 'sigmaA': [0.06, 0.09, 0.12], 'theta': np.arange(0.4, 0.941, 0.06),
+        'leak': [0.02, 0.04, 0.08]}
+    memo_path = tempfile.mkdtemp()
+    for n_levels in [1, 2]:
+        starttime = time.time()
+        best_ps, best_nll = fit_grid(objective, set_p, grid, n_levels, n_opt=5, memo_path=memo_path, verbose=True)
+        print('{} level(s), {:.1f} s, best: {} (-log L = {:.1f})'.format(n_levels, time.time() - starttime,
+            np.round(best_ps[0], 3).tolist(), best_nll[0]))
+    print('true: {}'.format(true_ps.tolist()))
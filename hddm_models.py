@@ -14,6 +14,70 @@ import os, fnmatch
 import hddm
 from IPython import embed as shell
 
+# ============================================ #
+# models and datasets, as run by b1_HDDM_run.py
+# ============================================ #
+
+# models, selected by index with -v
+models = ['stimcoding_nohist', # 0
+    'stimcoding_dc_prevresp', # 1
+    'stimcoding_z_prevresp', # 2
+    'stimcoding_dc_z_prevresp', # 3
+    'stimcoding_dc_prevcorrect', # 4
+    'stimcoding_z_prevcorrect', # 5
+    'stimcoding_dc_z_prevcorrect', # 6
+    'regress_dc_z_prevresp', # 7
+    'regress_dc_z_prevresp_prevrt', # 8
+    'regress_dc_z_prev2resp', # 9
+    'regress_dc_z_prev3resp', # 10
+    'regress_dc_z_prevresp_prevstim_prevrt_prevpupil', # 11
+    'stimcoding_dc_z_prevresp_pharma', #12
+    'stimcoding_dc_prevresp_sessions', # 13
+    'regress_dc_z_visualgamma', #14
+    'regress_dc_z_motorslope', #15
+    'regress_dc_z_motorstart', #16
+    'stimcoding_sz_nohist', # 17
+    'stimcoding_sz_dc_prevresp', # 18
+    'stimcoding_sz_z_prevresp', # 19
+    'stimcoding_sz_dc_z_prevresp', # 20
+    'regress_dc_prevresp', # 21
+    'regress_dc_prevresp_prevrt', #22
+    'regress_nohist', # 23
+    'regress_dc_prevcorrect_prevrt', # 24
+    'regress_dc_prevcorrect', # 25
+    'regress_dc_z_prevresp_visualgamma', # 26
+    'regress_dc_z_prevresp_motorslope', # 27
+    'regress_dc_z_prevresp_motorstart', # 28
+    'stimcoding_dc_z_prevresp_sessions', # 29
+    ]
+
+# datasets = ['RT_RDK', # 0
+#     'MEG', # 1
+#     'NatComm', # 2
+#     'Anke_merged', # 3
+#     'JW_yesno', # 4
+#     'Bharath_fMRI', # 5
+#     'Murphy', # 6
+#     'MEG_MEGdata', # 7
+#     'JW_PNAS', # 8
+#     'JW_fMRI', # 9
+#     'Anke_2afc_sequential', #10
+#     'Anke_MEG', #11
+#     'NatComm_500ms', # 12
+#     'MEG_750ms', # 13
+#     'JW_yesno_2500ms'] # 14
+
+# datasets, selected by index with -d
+datasets = ['Murphy', 'JW_yesno', 'JW_PNAS', 'NatComm', 'MEG'] #'MEG_MEGsessions', 'Bharath_fMRI', 'Anke_2afc_sequential', 'Anke_MEG']
+
+def dataset_path(dataset):
+    # find path depending on location and dataset
+    usr = os.environ.get('USER', '')
+    if 'aeurai' in usr:
+        return os.path.realpath(os.path.expanduser('/nfs/aeurai/HDDM/%s'%dataset))
+    else:
+        return os.path.realpath(os.path.expanduser('~/Data/HDDM/%s'%dataset))
+
 # prepare link function for the regression models
 def z_link_func(x):
     return 1 / (1 + np.exp(-(x.values.ravel())))
@@ -0,0 +1,332 @@
+#!/usr/bin/env python
+# encoding: utf-8
+
+"""
+Particle swarm fits of the analytic DDM, a Python counterpart of
+analyticalDDM/DDM/FIT_regular_DDM_PSO.m, ML_from_fpts_regularDDM.m and
+particle_swarm/pso_Trelea_vectorized.m.
+
+The whole swarm is evaluated as one batched call to fpt_ddm.fpt_regular_ddm
+per condition, and subjects x restarts are fitted on a pool of worker
+processes. Parameter constraints use the strings of the MATLAB code, e.g.
+'fi_fr_fi_fr_wC': v, Ter, a and eta fixed across conditions ('fi') or free
+per condition ('fr'), with ('wC') or without ('nC') uniform contaminants.
+
+Run on the Data folder as
+    python pso_ddm.py -d Data/visual_motion_2afc.csv -c fi_fr_fi_fr_wC --split session -n 0
+
+MIT License
+Copyright (c) Anne Urai, 2018
+anne.urai@gmail.com
+"""
+
+import os, glob, multiprocessing
+import numpy as np
+import pandas as pd
+import fpt_ddm
+from contaminants import add_contaminants
+
+# settings of FIT_regular_DDM_PSO.m
+param_names = ['v', 'Ter', 'a', 'eta']
+ranges = {'v': (0.005, 0.8), 'Ter': (0.06, 0.9), 'a': (0.03, 0.6), 'eta': (0.0001, 0.7)}
+max_velocity = {'v': 0.05, 'Ter': 0.08, 'a': 0.03, 'eta': 0.03}
+# seed distributions [mean, sd], the mean of the DL and FR seeds of the MATLAB code
+seeds = {'v': (0.104, 0.04), 'Ter': (0.4125, 0.08), 'a': (0.13, 0.035), 'eta': (0.13, 0.035)}
+p_contaminants = 0.02 # default, a condition can set its own
+min_likelihood = 1e-10 # replaces zero likelihoods
+
+# ============================================ #
+# constraints and data
+# ============================================ #
+
+def parse_constraints(constraints, n_conditions=2):
+
+    """
+    Parameter layout for a constraint string such as 'fi_fr_fi_fr_wC'.
+    Returns (names, param_order, contaminants), with param_order 0 for
+    parameters shared by all conditions and c+1 for parameters of condition c.
+    """
+
+    parts = constraints.split('_')
+    if len(parts) != 5 or any(p not in ['fi', 'fr'] for p in parts[:4]) or parts[4] not in ['wC', 'nC']:
+        raise ValueError('Constraints should look like fi_fr_fi_fr_wC, not {}'.format(constraints))
+    names, param_order = [], []
+    for p, setting in zip(param_names, parts[:4]):
+        if setting == 'fi':
+            names.append(p)
+            param_order.append(0)
+        else:
+            for c in range(n_conditions):
+                names.append('{}_{}'.format(p, c))
+                param_order.append(c + 1)
+    return names, np.array(param_order), parts[4] == 'wC'
+
+def make_condition(rt, correct, deadline=None, rt_std=4, rt_thresh=5):
+
+    """
+    Data of one condition, with the RT trimming of FIT_regular_DDM_PSO.m.
+    With a deadline, RTs of 0 or above the deadline count as misses and the
+    densities run up to the deadline; without, outliers above mean+rt_std*sd
+    and above rt_thresh seconds are removed and densities run up to the
+    slowest RT. Observed RTs are stored as counts per ms.
+    """
+
+    rt = np.asarray(rt, dtype=float)
+    correct = np.asarray(correct, dtype=int)
+    n_miss = 0
+    if deadline is not None:
+        miss = (rt <= 0) | (rt > deadline)
+        n_miss = int(miss.sum())
+        rt, correct = rt[~miss], correct[~miss]
+        tmax = deadline
+    else:
+        keep = rt > 0
+        rt, correct = rt[keep], correct[keep]
+        keep = rt < rt.mean() + rt_std * rt.std(ddof=1)
+        rt, correct = rt[keep], correct[keep]
+        keep = rt < rt_thresh
+        rt, correct = rt[keep], correct[keep]
+        tmax = np.ceil(np.round(rt.max() * 1000, 6)) / 1000
+    n_ts = int(np.round(tmax * 1000)) + 1
+    bins = np.round(rt * 1000).astype(int)
+    return {'tmax': tmax, 'n_miss': n_miss, 'n_trials': rt.size + n_miss,
+        'min_rt': rt.min(), 'max_rt': rt.max(),
+        'counts_correct': np.bincount(bins[correct == 1], minlength=n_ts),
+        'counts_error': np.bincount(bins[correct == 0], minlength=n_ts)}
+
+# ============================================ #
+# likelihood, as in ML_from_fpts_regularDDM.m
+# ============================================ #
+
+def neg_log_likelihood(pos, conditions, param_order, contaminants=True):
+
+    """
+    Negative log likelihood of each row of pos (particles x parameters).
+    Observed RTs are matched to the density at the same ms (in the MATLAB
+    code, the lookup of error RTs has a misplaced bracket; this uses the
+    intended lookup). Contaminants are added at the rate of the
+    condition's 'p_contaminants', or at p_contaminants.
+    """
+
+    pos = np.atleast_2d(pos)
+    L = np.zeros(pos.shape[0])
+    for c, cond in enumerate(conditions):
+        pm = pos[:, (param_order == 0) | (param_order == c + 1)]
+        gC, gE, ts = fpt_ddm.fpt_regular_ddm(pm, cond['tmax'])
+        if contaminants:
+            add_contaminants(gC, gE, ts, cond['min_rt'], cond['max_rt'], cond.get('p_contaminants', p_contaminants))
+        if cond['n_miss'] > 0:
+            total = gC.sum(axis=1) + gE.sum(axis=1)
+            with np.errstate(invalid='ignore', divide='ignore'):
+                L += cond['n_miss'] * np.where(total < 1, -np.log(1 - total), -np.log(min_likelihood))
+        gC[~(gC > min_likelihood)] = min_likelihood # also replaces NaN
+        gE[~(gE > min_likelihood)] = min_likelihood
+        L -= np.log(gC).dot(cond['counts_correct']) + np.log(gE).dot(cond['counts_error'])
+    return L
+
+# ============================================ #
+# particle swarm, as in pso_Trelea_vectorized.m
+# ============================================ #
+
+def pso(objective, bounds, max_vel, seed_positions=None, n_particles=50, n_iterations=500,
+    ac1=1.6, ac2=1.9, iw1=0.9, iw2=0.4, iwe=400, ergrd=1e-25, ergrdep=250, rng=None, verbose=False):
+
+    """
+    Minimize objective (a function of a particles x dimensions array, returning
+    one value per particle) with the common PSO with linearly decreasing
+    inertia weight, velocity clamping and bouncing at the bounds, the settings
+    of FIT_regular_DDM_PSO.m. Stops after ergrdep iterations in which the
+    global best changed by at most ergrd.
+
+    bounds         = dimensions x 2 array of (min, max)
+    max_vel        = maximum velocity per dimension
+    seed_positions = initial positions of the first particles
+
+    Returns (best position, best value, global best per iteration).
+    """
+
+    if rng is None:
+        rng = np.random.default_rng()
+    bounds = np.asarray(bounds, dtype=float)
+    max_vel = np.asarray(max_vel, dtype=float)
+    n_dim = bounds.shape[0]
+
+    pos = bounds[:, 0] + rng.random((n_particles, n_dim)) * (bounds[:, 1] - bounds[:, 0])
+    if seed_positions is not None:
+        pos[:len(seed_positions)] = seed_positions
+    vel = -max_vel + rng.random((n_particles, n_dim)) * 2 * max_vel
+    out = objective(pos)
+    pbest, pbestval = pos.copy(), out.copy()
+    gbestval = np.min(pbestval)
+    gbest = pbest[np.argmin(pbestval)].copy()
+
+    trace = [gbestval]
+    n_unchanged = 0
+    for i in range(1, n_iterations + 1):
+
+        # move the particles
+        iwt = ((iw2 - iw1) / (iwe - 1)) * (i - 1) + iw1 if i <= iwe else iw2
+        vel = iwt * vel + ac1 * rng.random(pos.shape) * (pbest - pos) + \
+            ac2 * rng.random(pos.shape) * (gbest - pos)
+        vel = np.clip(vel, -max_vel, max_vel)
+        pos = pos + vel
+        outside = (pos <= bounds[:, 0]) | (pos >= bounds[:, 1])
+        pos = np.clip(pos, bounds[:, 0], bounds[:, 1])
+        vel[outside] = -vel[outside] # bounce
+
+        # update personal and global bests
+        out = objective(pos)
+        better = pbestval >= out
+        pbestval[better] = out[better]
+        pbest[better] = pos[better]
+        previous = gbestval
+        if gbestval >= np.min(pbestval):
+            gbestval = np.min(pbestval)
+            gbest = pbest[np.argmin(pbestval)].copy()
+        trace.append(gbestval)
+        if verbose and (i == 1 or i % 5 == 0):
+            print('PSO: {}/{} iterations, GBest = {}'.format(i, n_iterations, gbestval))
+
+        n_unchanged = n_unchanged + 1 if abs(previous - gbestval) <= ergrd else 0
+        if n_unchanged >= ergrdep:
+            break
+
+    return gbest, gbestval, np.array(trace)
+
+def seed_particles(names, n_seeded=25, rng=None):
+    # first particles drawn from realistic parameter distributions, as in FIT_regular_DDM_PSO.m
+    if rng is None:
+        rng = np.random.default_rng()
+    seeded = np.zeros((n_seeded, len(names)))
+    for i, name in enumerate(names):
+        p = name.split('_')[0]
+        seeded[:, i] = seeds[p][0] + rng.standard_normal(n_seeded) * seeds[p][1]
+        if p != 'Ter': # just in case there are any too-low values
+            seeded[:, i] = np.maximum(seeded[:, i], ranges[p][0])
+    return seeded
+
+# ============================================ #
+# fitting subjects
+# ============================================ #
+
+def fit(conditions, constraints='fi_fr_fi_fr_wC', n_particles=50, n_iterations=500, rng=None, verbose=False):
+
+    """
+    Fit one subject, conditions is a list of make_condition dicts.
+    Returns a dict with the best parameters by name, L (negative log
+    likelihood), AIC, BIC and the number of iterations.
+    """
+
+    names, param_order, contaminants = parse_constraints(constraints, len(conditions))
+    bounds = [ranges[name.split('_')[0]] for name in names]
+    max_vel = [max_velocity[name.split('_')[0]] for name in names]
+    objective = lambda pos: neg_log_likelihood(pos, conditions, param_order, contaminants)
+    best, L, trace = pso(objective, bounds, max_vel, seed_particles(names, rng=rng), n_particles,
+        n_iterations, rng=rng, verbose=verbose)
+    n_trials = sum(cond['n_trials'] for cond in conditions)
+    res = dict(zip(names, best))
+    res.update({'L': L, 'AIC': 2 * L + 2 * len(best), 'BIC': 2 * L + len(best) * np.log(n_trials),
+        'n_iterations': len(trace) - 1, 'constraints': constraints})
+    return res
+
+def fit_task(args):
+    # runs in the worker processes
+    subj_idx, conditions, constraints, restart, n_particles, n_iterations, entropy = args
+    rng = np.random.default_rng(np.random.SeedSequence(entropy, spawn_key=(int(subj_idx), restart)))
+    res = fit(conditions, constraints, n_particles, n_iterations, rng=rng)
+    res.update({'subj_idx': subj_idx, 'restart': restart})
+    return res
+
+def fit_subjects(data, constraints='fi_fr_fi_fr_wC', split=None, n_restarts=1, n_workers=1,
+    n_particles=50, n_iterations=500, seed=None, contaminant_rates=None):
+
+    """
+    Fit every subject in data (a DataFrame in the format of Data/*.csv), with
+    conditions given by the values of the column split (or a single
+    condition), n_restarts times each, on n_workers processes (None for one
+    per core). Returns a DataFrame with all fits and one with the best fit
+    per subject. contaminant_rates optionally maps subj_idx to a contaminant
+    rate for that subject, instead of p_contaminants.
+    """
+
+    entropy = np.random.SeedSequence(seed).entropy
+    if seed is None:
+        print('pso seed: {}'.format(entropy)) # pass this as seed to reproduce the fits
+    if 'correct' not in data.columns:
+        data = data.assign(correct=np.array((data.stimulus > 0) == (data.response > 0), dtype=int))
+
+    tasks = []
+    for subj_idx, subj_data in data.groupby('subj_idx'):
+        groups = [subj_data] if split is None else [g for _, g in subj_data.groupby(split)]
+        conditions = [make_condition(g.rt.values, g.correct.values) for g in groups]
+        if contaminant_rates is not None and subj_idx in contaminant_rates:
+            for cond in conditions:
+                cond['p_contaminants'] = float(contaminant_rates[subj_idx])
+        for restart in range(n_restarts):
+            tasks.append((subj_idx, conditions, constraints, restart, n_particles, n_iterations, entropy))
+
+    if n_workers == 1 or len(tasks) < 2:
+        results = [fit_task(task) for task in tasks]
+    else:
+        # fork, as in sim_sweep.py
+        if 'fork' in multiprocessing.get_all_start_methods():
+            pool = multiprocessing.get_context('fork').Pool(n_workers)
+        else:
+            pool = multiprocessing.Pool(n_workers)
+        try:
+            results = []
+            for res in pool.imap_unordered(fit_task, tasks):
+                print('subject {}, restart {}: L = {:.2f}'.format(res['subj_idx'], res['restart'], res['L']))
+                results.append(res)
+            pool.close()
+        finally:
+            pool.terminate()
+            pool.join()
+
+    fits = pd.DataFrame(results).sort_values(['subj_idx', 'restart'])
+    best = fits.loc[fits.groupby('subj_idx')['L'].idxmin()].reset_index(drop=True)
+    return fits, best
+
+if __name__ == '__main__':
+
+    from optparse import OptionParser
+    usage = "pso_ddm.py [options]"
+    parser = OptionParser ( usage)
+    parser.add_option ( "-d", "--data",
+            default = None,
+            type = "string",
+            help = "csv file to fit, all files in Data/ if not given" )
+    parser.add_option ( "-c", "--constraints",
+            default = 'fi_fr_fi_fr_wC',
+            type = "string",
+            help = "Parameter constraints, e.g. fi_fr_fi_fr_wC" )
+    parser.add_option ( "--split",
+            default = None,
+            type = "string",
+            help = "Column that defines the conditions, e.g. session" )
+    parser.add_option ( "-r", "--restarts",
+            default = 1,
+            type = "int",
+            help = "Number of PSO runs per subject, the best one is kept" )
+    parser.add_option ( "-n", "--n_workers",
+            default = 1,
+            type = "int",
+            help = "Number of worker processes, 0 for one per core" )
+    parser.add_option ( "-i", "--iterations",
+            default = 500,
+            type = "int",
+            help = "Maximum number of PSO iterations" )
+    parser.add_option ( "-s", "--seed",
+            default = None,
+            type = "int",
+            help = "Seed for the fits, printed when not given" )
+    opts, args = parser.parse_args()
+
+    datafiles = [opts.data] if opts.data else sorted(glob.glob(os.path.join('Data', '*.csv')))
+    for datafile in datafiles:
+        print(datafile)
+        fits, best = fit_subjects(pd.read_csv(datafile), opts.constraints, opts.split, opts.restarts,
+            opts.n_workers or None, n_iterations=opts.iterations, seed=opts.seed)
+        name = os.path.splitext(os.path.basename(datafile))[0]
+        fits.to_csv('pso_{}_{}_all.csv'.format(name, opts.constraints), index=False)
+        best.to_csv('pso_{}_{}.csv'.format(name, opts.constraints), index=False)
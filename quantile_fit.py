@@ -0,0 +1,336 @@
+#!/usr/bin/env python
+# encoding: utf-8
+
+"""
+Quantile (G-square) fits of the stimcoding models in hddm_models.py, as
+m_subj.optimize('gsquare') in b1_HDDM_run.py with runMe == 3, without
+recomputing anything from the data during the optimization.
+
+The observed RT quantiles and the number of trials between them, per
+subject, condition (stimulus and the levels of the depends_on columns) and
+response, are computed once into arrays (ObservedQuantiles). Per evaluation
+of the objective, the predicted mass between the quantiles comes from one
+call of fpt_ddm.defective_cdfs for all conditions of a subject, with the
+observed quantiles as the time points. As in the HDDM models, the predicted
+distributions are a mixture with p_outlier outliers (contaminants.py).
+
+As in HDDMStimCoding with split_param='v', the drift rate is v for stimulus
+1 and -v for stimulus 0, plus the drift criterion dc; z is the starting point
+as a fraction of a and noise has unit variance per second.
+
+MIT License
+Copyright (c) Anne Urai, 2018
+anne.urai@gmail.com
+"""
+
+import multiprocessing
+import numpy as np
+import pandas as pd
+from scipy.optimize import minimize
+import fpt_ddm
+import contaminants
+
+quantiles_default = (0.1, 0.3, 0.5, 0.7, 0.9)
+t_inf = 100. # decision time (s) at which the defective CDFs have reached the response probabilities
+p_outlier = 0.05 # as in make_model of hddm_models.py
+
+# depends_on of the stimcoding models in hddm_models.py; coherence (and transitionprob)
+# dependencies are added by get_depends_on, as in make_model
+model_specs = {'stimcoding_nohist': {},
+    'stimcoding_dc_prevresp': {'dc': ['prevresp']},
+    'stimcoding_z_prevresp': {'z': ['prevresp']},
+    'stimcoding_dc_z_prevresp': {'dc': ['prevresp'], 'z': ['prevresp']},
+    'stimcoding_dc_prevcorrect': {'dc': ['prevresp', 'prevcorrect']},
+    'stimcoding_z_prevcorrect': {'z': ['prevresp', 'prevcorrect']},
+    'stimcoding_dc_z_prevcorrect': {'dc': ['prevresp', 'prevcorrect'], 'z': ['prevresp', 'prevcorrect']},
+    'stimcoding_dc_z_prevresp_pharma': {'dc': ['prevresp', 'drug'], 'z': ['prevresp', 'drug']},
+    'stimcoding_dc_prevresp_sessions': {'dc': ['prevresp', 'session']},
+    'stimcoding_dc_z_prevresp_sessions': {'dc': ['prevresp', 'session'], 'z': ['prevresp', 'session']}}
+
+# parameter ranges of the optimization, t is also limited by the fastest RT
+bounds = {'v': (-10, 10), 'a': (0.3, 5), 't': (0, 1), 'sv': (0, 3), 'z': (0.05, 0.95), 'dc': (-5, 5)}
+# ranges of random starting values for restarts, t as a fraction of its maximum
+start_ranges = {'v': (0, 2.5), 'a': (0.8, 2.5), 't': (0.1, 0.9), 'sv': (0, 1.5), 'z': (0.3, 0.7), 'dc': (-1, 1)}
+
+# ============================================ #
+# data
+# ============================================ #
+
+def prepare(data, min_rt=0.25):
+    # as in runMe == 3 and recode_4stimcoding: remove superfast responses, stimulus 0/1, coherence
+    data = data[data.rt > min_rt].copy()
+    data['coherence'] = data.stimulus.abs()
+    data['stimulus'] = (data.stimulus > 0).astype(int)
+    if 'prevstim' in data.columns:
+        data['prevcorrect'] = (data.prevresp == data.prevstim).astype(int)
+    return data
+
+def get_depends_on(model_name, data):
+    if model_name not in model_specs:
+        raise ValueError('No quantile fit for {}, only for the stimcoding models without sz'.format(model_name))
+    depends_on = dict((k, list(v)) for k, v in model_specs[model_name].items())
+    if model_name.endswith(('_pharma', '_sessions')):
+        return depends_on
+    if 'transitionprob' in data.columns and model_name != 'stimcoding_nohist':
+        depends_on['v'] = ['coherence']
+        for k in ['dc', 'z']:
+            if k in depends_on:
+                depends_on[k].append('transitionprob')
+    elif len(data.coherence.unique()) > 1:
+        depends_on['v'] = ['coherence']
+    return depends_on
+
+class ObservedQuantiles(object):
+
+    """
+    Observed RT quantiles and bin counts, for each subject x condition
+    (rows) and response (0, 1):
+    edges  = rows x 2 x quantiles, the RT quantiles of each response; t_inf
+             for responses with fewer than min_trials trials, which then only
+             count with their number of trials
+    counts = rows x 2 x quantiles+1, number of trials between the edges
+    levels = DataFrame with subj_idx, stimulus and the depends_on columns per row
+    """
+
+    def __init__(self, data, columns=(), quantiles=quantiles_default, min_trials=10):
+        self.quantiles = np.asarray(quantiles, dtype=float)
+        self.columns = ['subj_idx', 'stimulus'] + sorted(set(columns))
+        n_q = self.quantiles.size
+        levels, edges, counts = [], [], []
+        for key, group in data.groupby(self.columns):
+            e = np.full((2, n_q), t_inf)
+            c = np.zeros((2, n_q + 1))
+            for resp in [0, 1]:
+                rt = np.sort(group.rt.values[group.response.values == resp])
+                if rt.size >= min_trials:
+                    e[resp] = np.quantile(rt, self.quantiles)
+                    c[resp] = np.diff(np.r_[0, np.searchsorted(rt, e[resp], side='right'), rt.size])
+                else:
+                    c[resp, 0] = rt.size
+            levels.append(key)
+            edges.append(e)
+            counts.append(c)
+        self.levels = pd.DataFrame(levels, columns=self.columns)
+        self.edges, self.counts = np.array(edges), np.array(counts)
+        self.n_trials = self.counts.sum(axis=(1, 2))
+
+    def rows(self, subj_idx):
+        return np.flatnonzero(self.levels.subj_idx.values == subj_idx)
+
+# ============================================ #
+# model
+# ============================================ #
+
+def level_name(param, values):
+    # HDDM-style node names, e.g. dc(1.0) or dc(1.0.0.8)
+    return '{}({})'.format(param, '.'.join(str(float(v)) for v in values))
+
+class QuantileModel(object):
+
+    """
+    G-square objective of one subject, for the conditions in the given rows
+    of an ObservedQuantiles. Free parameters are a, t, sv, and v, dc and z,
+    one per level of their depends_on columns. Predictions are mixed with a
+    fraction p_outlier of HDDM's outlier distribution.
+    """
+
+    def __init__(self, observed, rows, depends_on, p_outlier=p_outlier):
+        self.edges, self.counts = observed.edges[rows], observed.counts[rows]
+        levels = observed.levels.iloc[rows]
+        self.stim_sign = np.where(levels.stimulus.values > 0, 1., -1.)
+
+        # column of the parameter vector for each parameter and row
+        self.names = ['a', 't', 'sv']
+        self.index = {}
+        for param in ['v', 'dc', 'z']:
+            cols = depends_on.get(param, [])
+            if not cols:
+                self.index[param] = np.full(len(rows), len(self.names))
+                self.names.append(param)
+                continue
+            keys = [tuple(k) for k in levels[cols].values]
+            unique = sorted(set(keys))
+            self.index[param] = np.array([len(self.names) + unique.index(k) for k in keys])
+            self.names += [level_name(param, k) for k in unique]
+        self.bounds = [bounds[name.split('(')[0]] for name in self.names]
+
+        # the time points of the CDFs, both responses' quantiles and t_inf, per row
+        self.times = np.concatenate([self.edges.reshape(len(rows), -1), np.full((len(rows), 1), t_inf)], axis=1)
+        self.n_obs = self.counts.sum()
+        self.observed_p = self.counts / self.n_obs
+        self.row_p = self.counts.sum(axis=(1, 2)) / self.n_obs # each condition's share of the trials
+
+        # outlier CDF at the bin edges of predicted, from RT 0 to t_inf
+        self.p_outlier = p_outlier
+        rt = np.concatenate([np.zeros((len(rows), 2, 1)), self.edges, np.full((len(rows), 2, 1), t_inf)], axis=2)
+        self.outlier = contaminants.outlier_cdf(rt)
+
+    def parameters(self, x):
+        # per row: drift rate, a, z, t, sv
+        x = np.asarray(x, dtype=float)
+        drift = self.stim_sign * x[self.index['v']] + x[self.index['dc']]
+        return drift, x[0], x[self.index['z']], x[1], x[2]
+
+    def predicted(self, x):
+
+        """
+        Predicted probability of each bin (rows x response x bin): the
+        defective CDF of each response at its observed quantiles, from one
+        batched call. In the units of fpt_ddm (noise s = 0.1), all of v, a
+        and sv are scaled by 0.1.
+        """
+
+        drift, a, z, t, sv = self.parameters(x)
+        n_rows, n_q = self.edges.shape[0], self.edges.shape[2]
+        pm = np.column_stack([drift / 10., np.full(n_rows, t), np.full(n_rows, a / 10.), np.full(n_rows, sv / 10.),
+            z * a / 10.])
+        decision_time = self.times - t
+        positive = decision_time > 0
+        g_upper, g_lower = fpt_ddm.defective_cdfs(pm, np.where(positive, decision_time, 1.), s=0.1)
+        g_upper, g_lower = g_upper * positive, g_lower * positive
+
+        cdf = np.empty((n_rows, 2, n_q + 2))
+        cdf[:, :, 0] = 0
+        cdf[:, 0, 1:-1], cdf[:, 1, 1:-1] = g_lower[:, :n_q], g_upper[:, n_q:2 * n_q]
+        cdf[:, 0, -1], cdf[:, 1, -1] = g_lower[:, -1], g_upper[:, -1]
+        # quantiles of a response without enough trials are at t_inf
+        cdf[:, :, 1:-1] = np.minimum(cdf[:, :, 1:-1], cdf[:, :, -1:])
+        if self.p_outlier > 0:
+            contaminants.mix(cdf, self.outlier, self.p_outlier)
+        return np.diff(cdf, axis=2) * self.row_p[:, None, None]
+
+    def gsquare(self, x, min_p=1e-10):
+        pred = np.maximum(self.predicted(x), min_p)
+        obs = self.observed_p
+        with np.errstate(divide='ignore', invalid='ignore'):
+            terms = np.where(obs > 0, obs * np.log(obs / pred), 0)
+        return 2 * self.n_obs * terms.sum()
+
+    def log_likelihood(self, x, min_p=1e-10):
+        # multinomial log likelihood of the bin counts, without the constant
+        return np.sum(self.counts * np.log(np.maximum(self.predicted(x), min_p)))
+
+    def start(self, rng=None):
+        # starting values in the middle of the data, or random ones from start_ranges
+        x = np.zeros(len(self.names))
+        for i, name in enumerate(self.names):
+            param = name.split('(')[0]
+            if rng is None:
+                x[i] = {'a': 1.5, 't': 0.5, 'sv': 0.5, 'v': 1, 'dc': 0, 'z': 0.5}[param]
+            else:
+                x[i] = rng.uniform(*start_ranges[param])
+        x[1] *= self.max_t()
+        return x
+
+    def max_t(self):
+        # fastest observed quantile, the non-decision time has to stay below it
+        return min(bounds['t'][1], self.edges.min())
+
+    def fit(self, x0=None, method='Powell'):
+        if x0 is None:
+            x0 = self.start()
+        fit_bounds = list(self.bounds)
+        fit_bounds[1] = (bounds['t'][0], self.max_t())
+        lower, upper = np.array(fit_bounds).T
+        # the parameters are also clipped inside the objective: scipy < 1.5 ignores the bounds of Powell
+        res = minimize(lambda x: self.gsquare(np.clip(x, lower, upper)), np.clip(x0, lower, upper), method=method,
+            bounds=fit_bounds)
+        x = np.clip(res.x, lower, upper)
+        params = dict(zip(self.names, x))
+        ll = self.log_likelihood(x)
+        info = {'gsquare': self.gsquare(x), 'likelihood': ll, 'penalty': len(self.names) * np.log(self.n_obs),
+            'bic': -2 * ll + len(self.names) * np.log(self.n_obs)}
+        return params, info
+
+def fit_task(args):
+    # runs in the worker processes
+    subj_idx, model, restart, seed = args
+    rng = None
+    if restart > 0: # the first fit starts from the default values
+        rng = np.random.RandomState([seed, int(subj_idx), restart])
+    params, info = model.fit(model.start(rng))
+    return subj_idx, restart, params, info
+
+def iter_fits(data, model_name, quantiles=quantiles_default, min_trials=10, n_restarts=1, n_workers=1, seed=None,
+    outlier_rates=None):
+
+    """
+    Quantile fits of all subjects in data (as in Data/*.csv, before prepare),
+    n_restarts times each from random starting values, on n_workers
+    processes (None for one per core). Yields (subj_idx, params, info) of the
+    fit with the lowest G-square per subject, as soon as all its restarts
+    are done. outlier_rates optionally maps subj_idx to that subject's
+    p_outlier. The starting values of each restart only depend on seed,
+    subj_idx and the restart, so they are the same for any n_workers.
+    """
+
+    if seed is None:
+        seed = np.random.randint(2**31)
+        if n_restarts > 1:
+            print('restart seed: {}'.format(seed)) # pass this as seed to reproduce the fits
+    data = prepare(data)
+    depends_on = get_depends_on(model_name, data)
+    observed = ObservedQuantiles(data, sum(depends_on.values(), []), quantiles, min_trials)
+    tasks = []
+    for subj_idx in observed.levels.subj_idx.unique():
+        rate = p_outlier
+        if outlier_rates is not None and subj_idx in outlier_rates:
+            rate = float(outlier_rates[subj_idx])
+        model = QuantileModel(observed, observed.rows(subj_idx), depends_on, rate)
+        for restart in range(n_restarts):
+            tasks.append((subj_idx, model, restart, seed))
+
+    if n_workers == 1 or len(tasks) < 2:
+        pool = None
+        results = (fit_task(task) for task in tasks)
+    else:
+        pool = multiprocessing.Pool(n_workers)
+        results = pool.imap_unordered(fit_task, tasks)
+
+    try:
+        best, done = {}, {}
+        for subj_idx, restart, params, info in results:
+            if subj_idx not in best or info['gsquare'] < best[subj_idx][1]['gsquare']:
+                best[subj_idx] = (params, info)
+            done[subj_idx] = done.get(subj_idx, 0) + 1
+            if done[subj_idx] == n_restarts:
+                params, info = best.pop(subj_idx)
+                yield subj_idx, params, info
+        if pool is not None:
+            pool.close()
+    finally:
+        if pool is not None:
+            pool.terminate()
+            pool.join()
+
+def fit_subjects(data, model_name, quantiles=quantiles_default, min_trials=10, n_restarts=1, n_workers=1,
+    seed=None, outlier_rates=None):
+
+    """
+    Same as iter_fits, but returns (params, bic), DataFrames with one row per
+    subject (in order) as Gsquare.csv and BIC.csv of b1_HDDM_run.py
+    """
+
+    subj_params, bic = [], []
+    for subj_idx, params, info in iter_fits(data, model_name, quantiles, min_trials, n_restarts, n_workers, seed,
+        outlier_rates):
+        params.update({'subj_idx': subj_idx})
+        info.update({'subj_idx': subj_idx})
+        subj_params.append(params)
+        bic.append(info)
+    params, bic = pd.DataFrame(subj_params), pd.DataFrame(bic)
+    order = np.argsort(params.subj_idx.values, kind='stable')
+    return params.iloc[order].reset_index(drop=True), bic.iloc[order].reset_index(drop=True)
+
+if __name__ == '__main__':
+
+    import time
+    from sim_history import simulate_dataset
+
+    # recover the history biases of simulated data
+    df = simulate_dataset(n_subjects=6, n_trials=800, seed=1, v=1, a=1.4, t=0.3, sv=0.3,
+        dc_prevresp=0.4, z_prevresp=0.3)
+    starttime = time.time()
+    params, bic = fit_subjects(df, 'stimcoding_dc_z_prevresp', n_restarts=2, n_workers=2, seed=1)
+    print(params.round(3))
+    print('{:.1f} s per subject and restart'.format((time.time() - starttime) / len(params) / 2))
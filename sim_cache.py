@@ -0,0 +1,85 @@
+#!/usr/bin/env python
+# encoding: utf-8
+
+"""
+On-disk cache for simulated trials, so that figures can be remade without
+rerunning the simulations.
+
+Results are stored as .npz files named after a hash of everything that
+determines them: model variant, parameters, number of trials, seed and
+ddm_sim.engine_version. When the cache grows beyond max_bytes, the least
+recently used files are removed (file modification times are bumped on every
+hit, so they track use rather than creation).
+
+MIT License
+Copyright (c) Anne Urai, 2018
+anne.urai@gmail.com
+"""
+
+import os, json, hashlib
+import numpy as np
+import ddm_sim
+
+def cache_key(**params):
+    # hash of the parameters, independent of their order
+    params['engine_version'] = ddm_sim.engine_version
+    return hashlib.sha1(json.dumps(params, sort_keys=True).encode('utf-8')).hexdigest()
+
+class SimulationCache(object):
+
+    def __init__(self, path, max_bytes=2 * 1024**3):
+        self.path = path
+        self.max_bytes = max_bytes
+        if not os.path.exists(path):
+            os.makedirs(path)
+
+    def filename(self, key):
+        return os.path.join(self.path, '%s.npz'%key)
+
+    def has(self, key):
+        return os.path.isfile(self.filename(key))
+
+    def get(self, key):
+        # returns a dict of arrays, or None on a miss
+        try:
+            with np.load(self.filename(key)) as f:
+                arrays = dict((k, f[k]) for k in f.files)
+        except (IOError, OSError, ValueError):
+            return None
+        try:
+            os.utime(self.filename(key), None) # mark as recently used
+        except OSError:
+            pass
+        return arrays
+
+    def put(self, key, **arrays):
+        # write to a temporary file first, so that readers never see a half-written file
+        tmpname = os.path.join(self.path, '%s.%d.tmp.npz'%(key, os.getpid()))
+        np.savez(tmpname, **arrays)
+        os.rename(tmpname, self.filename(key))
+        self.evict()
+
+    def evict(self):
+        # remove least recently used files until the cache fits in max_bytes
+        files = []
+        for fl in os.listdir(self.path):
+            if fl.endswith('.npz') and not fl.endswith('.tmp.npz'):
+                try:
+                    st = os.stat(os.path.join(self.path, fl))
+                except OSError:
+                    continue # removed by another process
+                files.append((st.st_mtime, st.st_size, fl))
+        total = sum(f[1] for f in files)
+        for mtime, size, fl in sorted(files):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(os.path.join(self.path, fl))
+            except OSError:
+                pass
+            total -= size
+
+    def clear(self):
+        for fl in os.listdir(self.path):
+            if fl.endswith('.npz'):
+                os.remove(os.path.join(self.path, fl))
@@ -0,0 +1,85 @@
+#!/usr/bin/env python
+# encoding: utf-8
+
+"""
+Validation of the adaptive time steps in ddm_sim.simulate_adaptive against
+the fixed-step simulate: RT quantiles per response, choice probabilities and
+the number of updates per trial, for the sArray presets of
+sim_ddm_collapsing_bounds.py and a few slow, low-drift conditions.
+
+MIT License
+Copyright (c) Anne Urai, 2018
+anne.urai@gmail.com
+"""
+
+import time
+import numpy as np
+import ddm_sim as DDM
+
+conditions = [
+    {'v':0.7, 'dc': 0, 'z':0.5, 'a':1.8, 'model':'DDM'},
+    {'v':0.7, 'dc': 0, 'z':0.625, 'a':1.8, 'model':'DDM'},
+    {'v':0.7, 'dc': 0.3, 'z':0.5, 'a':1.8, 'model':'DDM2'},
+    {'v':0.7, 'dc': 0.3, 'z':0.5, 'a':1.8, 'model':'DDM3'},
+    {'v':0.1, 'dc': 0, 'z':0.5, 'a':3.0, 'model':'DDM'},
+    {'v':0, 'dc': 0, 'z':0.5, 'a':3.0, 'model':'DDM'},
+    {'v':0.1, 'dc': 0, 'z':0.5, 'a':3.0, 'model':'DDM', 'dt':0.001},
+    {'v':0.7, 'dc': 0.3, 'z':0.5, 'a':1.8, 'model':'DDM2', 'dt':0.001},
+    ]
+quantiles = [0.1, 0.3, 0.5, 0.7, 0.9]
+
+def quantile_diff(rt_a, resp_a, rt_b, resp_b):
+    # largest difference in RT quantiles per response, relative to the interquartile range of rt_a
+    iqr = np.subtract(*np.percentile(rt_a, [75, 25]))
+    max_diff = 0
+    for resp in [0, 1]:
+        if (resp_a == resp).sum() > 100 and (resp_b == resp).sum() > 100:
+            q_a = np.quantile(rt_a[resp_a == resp], quantiles)
+            q_b = np.quantile(rt_b[resp_b == resp], quantiles)
+            max_diff = max(max_diff, np.abs(q_a - q_b).max() / iqr)
+    return max_diff
+
+def compare(cond, nr_trials=20000, tol=1e-3, seed=0):
+
+    """
+    Compare the adaptive RTs to the fixed-step RTs, and to a second
+    fixed-step run with another seed as a measure of the sampling noise.
+    Returns the quantile and P(response=1) differences of both, the ratio of
+    updates per trial and the wall-clock run times.
+    """
+
+    params = dict((k, cond[k]) for k in ['v', 'a', 'z', 'dc', 'dt'] if k in cond)
+    res = {}
+    for name, method, s in [('fixed', 'euler', seed), ('noise', 'euler', seed + 1), ('adaptive', 'adaptive', seed)]:
+        starttime = time.time()
+        rt, response = DDM.models[cond['model']](stim=1, nr_trials=nr_trials, method=method, tol=tol,
+            rng=np.random.default_rng(s), **params)
+        res[name] = (rt, response, time.time() - starttime)
+
+    # number of updates per trial, from the engine itself
+    drift, bounds = {'DDM': (cond['v'] + cond['dc'], None),
+        'DDM2': (cond['v'], DDM.shifting_bounds(cond['a'], cond['dc'])),
+        'DDM3': (cond['v'], DDM.shifting_upper_bound(cond['a'], cond['dc']))}[cond['model']]
+    updates = DDM.simulate_adaptive(drift, cond['a'], cond['z'], bounds=bounds, nr_trials=nr_trials,
+        dt=cond.get('dt', 0.01), tol=tol, rng=np.random.default_rng(seed), return_updates=True)[2]
+
+    rt_fixed, resp_fixed = res['fixed'][:2]
+    return {'quantile_diff': quantile_diff(rt_fixed, resp_fixed, *res['adaptive'][:2]),
+        'noise_quantile_diff': quantile_diff(rt_fixed, resp_fixed, *res['noise'][:2]),
+        'choice_diff': res['adaptive'][1].mean() - resp_fixed.mean(),
+        'noise_choice_diff': res['noise'][1].mean() - resp_fixed.mean(),
+        'step_ratio': (rt_fixed + 1).mean() / updates.mean(),
+        'time_fixed': res['fixed'][2], 'time_adaptive': res['adaptive'][2]}
+
+if __name__ == '__main__':
+
+    # differences between two fixed-step runs with different seeds are given in brackets
+    print('%-4s %-5s %5s %5s %6s %20s %20s %11s %10s %10s %9s' %('cond', 'model', 'v', 'a', 'dt',
+        'quantile diff', 'choice diff', 'step ratio', 'fixed (s)', 'adapt (s)', 'speedup'))
+    for c, cond in enumerate(conditions):
+        res = compare(cond)
+        print('%-4d %-5s %5.2f %5.2f %6.3f %11.3f (%6.3f) %11.4f (%6.4f) %11.2f %10.3f %10.3f %9.2f' %(c, cond['model'],
+            cond['v'], cond['a'], cond.get('dt', 0.01), res['quantile_diff'], res['noise_quantile_diff'],
+            res['choice_diff'], res['noise_choice_diff'], res['step_ratio'], res['time_fixed'],
+            res['time_adaptive'], res['time_fixed'] / res['time_adaptive']))
+    print('step ratio = fewer updates per trial, speedup = wall-clock gain; each update costs more than a fixed step')
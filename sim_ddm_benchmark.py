@@ -0,0 +1,114 @@
+#!/usr/bin/env python
+# encoding: utf-8
+
+"""
+Per-step cost of the simulators for the sArray presets of
+sim_ddm_collapsing_bounds.py, and for two presets with few trials. Compares
+the original one-trial-at-a-time loop, the ddm_sim engine with one rng call
+per step, and the ddm_sim engine as it is, which draws its noise in
+pre-allocated blocks (NoiseBlock). The two speedups separate the gains:
+nearly all of it comes from simulating the trials in lock-step as one array
+(20x with 1000 trials, ~60x with 100000). Blocks only save the overhead of an
+rng call, which matters when few trials are active: ~1.15x with 100 or 1000
+trials (presets 5-6), and no gain (0.85-1.0x) with 10000 trials or more.
+
+MIT License
+Copyright (c) Anne Urai, 2018
+anne.urai@gmail.com
+"""
+
+import time
+import numpy as np
+import ddm_sim as DDM
+
+sArray = [
+    {'v':0.7, 'dc': 0, 'z':0.5, 'a':1.8, 'nr_trials':100000, 'model':'DDM'},
+    {'v':0.7, 'dc': 0, 'z':0.625, 'a':1.8, 'nr_trials':10000, 'model':'DDM'},
+    {'v':0.7, 'dc': 0.3, 'z':0.5, 'a':1.8, 'nr_trials':100000, 'model':'DDM'},
+    {'v':0.7, 'dc': 0.3, 'z':0.5, 'a':1.8, 'nr_trials':100000, 'model':'DDM2'},
+    {'v':0.7, 'dc': 0.3, 'z':0.5, 'a':1.8, 'nr_trials':100000, 'model':'DDM3'},
+    {'v':0.7, 'dc': 0, 'z':0.5, 'a':1.8, 'nr_trials':1000, 'model':'DDM'},
+    {'v':0.7, 'dc': 0, 'z':0.5, 'a':1.8, 'nr_trials':100, 'model':'DDM'},
+    ]
+n_repeats = 3 # the fastest of n_repeats runs is reported
+n_scalar = 2000 # the original loop is only run on a subset of trials
+
+# ============================================ #
+# reference implementations
+# ============================================ #
+
+def scalar_loop(v, a, z, dc, model, nr_trials=1000, dt=0.01):
+    # the original DDM/DDM2/DDM3 loops for stim=1, one trial and one np.random call at a time
+    rt = np.zeros(nr_trials)
+    response = np.zeros(nr_trials)
+    for t in range(nr_trials):
+        time = 0
+        dv = z * a
+        bound1 = a
+        bound2 = 0
+        while True:
+            noise = np.random.normal(0,1) / np.sqrt(0.01)
+            if model == 'DDM':
+                delta = (v + dc + noise) * dt
+            else:
+                delta = (v + noise) * dt
+            dv += delta
+            if model != 'DDM':
+                bound1 = bound1 - (dc * dt)
+            if model == 'DDM2':
+                bound2 = bound2 - (dc * dt)
+            if dv >= bound1:
+                rt[t] = time
+                response[t] = 1
+                break
+            elif dv <= bound2:
+                rt[t] = time
+                response[t] = 0
+                break
+            time += 1
+    return(rt, response)
+
+class PerStepNoise(DDM.NoiseBlock):
+    # one rng call per step, for the active trials only
+    def draw(self, n):
+        return self.rng.standard_normal(n)
+
+def lockstep_per_step_rng(model, **params):
+    # the ddm_sim engine, with NoiseBlock replaced by one rng call per step
+    noise_block = DDM.NoiseBlock
+    DDM.NoiseBlock = PerStepNoise
+    try:
+        return DDM.models[model](method='euler', **params)
+    finally:
+        DDM.NoiseBlock = noise_block
+
+def per_step_cost(fun, nr_trials, seed=None, **params):
+    # seconds per simulated trial-step, the fastest of n_repeats runs
+    costs = []
+    for repeat in range(n_repeats):
+        if seed is not None:
+            params['rng'] = np.random.default_rng(seed)
+        starttime = time.time()
+        rt, response = fun(nr_trials=nr_trials, **params)
+        costs.append((time.time() - starttime) / np.sum(rt + 1))
+    return min(costs)
+
+# ============================================ #
+# run the benchmark
+# ============================================ #
+
+if __name__ == '__main__':
+
+    print('%-6s %-5s %10s %12s %14s %12s %12s %12s' %('preset', 'model', 'nr_trials', 'scalar (ns)',
+        'per-step (ns)', 'blocks (ns)', 'lock-step x', 'blocks x'))
+    for s, preset in enumerate(sArray):
+        params = dict((k, preset[k]) for k in ['v', 'a', 'z', 'dc'])
+        t_scalar = per_step_cost(scalar_loop, min(n_scalar, preset['nr_trials']), model=preset['model'], **params)
+        t_step = per_step_cost(lockstep_per_step_rng, preset['nr_trials'], seed=s, model=preset['model'],
+            stim=1, **params)
+        t_block = per_step_cost(DDM.models[preset['model']], preset['nr_trials'], seed=s, stim=1,
+            method='euler', **params)
+        print('%-6d %-5s %10d %12.1f %14.1f %12.1f %12.1f %12.2f' %(s, preset['model'], preset['nr_trials'],
+            t_scalar * 1e9, t_step * 1e9, t_block * 1e9, t_scalar / t_step, t_step / t_block))
+    print('lock-step x = scalar / per-step, the gain of simulating all trials as one array')
+    print('blocks x    = per-step / blocks, the gain of drawing the noise in blocks')
@@ -12,6 +12,53 @@ import pandas as pd
 import bottleneck as bn
 from IPython import embed as shell
 
+import ddm_sim as DDM # vectorized simulators, see ddm_sim.py
+from sim_store import SimulationStore
+from sim_sweep import iter_sweep
+from sim_summary import RTSummary
+from sim_cache import SimulationCache
+
+# ============================================ #
+# parse input arguments
+# ============================================ #
+
+from optparse import OptionParser
+usage = "sim_ddm_collapsing_bounds.py [options]"
+parser = OptionParser ( usage)
+parser.add_option ( "-s", "--stream",
+        action = "store_true",
+        default = False,
+        help = "Write the simulations chunk by chunk to a binary store instead of df.csv" )
+parser.add_option ( "-c", "--chunk_size",
+        default = 100000,
+        type = "int",
+        help = "Number of trials simulated at once" )
+parser.add_option ( "-o", "--output",
+        default = 'sims',
+        type = "string",
+        help = "Folder for the binary store in streaming mode" )
+parser.add_option ( "-n", "--n_workers",
+        default = 1,
+        type = "int",
+        help = "Number of worker processes, 0 for one per core" )
+parser.add_option ( "-r", "--seed",
+        default = None,
+        type = "int",
+        help = "Seed for the simulations, printed when not given" )
+parser.add_option ( "--cache",
+        default = None,
+        type = "string",
+        help = "Folder to cache simulations in, only used together with a seed" )
+parser.add_option ( "--cache_size",
+        default = 2048,
+        type = "int",
+        help = "Maximum size of the cache in MB" )
+parser.add_option ( "-q", "--summary_only",
+        action = "store_true",
+        default = False,
+        help = "Only keep the summaries needed for the figures, do not write df.csv" )
+opts, args = parser.parse_args()
+
 sns.set(style='ticks', font='Arial', font_scale=1, rc={
     'axes.linewidth': 0.25, 
     'axes.labelsize': 7, 
@@ -27,142 +74,6 @@ sns.set(style='ticks', font='Arial', font_scale=1, rc={
     'ytick.color':'Black',} )
 sns.plotting_context()
 
-def DDM(v=1, a=1, z=0.5, dc=0, stim=0, nr_trials=1000, dt=0.01, verbose=False):
-    
-    """
-    DDM
-    """
-    
-    # Setup all variables:
-    rt = np.zeros(nr_trials)
-    response = np.zeros(nr_trials)
-    
-    # Run the traces:
-    for t in range(nr_trials):
-        time = 0
-        dv = z * a
-        # trace = []
-        while True:
-            if verbose:
-                print('dt: {}'.format(dt))
-            
-            # update dv:
-            noise = np.random.normal(0,1) / np.sqrt(0.01)
-            if stim == 1:
-                delta = (v + dc + noise) * dt
-            else:
-                delta = (-v + dc + noise) * dt
-            dv += delta
-            
-            # Check if one of the thresholds is crossed:
-            if dv >= a:
-                rt[t] = time
-                response[t] = 1
-                break
-            elif dv <= 0:
-                rt[t] = time
-                response[t] = 0
-                break
-            
-            # update time:
-            time += 1
-            
-    return(rt, response)
-def DDM2(v=1, a=1, z=0.5, dc=0, stim=0, nr_trials=1000, dt=0.01, verbose=False):
-    
-    """
-    DDM
-    """
-    
-    # Setup all variables:
-    rt = np.zeros(nr_trials)
-    response = np.zeros(nr_trials)
-    
-    # Run the traces:
-    for t in range(nr_trials):
-        time = 0
-        dv = z * a
-        bound1 = a
-        bound2 = 0
-        # trace = []
-        while True:
-            if verbose:
-                print('dt: {}'.format(dt))
-            
-            # update dv:
-            noise = np.random.normal(0,1) / np.sqrt(0.01)
-            if stim == 1:
-                delta = (v + noise) * dt
-            else:
-                delta = (-v + noise) * dt
-            dv += delta
-            
-            # update bounds:
-            bound1 = bound1 - (dc * dt)
-            bound2 = bound2 - (dc * dt)
-            
-            # Check if one of the thresholds is crossed:
-            if dv >= bound1:
-                rt[t] = time
-                response[t] = 1
-                break
-            elif dv <= bound2:
-                rt[t] = time
-                response[t] = 0
-                break
-            
-            # update time:
-            time += 1
-            
-    return(rt, response)
-def DDM3(v=1, a=1, z=0.5, dc=0, stim=0, nr_trials=1000, dt=0.01, verbose=False):
-    
-    """
-    DDM
-    """
-    
-    # Setup all variables:
-    rt = np.zeros(nr_trials)
-    response = np.zeros(nr_trials)
-    
-    # Run the traces:
-    for t in range(nr_trials):
-        time = 0
-        dv = z * a
-        bound1 = a
-        bound2 = 0
-        # trace = []
-        while True:
-            if verbose:
-                print('dt: {}'.format(dt))
-            
-            # update dv:
-            noise = np.random.normal(0,1) / np.sqrt(0.01)
-            if stim == 1:
-                delta = (v + noise) * dt
-            else:
-                delta = (-v + noise) * dt
-            dv += delta
-            
-            # update bounds:
-            bound1 = bound1 - (dc * dt)
-            # bound2 = bound2 - (dc * dt)
-            
-            # Check if one of the thresholds is crossed:
-            if dv >= bound1:
-                rt[t] = time
-                response[t] = 1
-                break
-            elif dv <= bound2:
-                rt[t] = time
-                response[t] = 0
-                break
-            
-            # update time:
-            time += 1
-            
-    return(rt, response)
-
 sArray = [
     {'v':0.7, 'dc': 0, 'z':0.5, 'a':1.8, 'nr_trials':100000},
     {'v':0.7, 'dc': 0, 'z':0.625, 'a':1.8, 'nr_trials':10000},
@@ -171,59 +82,82 @@ sArray = [
     {'v':0.7, 'dc': 0.3, 'z':0.5, 'a':1.8, 'nr_trials':100000},
     ]
 
-dfs = []
-for s in range(len(sArray)):
-    print(s)
-    rt = []
-    response = []
-    stimulus = []
-    for stim in [0,1]:
-        
-        if s < 3:
-            rt_dum, response_dum = DDM.DDM(v=sArray[s]['v'], a=sArray[s]['a'], z=sArray[s]['z'], dc=sArray[s]['dc'], stim=stim, nr_trials=sArray[s]['nr_trials'], verbose=False)
-        elif s == 3:
-            rt_dum, response_dum = DDM.DDM2(v=sArray[s]['v'], a=sArray[s]['a'], z=sArray[s]['z'], dc=sArray[s]['dc'], stim=stim, nr_trials=sArray[s]['nr_trials'], verbose=False)
-        elif s == 4:
-            rt_dum, response_dum = DDM.DDM3(v=sArray[s]['v'], a=sArray[s]['a'], z=sArray[s]['z'], dc=sArray[s]['dc'], stim=stim, nr_trials=sArray[s]['nr_trials'], verbose=False)
-        rt.append(rt_dum)
-        response.append(response_dum)
-        stimulus.append(np.ones(sArray[s]['nr_trials']) * stim)
-        
-    df = pd.DataFrame()
-    df.loc[:,'rt'] = (np.concatenate(rt) + 200) / 1000.0
-    df.loc[:,'response'] = np.concatenate(response)
-    df.loc[:,'stimulus'] = np.concatenate(stimulus)
-    df.loc[:,'correct'] = np.array(np.concatenate(stimulus) == np.concatenate(response), dtype=int)
-    df.loc[:,'subj_idx'] = s
-    dfs.append(df)
-df = pd.concat(dfs)
-df.to_csv('df.csv')
+def get_model(s):
+    if s < 3:
+        return DDM.DDM
+    elif s == 3:
+        return DDM.DDM2
+    elif s == 4:
+        return DDM.DDM3
+
+conditions = [dict(sArray[s], model=get_model(s).__name__) for s in range(len(sArray))]
+n_workers = opts.n_workers or None
+cache = None
+if opts.cache is not None:
+    cache = SimulationCache(opts.cache, max_bytes=opts.cache_size * 1024**2)
+
+# ============================================ #
+# simulate in chunks, summarize each chunk as it comes in
+# ============================================ #
+
+summaries = dict((s, RTSummary()) for s in range(len(sArray)))
+if opts.stream:
+    store = SimulationStore(opts.output)
+elif not opts.summary_only:
+    trials = dict((s, []) for s in range(len(sArray)))
+for s, stim, rt_dum, response_dum in iter_sweep(conditions, opts.seed, n_workers, opts.chunk_size, cache):
+    rt = (rt_dum + 200) / 1000.0
+    stimulus = np.ones(len(rt_dum)) * stim
+    summaries[s].update(rt, response_dum, stimulus)
+    if opts.stream:
+        if not store.conditions or store.conditions[-1]['subj_idx'] != s:
+            print(s)
+            store.add_condition(s, **conditions[s])
+        store.append(rt, response_dum, stimulus)
+    elif not opts.summary_only:
+        trials[s].append((rt, response_dum, stimulus))
+if opts.stream:
+    store.close()
+elif not opts.summary_only:
+    dfs = []
+    for s in range(len(sArray)):
+        rt, response, stimulus = [np.concatenate(x) for x in zip(*trials[s])]
+        df = pd.DataFrame()
+        df.loc[:,'rt'] = rt
+        df.loc[:,'response'] = response
+        df.loc[:,'stimulus'] = stimulus
+        df.loc[:,'correct'] = np.array(stimulus == response, dtype=int)
+        df.loc[:,'subj_idx'] = s
+        dfs.append(df)
+    df = pd.concat(dfs)
+    df.to_csv('df.csv')
+
+# reference lines for the conditional accuracy/response plots
+mean_correct = summaries[0].mean('correct')
+mean_response = summaries[0].mean('response')
+quantiles = [0, 0.1, 0.3, 0.5, 0.7, 0.9, 1]
 
 fig = plt.figure(figsize=(8,6))
 plt_nr = 1
 for s in range(len(sArray)):
     
-    data_subj = df.query('subj_idx == {}'.format(s)).copy()
-    
     # rt distributions:
     ax = fig.add_subplot(3,5,plt_nr)
-    ax.hist(data_subj.loc[(data_subj.response==0), 'rt'], alpha=0.5, bins=40)
-    ax.hist(data_subj.loc[(data_subj.response==1), 'rt'], alpha=0.5, bins=40)
+    for response in [0, 1]:
+        counts, edges = summaries[s].histogram(response, bins=40)
+        ax.hist(edges[:-1], bins=edges, weights=counts, alpha=0.5)
     ax.set_xlim(0,0.8)
-    ax.set_title('choice={}; correct={}'.format(round(data_subj.loc[:, 'response'].mean(), 3), round(data_subj.loc[:, 'correct'].mean(), 3)))
+    ax.set_title('choice={}; correct={}'.format(round(summaries[s].mean('response'), 3), round(summaries[s].mean('correct'), 3)))
     ax.set_xlabel('RT (s)')
     plt_nr += 1
     
 for s in range(len(sArray)):
     
-    data_subj = df.query('subj_idx == {}'.format(s)).copy()
-    
     # condition accuracy plots:
-    quantiles = [0, 0.1, 0.3, 0.5, 0.7, 0.9, 1]
+    rt_bin, correct_bin, response_bin = summaries[s].conditional(quantiles)
     ax = fig.add_subplot(3,5,plt_nr)
-    plt.axhline(df.loc[df.subj_idx==0, 'correct'].mean(), lw=0.5, color='k')
-    data_subj.loc[:,'rt_bin'] = pd.qcut(data_subj['rt'], quantiles, labels=False)
-    ax.plot(np.array(data_subj.groupby('rt_bin').mean()['rt']), np.array(data_subj.groupby('rt_bin').mean()['correct']))
+    plt.axhline(mean_correct, lw=0.5, color='k')
+    ax.plot(rt_bin, correct_bin)
     ax.set_xlim(0.2,0.45)
     ax.set_ylim(0.50, 1)
     ax.set_title('Conditional accuracy')
@@ -232,13 +166,11 @@ for s in range(len(sArray)):
     
 for s in range(len(sArray)):
 
-    data_subj = df.query('subj_idx == {}'.format(s)).copy()
-    
     # condition accuracy plots:
+    rt_bin, correct_bin, response_bin = summaries[s].conditional(quantiles)
     ax = fig.add_subplot(3,5,plt_nr)
-    data_subj.loc[:,'rt_bin'] = pd.qcut(data_subj['rt'], quantiles, labels=False)
-    plt.axhline(df.loc[df.subj_idx==0, 'response'].mean(), lw=0.5, color='k')
-    ax.plot(np.array(data_subj.groupby('rt_bin').mean()['rt']), np.array(data_subj.groupby('rt_bin').mean()['response']))
+    plt.axhline(mean_response, lw=0.5, color='k')
+    ax.plot(rt_bin, response_bin)
     ax.set_xlim(0.2,0.45)
     ax.set_ylim(0.25,0.75)
     ax.set_title('Conditional response')
@@ -0,0 +1,293 @@
+#!/usr/bin/env python
+# encoding: utf-8
+
+"""
+Closed-loop simulations of choice history biases: the starting point and
+drift bias on each trial depend on the simulated responses, stimuli,
+correctness and RTs of the preceding trials, and their interactions (e.g.
+prevresp:prevrt), as in the regression models of hddm_models.py. History
+weights can differ per transition probability, as C(transitionprob) terms.
+prevpupil is an external N(0, 1) covariate, the simulation has no pupil.
+
+All sessions are simulated in lock-step. Every Euler step updates the
+decision variable of the current trial of every session as one array; when a
+session's trial hits a bound, its next trial starts right away with a drift
+bias and starting point computed from its own history. So there is no loop
+over trials or subjects, only over time steps.
+
+The output has the same columns as Data/*.csv: stimulus coded -1/1, response
+0/1, prevresp/prevstim coded -1/1 and prevrt the z-scored log RT within each
+subject and session, plus prevcorrect (0/1), and transitionprob and
+prevpupil when they are simulated. During the simulation, prevrt is z-scored
+with the mean and sd of the session's trials so far.
+
+MIT License
+Copyright (c) Anne Urai, 2018
+anne.urai@gmail.com
+"""
+
+import numpy as np
+import pandas as pd
+from ddm_sim import NoiseBlock
+
+# history regressors, with the lag and the variable they are computed from
+regressors = {'prevresp': (1, 'response'), 'prev2resp': (2, 'response'), 'prev3resp': (3, 'response'),
+    'prevstim': (1, 'stimulus'), 'prev2stim': (2, 'stimulus'), 'prev3stim': (3, 'stimulus'),
+    'prevrt': (1, 'rt'), 'prev2rt': (2, 'rt'), 'prev3rt': (3, 'rt'),
+    'prevcorrect': (1, 'correct'), 'prevpupil': (1, 'pupil')}
+
+def logit(p):
+    return np.log(p / (1 - p))
+
+def z_link_func(x):
+    # same as in hddm_models.py, maps the z regression onto (0, 1)
+    return 1 / (1 + np.exp(-x))
+
+def history_term(name):
+    # (dc or z, [regressors]) of a history weight such as dc_prevresp:prevrt, None for other parameters
+    if '_' not in name:
+        return None
+    which, term = name.split('_', 1)
+    if which not in ['dc', 'z'] or not all(regr in regressors for regr in term.split(':')):
+        return None
+    return which, term.split(':')
+
+def subject_params(n_subjects, **params):
+
+    """
+    Per-subject parameters as arrays of length n_subjects.
+    v, a, t     = drift rate (scaled by stimulus -1/1), boundary separation, non-decision time
+    z           = starting point as a fraction of a, before history effects
+    dc          = drift bias, before history effects
+    sv          = between-trial drift rate variability
+    dc_<regr>, z_<regr> = history weights for each of the regressors above,
+                  added to the drift bias and to logit(z), respectively;
+                  dc_<regr>:<regr> etc. weigh the product of the regressors
+    Scalars are used for all subjects.
+    """
+
+    defaults = {'v': 1, 'a': 1.5, 't': 0.3, 'z': 0.5, 'dc': 0, 'sv': 0}
+    for k in params:
+        if k not in defaults and history_term(k) is None:
+            raise ValueError('Unknown parameter {}'.format(k))
+    defaults.update(params)
+    return dict((k, np.ones(n_subjects) * p) for k, p in defaults.items())
+
+def make_stimuli(n_sessions, n_trials, p_repeat=0.5, rng=None):
+    # stimulus sequences coded -1/1, repeating the previous stimulus with probability p_repeat
+    # (a scalar, or an n_sessions x 1 array)
+    if rng is None:
+        rng = np.random.default_rng()
+    first = np.where(rng.random((n_sessions, 1)) < 0.5, -1, 1)
+    flips = np.where(rng.random((n_sessions, n_trials - 1)) < p_repeat, 1, -1)
+    return np.cumprod(np.hstack([first, flips]), axis=1)
+
+def simulate_sessions(params, stimuli, dt=0.001, rng=None, noise_block=2**20, pupil=None):
+
+    """
+    Simulate one session per row of stimuli (n_sessions x n_trials, -1/1),
+    with params a dict of arrays of length n_sessions (see subject_params).
+    pupil (n_sessions x n_trials) is only needed for prevpupil weights.
+    Noise has unit variance per second, as in HDDM.
+
+    Returns (rt, response), both n_sessions x n_trials, rt in seconds
+    including the non-decision time.
+    """
+
+    if rng is None:
+        rng = np.random.default_rng()
+    n_sessions, n_trials = stimuli.shape
+    noise = NoiseBlock(rng, min(noise_block, 16 * n_sessions))
+    history = [(k, history_term(k)) for k in params if history_term(k) is not None]
+    if pupil is None and any('prevpupil' in term for k, (which, term) in history):
+        raise ValueError('prevpupil weights need a pupil covariate')
+
+    rt = np.zeros((n_sessions, n_trials))
+    response = np.zeros((n_sessions, n_trials))
+    stim_sign = np.asarray(stimuli, dtype=float)
+    resp_sign = np.zeros((n_sessions, n_trials)) # response coded -1/1
+    logrt = np.zeros((n_sessions, n_trials))
+    logrt_sum = np.zeros(n_sessions) # running sums of the log RTs of each session
+    logrt_sq = np.zeros(n_sessions)
+
+    def past(regr, sessions, trials):
+        # regressor of the given trials, 0 at the start of a session
+        lag, var = regressors[regr]
+        prev = np.maximum(trials - lag, 0)
+        if var == 'response':
+            value = resp_sign[sessions, prev]
+        elif var == 'stimulus':
+            value = stim_sign[sessions, prev]
+        elif var == 'correct':
+            value = np.asarray(resp_sign[sessions, prev] == stim_sign[sessions, prev], dtype=float)
+        elif var == 'pupil':
+            value = pupil[sessions, prev]
+        else: # log RT, z-scored with the trials of the session so far
+            n = np.maximum(trials, 1)
+            mean = logrt_sum[sessions] / n
+            sd = np.sqrt(np.maximum(logrt_sq[sessions] / n - mean ** 2, 0))
+            value = np.where(sd > 0, (logrt[sessions, prev] - mean) / np.where(sd > 0, sd, 1), 0)
+        return np.where(trials >= lag, value, 0)
+
+    def start_trials(sessions, trials):
+        # drift and starting point of the given trials, from the history so far
+        drift = params['v'][sessions] * stim_sign[sessions, trials] + params['dc'][sessions]
+        z = logit(params['z'][sessions])
+        for k, (which, term) in history:
+            value = params[k][sessions]
+            for regr in term:
+                value = value * past(regr, sessions, trials)
+            if which == 'dc':
+                drift = drift + value
+            else:
+                z = z + value
+        drift = drift + params['sv'][sessions] * rng.standard_normal(sessions.size)
+        return drift * dt, z_link_func(z) * params['a'][sessions]
+
+    # state of the current trial of each active session
+    active = np.arange(n_sessions)
+    trial = np.zeros(n_sessions, dtype=int)
+    steps = np.zeros(n_sessions, dtype=int)
+    drift_step, dv = start_trials(active, trial)
+    bound = params['a'].copy()
+    noise_step = np.sqrt(dt)
+
+    while active.size > 0:
+
+        # update dv:
+        eps = noise.draw(active.size)
+        eps *= noise_step
+        dv += eps
+        dv += drift_step
+        steps += 1
+
+        # Check if one of the thresholds is crossed:
+        upper = dv >= bound
+        done = np.flatnonzero(upper | (dv <= 0))
+        if done.size == 0:
+            continue
+        sessions, trials = active[done], trial[done]
+        rt[sessions, trials] = steps[done] * dt + params['t'][sessions]
+        response[sessions, trials] = upper[done]
+        resp_sign[sessions, trials] = np.where(upper[done], 1, -1)
+        logrt[sessions, trials] = np.log(rt[sessions, trials])
+        logrt_sum[sessions] += logrt[sessions, trials]
+        logrt_sq[sessions] += logrt[sessions, trials] ** 2
+
+        # start the next trial, or drop sessions that are finished
+        trial[done] += 1
+        steps[done] = 0
+        finished = trial >= n_trials
+        if finished.any():
+            keep = ~finished
+            restart = np.zeros(active.size, dtype=bool)
+            restart[done] = True
+            active, trial, steps = active[keep], trial[keep], steps[keep]
+            dv, drift_step, bound = dv[keep], drift_step[keep], bound[keep]
+            done = np.flatnonzero(restart[keep])
+        if done.size > 0:
+            drift_step[done], dv[done] = start_trials(active[done], trial[done])
+
+    return(rt, response)
+
+def to_dataframe(rt, response, stimuli, subj_idx, session=None, block=None, transitionprob=None, pupil=None):
+
+    """
+    DataFrame with the columns of Data/*.csv, one row per trial
+    subj_idx, session, block = per-session labels (block defaults to 1)
+    transitionprob = per-session repetition probability, adds a transitionprob column
+    pupil          = n_sessions x n_trials covariate, adds a prevpupil column
+    """
+
+    n_sessions, n_trials = rt.shape
+    if session is None:
+        session = np.ones(n_sessions, dtype=int)
+    if block is None:
+        block = np.ones(n_sessions, dtype=int)
+
+    # z-scored log RT within each subject and session
+    logrt = np.log(rt)
+    zrt = (logrt - logrt.mean(axis=1, keepdims=True)) / logrt.std(axis=1, keepdims=True)
+
+    cols = {'subj_idx': np.repeat(subj_idx, n_trials), 'session': np.repeat(session, n_trials),
+        'block': np.repeat(block, n_trials), 'trial': np.tile(np.arange(n_trials), n_sessions),
+        'stimulus': stimuli.ravel(), 'response': response.ravel().astype(int), 'rt': rt.ravel()}
+    resp_sign = response * 2 - 1
+    correct = np.asarray(resp_sign == stimuli, dtype=float)
+    lagged = [('resp', resp_sign, [1, 2, 3]), ('stim', stimuli, [1, 2, 3]), ('rt', zrt, [1, 2, 3]),
+        ('correct', correct, [1])]
+    columns = ['subj_idx', 'session', 'block', 'trial', 'stimulus', 'response', 'rt',
+        'prevstim', 'prevresp', 'prevrt', 'prev2resp', 'prev3resp', 'prev2stim', 'prev3stim',
+        'prev2rt', 'prev3rt', 'correct', 'prevcorrect']
+    if pupil is not None:
+        lagged.append(('pupil', pupil, [1]))
+        columns.append('prevpupil')
+    if transitionprob is not None:
+        cols['transitionprob'] = np.repeat(transitionprob, n_trials)
+        columns.append('transitionprob')
+    for name, past, lags in lagged:
+        for lag in lags:
+            col = np.full((n_sessions, n_trials), np.nan)
+            col[:, lag:] = past[:, :-lag]
+            cols['prev{}{}'.format('' if lag == 1 else lag, name)] = col.ravel()
+    df = pd.DataFrame(cols)
+    df['correct'] = np.array((df.stimulus > 0) == (df.response > 0), dtype=int)
+    return df[columns]
+
+def simulate_dataset(n_subjects=20, n_trials=500, n_sessions=1, p_repeat=0.5, dt=0.001, seed=None, pupil=False,
+    **params):
+
+    """
+    Synthetic dataset for parameter recovery, e.g.
+        simulate_dataset(n_subjects=30, v=1, a=1.5, dc_prevresp=0.3, z_prevresp=0.2)
+    Parameters are per subject (see subject_params) and shared across sessions.
+    With a list of p_repeat values, every session has one block of n_trials
+    per value, with a transitionprob column; a parameter can then also be a
+    dict of values per p_repeat, e.g. dc_prevresp={0.2: -0.3, 0.8: 0.3}.
+    pupil adds a prevpupil column, it is also drawn for prevpupil weights.
+    """
+
+    rng = np.random.default_rng(seed)
+    levels = np.atleast_1d(p_repeat)
+    per_level = dict((k, p) for k, p in params.items() if isinstance(p, dict))
+    params = subject_params(n_subjects, **dict((k, 0 if k in per_level else p) for k, p in params.items()))
+    n_blocks = n_sessions * levels.size
+    subj = np.repeat(np.arange(1, n_subjects + 1), n_blocks)
+    session = np.tile(np.repeat(np.arange(1, n_sessions + 1), levels.size), n_subjects)
+    block = np.tile(np.arange(1, levels.size + 1), n_subjects * n_sessions)
+    level = levels[block - 1]
+    params = dict((k, np.repeat(p, n_blocks)) for k, p in params.items())
+    for k, values in per_level.items():
+        params[k] = np.array([values[l] for l in level], dtype=float)
+    stimuli = make_stimuli(subj.size, n_trials, level[:, None], rng)
+    if pupil or any('prevpupil' in history_term(k)[1] for k in params if history_term(k) is not None):
+        pupil = rng.standard_normal(stimuli.shape)
+    else:
+        pupil = None
+    rt, response = simulate_sessions(params, stimuli, dt, rng, pupil=pupil)
+    return to_dataframe(rt, response, stimuli, subj, session, block,
+        transitionprob=level if np.ndim(p_repeat) > 0 else None, pupil=pupil)
+
+if __name__ == '__main__':
+
+    # the repetition probability should go up with the history weights
+    for dc_prevresp, z_prevresp in [(0, 0), (0.5, 0), (0, 0.5)]:
+        df = simulate_dataset(n_subjects=20, n_trials=500, seed=1,
+            dc_prevresp=dc_prevresp, z_prevresp=z_prevresp)
+        repeat = (df.response * 2 - 1 == df.prevresp)[df.prevresp.notnull()].mean()
+        print('dc_prevresp={}, z_prevresp={}: P(repeat)={:.3f}, mean rt={:.3f}, accuracy={:.3f}'.format(
+            dc_prevresp, z_prevresp, repeat, df.rt.mean(), df.correct.mean()))
+
+    # with dc_prevresp:prevrt < 0, choices repeat more after fast trials
+    df = simulate_dataset(n_subjects=20, n_trials=500, seed=1, dc_prevresp=0.3, **{'dc_prevresp:prevrt': -0.3})
+    repeat = (df.response * 2 - 1 == df.prevresp)
+    for name, trials in [('fast', df.prevrt < 0), ('slow', df.prevrt > 0)]:
+        print('dc_prevresp=0.3, dc_prevresp:prevrt=-0.3: P(repeat) after {} trials={:.3f}'.format(
+            name, repeat[trials].mean()))
+
+    # history weights per transition probability
+    df = simulate_dataset(n_subjects=20, n_trials=500, p_repeat=[0.2, 0.5, 0.8], seed=1,
+        dc_prevresp={0.2: -0.5, 0.5: 0, 0.8: 0.5})
+    repeat = (df.response * 2 - 1 == df.prevresp)[df.prevresp.notnull()]
+    for p, r in repeat.groupby(df.transitionprob).mean().items():
+        print('transitionprob={}: P(repeat)={:.3f}'.format(p, r))
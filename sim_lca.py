@@ -0,0 +1,180 @@
+#!/usr/bin/env python
+# encoding: utf-8
+
+"""
+Two leaky accumulators for the signal detection task of Ossmy et al. (2013),
+a batched port of analyticalDDM/LeakyAccumulator/sim2acc.m and
+sim2acc_no_bound.m.
+
+The MATLAB code simulates all trials of one parameter set at once, storing
+the input, the noise and the accumulators for every time step. Here a batch of
+parameter sets is simulated together, as arrays of sets x accumulators x
+trials, looping over time steps only. Only the first passage of each
+accumulator (and its running maximum) is kept, not the traces.
+
+All parameter sets share the same signal onsets and the same standard normal
+draws for the stimulus and accumulator noise, handed out step by step from a
+ddm_sim.NoiseBlock and scaled by sigmaL and sigmaA. So the trials of a set do
+not depend on the other sets in the batch: a set simulated on its own with the
+same seed gives the same trials, and differences between the parameter sets
+of a grid are not blurred by independent Monte Carlo noise.
+
+Parameters follow the MATLAB code: params = [beta, sigmaA, theta, leak, Ter]
+per row, as in ML_2acc.m.
+
+MIT License
+Copyright (c) Anne Urai, 2018
+anne.urai@gmail.com
+"""
+
+import numpy as np
+from ddm_sim import NoiseBlock
+
+# increase whenever the simulated trials for a given seed change,
+# this invalidates the objective values memoized by grid_search.py
+engine_version = 1
+
+# fixed parameters, as in sim2acc.m
+dt = 1 / 60.            # model time step (s), one video frame
+base_input = 0.35       # baseline stimulus input
+trial_length = 5        # s
+onset_range = (0.6, 3.5) # range of signal onsets (s)
+
+def n_steps(ter):
+    # number of time steps after the non-decision time, ceil((trial_length-Ter)/dt)
+    return np.ceil(np.round((trial_length - np.asarray(ter, dtype=float)) / dt, 6)).astype(int)
+
+def matlab_round(x):
+    # round half away from zero, for positive x
+    return np.floor(np.asarray(x) + 0.5).astype(int)
+
+# ============================================ #
+# simulation
+# ============================================ #
+
+def simulate(beta, sigma_a, theta, leak, ter, strength=0, duration=0, nsims=10000, sigma_input=0.13,
+    rng=None, noise_block=2**20):
+
+    """
+    Simulate nsims trials for each parameter set (all arguments but nsims,
+    sigma_input, rng and noise_block are scalars or arrays of one value per set).
+    beta        = brightness exponent
+    sigma_a     = accumulator noise per step
+    theta       = decision bound, use np.inf to simulate without a bound
+    leak        = accumulator leak per step
+    ter         = non-decision time, shortens the trial
+    strength, duration = signal added to the input of accumulator 1
+    sigma_input = stimulus noise per step
+
+    Returns (first, onsets, peak):
+    first  = sets x 2 x nsims step of the first bound crossing of each
+             accumulator, counted from 1 as in sim2acc.m, 0 if it never crossed
+    onsets = sets x nsims signal onsets relative to Ter, as in sim2acc.m
+    peak   = sets x nsims maximum of both accumulators over the trial
+    """
+
+    if rng is None:
+        rng = np.random.default_rng()
+    beta, sigma_a, theta, leak, ter, strength, duration = [np.atleast_1d(np.asarray(x, dtype=float))
+        for x in np.broadcast_arrays(beta, sigma_a, theta, leak, ter, strength, duration)]
+    n_sets = beta.size
+
+    # sets with the most steps first, so the sets still running are always the first k
+    steps = n_steps(ter)
+    order = np.argsort(-steps, kind='stable')
+    beta, sigma_a, theta, leak, ter, strength, duration, steps = [x[order]
+        for x in [beta, sigma_a, theta, leak, ter, strength, duration, steps]]
+
+    # signal onsets, shared by all sets; onsets that round to step 0 (or below, for Ter > 0.6)
+    # start at the first step
+    onsets = onset_range[0] + (onset_range[1] - onset_range[0]) * rng.random(nsims)[None, :] - ter[:, None]
+    onsets[matlab_round(onsets / dt) <= 0] = dt
+    signal = strength > 0
+    first_step = matlab_round(onsets / dt)
+    last_step = first_step + np.floor(np.round(duration / dt, 6)).astype(int)[:, None]
+
+    noise = NoiseBlock(rng, noise_block)
+    base_out = base_input ** beta[:, None, None]
+    beta, sigma_a, theta, retain = [x[:, None, None] for x in [beta, sigma_a, theta, 1 - leak]]
+    y = np.zeros((n_sets, 2, nsims))
+    first = np.zeros((n_sets, 2, nsims), dtype=int)
+    peak = np.full((n_sets, nsims), -np.inf)
+    k = n_sets
+
+    for t in range(1, steps[0] + 1):
+        while steps[k - 1] < t:
+            k -= 1
+
+        # one draw of stimulus noise and of accumulator noise per accumulator and trial
+        eps = noise.draw(4 * nsims).reshape(2, 2, nsims)
+        inp = np.repeat((eps[0] * sigma_input + base_input)[None], k, axis=0)
+        if signal[:k].any():
+            on = (t >= first_step[:k]) & (t <= last_step[:k]) & signal[:k, None]
+            inp[:, 0] += strength[:k, None] * on
+        np.maximum(inp, 0, out=inp) # no negative luminance
+        np.power(inp, beta[:k], out=inp)
+        inp -= base_out[:k]
+
+        yk = y[:k]
+        yk *= retain[:k]
+        yk += inp
+        yk += eps[1] * sigma_a[:k]
+
+        crossed = (yk >= theta[:k]) & (first[:k] == 0)
+        first[:k][crossed] = t
+        np.maximum(peak[:k], yk.max(axis=1), out=peak[:k])
+
+    unsort = np.argsort(order)
+    return first[unsort], onsets[unsort], peak[unsort]
+
+# ============================================ #
+# behaviour, as in sim2acc.m and sim2acc_no_bound.m
+# ============================================ #
+
+def sim2acc(params, s=0, d=0, nsims=10000, sigma_input=0.13, rng=None, noise_block=2**20):
+
+    """
+    Response codes per trial for params (one [beta, sigmaA, theta, leak, Ter]
+    vector, or sets x 5) with signal strength s and duration d (scalars or one
+    per set). Without a signal, 51 (false alarm) if either accumulator reached
+    theta during the trial and 31 (correct rejection) otherwise. With a signal,
+    1 (hit) if accumulator 1 crossed between signal onset and offset, and not
+    after accumulator 2, and 0 otherwise. Returns nsims codes, or sets x nsims.
+    """
+
+    single = np.ndim(params) == 1
+    pm = np.atleast_2d(np.asarray(params, dtype=float))
+    first, onsets, peak = simulate(pm[:, 0], pm[:, 1], pm[:, 2], pm[:, 3], pm[:, 4],
+        s, d, nsims, sigma_input, rng, noise_block)
+
+    s = np.broadcast_to(np.asarray(s, dtype=float), pm.shape[:1])[:, None]
+    d = np.broadcast_to(np.asarray(d, dtype=float), pm.shape[:1])[:, None]
+    with np.errstate(invalid='ignore'):
+        rt = np.where(first > 0, first * dt - onsets[:, None, :], np.nan) # relative to signal onset
+        hit = (first[:, 0] > 0) & (rt[:, 0] >= 0) & (rt[:, 0] <= d) & \
+            ((first[:, 1] == 0) | (rt[:, 0] - rt[:, 1] <= 0))
+    acc = np.where(s > 0, np.where(hit, 1, 0), np.where(peak >= pm[:, 2, None], 51, 31))
+    if single:
+        return acc[0]
+    return acc
+
+def sim2acc_no_bound(params, nsims=10000, sigma_input=0.11, rng=None, noise_block=2**20):
+
+    """
+    Noise-only trials without a bound, for params [beta, sigmaA, leak, Ter]
+    (or sets x 4). sim2acc_no_bound.m returns the traces, but FIT_2acc.m only
+    uses their maximum over time and accumulators, max(max(y,[],3)), so that
+    is what this returns: nsims values, or sets x nsims.
+    """
+
+    single = np.ndim(params) == 1
+    pm = np.atleast_2d(np.asarray(params, dtype=float))
+    peak = simulate(pm[:, 0], pm[:, 1], np.inf, pm[:, 2], pm[:, 3], 0, 0, nsims, sigma_input,
+        rng, noise_block)[2]
+    if single:
+        return peak[0]
+    return peak
+
+def response_rate(acc, code):
+    # proportion of trials with the given response code, e.g. 51 for false alarms and 1 for hits
+    return np.mean(np.asarray(acc) == code, axis=-1)
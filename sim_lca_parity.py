@@ -0,0 +1,137 @@
+#!/usr/bin/env python
+# encoding: utf-8
+
+"""
+Parity check of sim_lca.py against a line-by-line transliteration of
+analyticalDDM/LeakyAccumulator/sim2acc.m and sim2acc_no_bound.m. The
+transliteration takes its random numbers in the order in which sim_lca.py
+draws them, so both give the same trials for the same seed. Also checks that
+a set gives the same trials within a batch as on its own, and reports the
+speedup of simulating the batch at once. Run as: python sim_lca_parity.py
+
+MIT License
+Copyright (c) Anne Urai, 2018
+anne.urai@gmail.com
+"""
+
+import time
+import numpy as np
+from ddm_sim import NoiseBlock
+import sim_lca
+
+# ============================================ #
+# transliteration of the MATLAB code
+# ============================================ #
+
+def draw_noise(rng, nsims, n, noise_block=2**20):
+    # the onsets, and per step the stimulus and accumulator noise, in the order of sim_lca.simulate
+    u = rng.random(nsims)
+    noise = NoiseBlock(rng, noise_block)
+    eps = np.stack([noise.draw(4 * nsims).reshape(2, 2, nsims).copy() for t in range(n)], axis=-1)
+    return u, eps[0], eps[1]
+
+def sim2acc(params, s, d, nsims, rng):
+    dt = 1/60.
+    baseL = 0.35
+    sigmaL = 0.13
+    trial_length = 5
+    onset_range = [0.6, 3.5]
+    beta, sigmaA, theta, leak, Ter = params
+    n = int(np.ceil(np.round((trial_length-Ter)/dt, 6)))
+    u, input_noise, acc_noise = draw_noise(rng, nsims, n)
+
+    input = (input_noise*sigmaL)+baseL
+    onsets = (onset_range[0]+(onset_range[1]-onset_range[0])*u)-Ter
+    if s > 0:
+        onsets[np.floor(onsets/dt+0.5) == 0] = dt
+        for i in range(nsims):
+            k = int(np.floor(onsets[i]/dt+0.5))
+            stop = min(k+int(np.floor(np.round(d/dt, 6))), n)
+            input[0, i, k-1:stop] = input[0, i, k-1:stop]+s
+    input[input < 0] = 0
+    input = (input**beta)-(baseL**beta)
+
+    noise = acc_noise*sigmaA
+    y = np.zeros((2, nsims, 1+n))
+    for t in range(n):
+        y[0, :, t+1] = (y[0, :, t]*(1-leak))+input[0, :, t]+noise[0, :, t]
+        y[1, :, t+1] = (y[1, :, t]*(1-leak))+input[1, :, t]+noise[1, :, t]
+    y = y[:, :, 1:]
+
+    ACC = np.zeros(nsims)
+    if s == 0:
+        ACC[np.max(np.max(y, axis=2), axis=0) < theta] = 31
+        ACC[np.max(np.max(y, axis=2), axis=0) >= theta] = 51
+    else:
+        RT = []
+        for acc in range(2):
+            crossed = y[acc] >= theta
+            I = np.flatnonzero(crossed.any(axis=1))
+            J = np.argmax(crossed[I], axis=1)+1
+            rt = np.full(nsims, np.nan)
+            rt[I] = (J*dt)-onsets[I]
+            RT.append((I, rt))
+        (I1, RT1), (I2, RT2) = RT
+        ts = np.arange(nsims)
+        dual_pass = ts[np.isin(ts, I1) & np.isin(ts, I2)]
+        ACC[(np.isin(ts, I1) & (RT1 >= 0) & (RT1 <= d)) & (~np.isin(ts, I2) |
+            np.isin(ts, dual_pass[RT1[dual_pass]-RT2[dual_pass] <= 0]))] = 1
+    return ACC
+
+def sim2acc_no_bound(params, nsims, rng):
+    dt = 1/60.
+    baseL = 0.35
+    sigmaL = 0.11
+    trial_length = 5
+    beta, sigmaA, leak, Ter = params
+    n = int(np.ceil(np.round((trial_length-Ter)/dt, 6)))
+    u, input_noise, acc_noise = draw_noise(rng, nsims, n)
+
+    input = (input_noise*sigmaL)+baseL
+    input[input < 0] = 0
+    input = (input**beta)-(baseL**beta)
+    noise = acc_noise*sigmaA
+    y = np.zeros((2, nsims, 1+n))
+    for t in range(n):
+        y[0, :, t+1] = (y[0, :, t]*(1-leak))+input[0, :, t]+noise[0, :, t]
+        y[1, :, t+1] = (y[1, :, t]*(1-leak))+input[1, :, t]+noise[1, :, t]
+    return y[:, :, 1:]
+
+# ============================================ #
+# compare
+# ============================================ #
+
+if __name__ == '__main__':
+
+    rng = np.random.default_rng(2013)
+    n_sets, nsims, seed = 24, 2000, 7
+    # grid ranges from FIT_2acc.m; Ter up to the fixed 0.6, above that the earliest
+    # onsets are negative and sim2acc.m errors (sim_lca.py starts those signals at the first step)
+    pm = np.column_stack([rng.uniform(0.2, 1, n_sets), rng.uniform(0, 0.31, n_sets),
+        rng.uniform(0.3, 3, n_sets), rng.uniform(0, 0.3, n_sets), rng.choice([0.4, 0.5, 0.6], n_sets)])
+    strs = rng.choice([0, 0.1, 0.2], n_sets)
+    durs = rng.choice([0.15, 0.45, 0.9], n_sets)
+
+    starttime = time.time()
+    ref = [sim2acc(p, s, d, nsims, np.random.default_rng(seed)) for p, s, d in zip(pm, strs, durs)]
+    t_loop = time.time() - starttime
+    starttime = time.time()
+    acc = sim_lca.sim2acc(pm, strs, durs, nsims, rng=np.random.default_rng(seed))
+    t_vec = time.time() - starttime
+
+    mismatch = np.mean([np.mean(r != a) for r, a in zip(ref, acc)])
+    alone = sim_lca.sim2acc(pm[5], strs[5], durs[5], nsims, rng=np.random.default_rng(seed))
+    print('sim2acc: {} sets x {} trials, {} of trials differ, loops {:.2f} s, batched {:.2f} s'.format(
+        n_sets, nsims, mismatch, t_loop, t_vec))
+    print('hit/false alarm rates: {}'.format(np.round([sim_lca.response_rate(a, 1 if s > 0 else 51)
+        for a, s in zip(acc, strs)], 3)))
+    assert mismatch == 0
+    assert np.array_equal(alone, acc[5])
+
+    pm_nb = pm[:, [0, 1, 3, 4]]
+    ref = [np.max(np.max(sim2acc_no_bound(p, nsims, np.random.default_rng(seed)), axis=2), axis=0)
+        for p in pm_nb]
+    peak = sim_lca.sim2acc_no_bound(pm_nb, nsims, rng=np.random.default_rng(seed))
+    max_err = np.max(np.abs(np.array(ref) - peak))
+    print('sim2acc_no_bound: max difference of the peak activity {:.2e}'.format(max_err))
+    assert max_err < 1e-10
@@ -0,0 +1,248 @@
+#!/usr/bin/env python
+# encoding: utf-8
+
+"""
+Likelihood lookup tables for the collapsing bound models of ddm_sim.py
+(DDM2, DDM3), which have no analytic likelihood.
+
+A table is built once by simulating every cell of a grid over v, a, z and
+dc (with sim_sweep.iter_sweep, so on a pool of workers and with the
+simulation cache), and stores per cell, stimulus and response the RT density
+in bins of bin_width seconds, as a memory-mapped .npy file. At fit time,
+densities are multilinearly interpolated between the grid cells and between
+the bin centres, with the non-decision time t applied as a shift of the RTs.
+So a fit needs no simulations at all, and only reads the parts of the table
+it needs from disk.
+
+Time is in seconds: a trace that crosses a bound on step n (counting from 1)
+has a decision time of n*dt. Tables are always simulated with Euler steps
+(method='euler'), also for the static bounds of DDM, so that tables of
+different models share the same discretization. With the default dt=0.01
+the noise of ddm_sim has unit variance per second, as in HDDM.
+
+Usage:
+    python sim_lut.py -m DDM2 -n 0 -r 1                # build lut_DDM2
+    python sim_lut.py -m DDM2 -d visual_motion_2afc     # fit all subjects
+
+MIT License
+Copyright (c) Anne Urai, 2018
+anne.urai@gmail.com
+"""
+
+import os, json
+import numpy as np
+from scipy.optimize import minimize
+import ddm_sim
+from sim_sweep import iter_sweep
+
+param_names = ['v', 'a', 'z', 'dc']
+
+# default grid, v is the drift for stimulus 1 (and -v for stimulus 0)
+default_axes = {'v': np.linspace(0, 2.5, 6), 'a': np.linspace(0.6, 2.6, 6), 'z': [0.35, 0.5, 0.65],
+    'dc': np.linspace(-0.8, 0.8, 5)}
+
+# ============================================ #
+# building a table
+# ============================================ #
+
+def build_table(path, model='DDM2', axes=None, nr_trials=20000, dt=0.01, bin_width=0.02, t_max=4.0,
+    seed=None, n_workers=1, cache=None, verbose=True):
+
+    """
+    Simulate nr_trials per stimulus for every cell of the grid (axes = dict of
+    values per parameter in param_names) and write the table to folder path:
+    table.npy = densities, cells x stimulus x response x RT bins, float32
+    tail.npy  = probability of decision times beyond t_max, cells x stimulus x response
+    table.json = everything needed to read it; written last, so a table
+    without it is incomplete
+    """
+
+    if axes is None:
+        axes = default_axes
+    axes = dict((k, [float(x) for x in np.unique(axes[k])]) for k in param_names)
+    n_bins = int(np.round(t_max / bin_width))
+    shape = tuple(len(axes[k]) for k in param_names)
+    if not os.path.isdir(path):
+        os.makedirs(path)
+
+    table = np.lib.format.open_memmap(os.path.join(path, 'table.npy'), mode='w+', dtype=np.float32,
+        shape=shape + (2, 2, n_bins))
+    tail = np.zeros(shape + (2, 2))
+    cells = list(np.ndindex(*shape))
+    conditions = [dict(((k, axes[k][i]) for k, i in zip(param_names, cell)), model=model,
+        nr_trials=nr_trials, dt=dt, method='euler') for cell in cells]
+
+    entropy = np.random.SeedSequence(seed).entropy
+    if seed is None:
+        print('table seed: {}'.format(entropy)) # pass this as seed to rebuild the same table
+    for c, stim, rt, response in iter_sweep(conditions, entropy, n_workers, cache=cache):
+        decision_time = (rt + 1) * dt # the crossing happens on update rt+1
+        for resp in [0, 1]:
+            t = decision_time[response == resp]
+            counts = np.bincount(np.minimum(t / bin_width, n_bins).astype(int), minlength=n_bins + 1)
+            table[cells[c] + (stim, resp)] += counts[:n_bins] / float(nr_trials * bin_width)
+            tail[cells[c] + (stim, resp)] += counts[n_bins] / float(nr_trials)
+        if verbose and stim == 1 and c % 50 == 0:
+            print('{} / {} cells simulated'.format(c + 1, len(cells)))
+    table.flush()
+    del table
+
+    np.save(os.path.join(path, 'tail.npy'), tail)
+    info = {'model': model, 'axes': axes, 'nr_trials': nr_trials, 'dt': dt, 'bin_width': bin_width,
+        'n_bins': n_bins, 'seed': str(entropy), 'engine_version': ddm_sim.engine_version}
+    tmpname = os.path.join(path, 'table.%d.tmp.json'%os.getpid())
+    with open(tmpname, 'w') as f:
+        json.dump(info, f, indent=1)
+    os.rename(tmpname, os.path.join(path, 'table.json'))
+    return LikelihoodTable(path)
+
+# ============================================ #
+# reading a table
+# ============================================ #
+
+def _axis_weights(axis, x):
+    # lower grid index and interpolation weight of the upper one, clipped to the axis
+    if axis.size == 1:
+        return np.zeros(np.shape(x), dtype=int), np.zeros(np.shape(x))
+    x = np.clip(x, axis[0], axis[-1])
+    i = np.clip(np.searchsorted(axis, x, side='right') - 1, 0, axis.size - 2)
+    return i, (x - axis[i]) / (axis[i + 1] - axis[i])
+
+class LikelihoodTable(object):
+
+    def __init__(self, path):
+        with open(os.path.join(path, 'table.json')) as f:
+            self.info = json.load(f)
+        if self.info['engine_version'] != ddm_sim.engine_version:
+            print('warning: {} was built with ddm_sim engine_version {}'.format(path, self.info['engine_version']))
+        self.axes = [np.array(self.info['axes'][k]) for k in param_names]
+        self.bin_width = self.info['bin_width']
+        self.table = np.load(os.path.join(path, 'table.npy'), mmap_mode='r')
+        self.tail = np.load(os.path.join(path, 'tail.npy'))
+
+    @property
+    def ranges(self):
+        return dict((k, (ax[0], ax[-1])) for k, ax in zip(param_names, self.axes))
+
+    def density(self, stimulus, response, rt, v, a, z, dc, t=0):
+
+        """
+        Interpolated density of each trial's RT (in seconds) and response,
+        for stimulus and response coded 0/1 (stimulus -1 is read as 0) and
+        parameters that are scalars or one value per trial. Parameters outside
+        the grid are clipped to it.
+        """
+
+        stimulus = (np.asarray(stimulus) > 0).astype(int)
+        response = np.asarray(response).astype(int)
+        decision_time = np.asarray(rt, dtype=float) - t
+        weights = [_axis_weights(ax, np.broadcast_to(x, decision_time.shape))
+            for ax, x in zip(self.axes, [v, a, z, dc])]
+
+        # between bin centres; before the first centre towards zero density at decision time 0
+        pos = np.clip(decision_time / self.bin_width - 0.5, -1, self.table.shape[-1] - 1)
+        b = np.floor(pos).astype(int)
+        wb = pos - b
+        b_next = np.minimum(b + 1, self.table.shape[-1] - 1)
+
+        dens = np.zeros(decision_time.shape)
+        for corner in np.ndindex(*(2,) * len(self.axes)):
+            idx, w = [], 1
+            for (i, wi), up, ax in zip(weights, corner, self.axes):
+                idx.append(np.minimum(i + up, ax.size - 1))
+                w = w * (wi if up else 1 - wi)
+            idx += [stimulus, response]
+            before = np.where(b >= 0, self.table[tuple(idx + [np.maximum(b, 0)])], 0)
+            after = self.table[tuple(idx + [b_next])]
+            dens += w * ((1 - wb) * before + wb * after)
+        return np.where(decision_time > 0, dens, 0)
+
+    def log_likelihood(self, stimulus, response, rt, min_density=1e-10, **params):
+        return np.sum(np.log(np.maximum(self.density(stimulus, response, rt, **params), min_density)))
+
+# ============================================ #
+# fitting
+# ============================================ #
+
+def fit_subject(table, data, x0=None, min_density=1e-10):
+
+    """
+    Maximum likelihood fit of v, a, z, dc and t to the trials of one subject
+    (a DataFrame with stimulus, response and rt, as in Data/*.csv), within
+    the grid of the table. Returns a dict with the parameters, the negative
+    log likelihood and the BIC.
+    """
+
+    names = param_names + ['t']
+    stimulus, response, rt = data.stimulus.values, data.response.values, data.rt.values
+    bounds = [table.ranges[k] for k in param_names] + [(0, max(rt.min() - 0.01, 0))]
+    if x0 is None:
+        x0 = [np.mean(b) for b in bounds[:-1]] + [bounds[-1][1] / 2.0]
+
+    lower, upper = np.array(bounds).T
+
+    def objective(x):
+        # clipped here too: scipy < 1.5 ignores the bounds of Powell
+        x = np.clip(x, lower, upper)
+        return -table.log_likelihood(stimulus, response, rt, min_density, **dict(zip(names, x)))
+
+    res = minimize(objective, np.clip(x0, lower, upper), method='Powell', bounds=bounds)
+    x = np.clip(res.x, lower, upper)
+    fit = dict(zip(names, x))
+    fit['nll'] = objective(x)
+    fit['bic'] = 2 * res.fun + len(names) * np.log(len(rt))
+    return fit
+
+if __name__ == '__main__':
+
+    import pandas as pd
+    from optparse import OptionParser
+    from sim_cache import SimulationCache
+    usage = "sim_lut.py [options]"
+    parser = OptionParser ( usage)
+    parser.add_option ( "-m", "--model",
+            default = 'DDM2',
+            type = "string",
+            help = "Simulator in ddm_sim.models to build the table for" )
+    parser.add_option ( "-o", "--output",
+            default = None,
+            type = "string",
+            help = "Folder of the table, defaults to lut_<model>" )
+    parser.add_option ( "-t", "--nr_trials",
+            default = 20000,
+            type = "int",
+            help = "Number of simulated trials per grid cell and stimulus" )
+    parser.add_option ( "-n", "--n_workers",
+            default = 1,
+            type = "int",
+            help = "Number of worker processes, 0 for one per core" )
+    parser.add_option ( "-r", "--seed",
+            default = None,
+            type = "int",
+            help = "Seed for the simulations, printed when not given" )
+    parser.add_option ( "--cache",
+            default = None,
+            type = "string",
+            help = "Folder to cache simulations in, only used together with a seed" )
+    parser.add_option ( "-d", "--dataset",
+            default = None,
+            type = "string",
+            help = "Fit all subjects of Data/<dataset>.csv with the table" )
+    opts, args = parser.parse_args()
+
+    path = opts.output or 'lut_%s'%opts.model
+    if not os.path.isfile(os.path.join(path, 'table.json')):
+        cache = SimulationCache(opts.cache) if opts.cache is not None else None
+        build_table(path, opts.model, nr_trials=opts.nr_trials, seed=opts.seed, n_workers=opts.n_workers or None,
+            cache=cache)
+    table = LikelihoodTable(path)
+
+    if opts.dataset is not None:
+        data = pd.read_csv(os.path.join('Data', '%s.csv'%opts.dataset))
+        fits = []
+        for subj_idx, subj_data in data.groupby('subj_idx'):
+            fit = fit_subject(table, subj_data.dropna(subset=['rt']))
+            fit['subj_idx'] = subj_idx
+            print(fit)
+            fits.append(fit)
+        pd.DataFrame(fits).to_csv('lut_%s_%s.csv'%(table.info['model'], opts.dataset), index=False)
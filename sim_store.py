@@ -0,0 +1,119 @@
+#!/usr/bin/env python
+# encoding: utf-8
+
+"""
+Columnar binary store for simulated trials, so that large simulation sweeps
+can be written chunk by chunk instead of being kept in memory as one
+DataFrame and written to a csv file.
+
+A store is a folder with one raw binary file per column (rt as float32,
+response and stimulus as int8, subj_idx as int16) and a meta.json file that
+lists, for each condition, its parameters and the range of trials it covers.
+Trials of one condition are stored contiguously; reading goes through
+np.memmap, so only the requested condition is loaded from disk.
+
+MIT License
+Copyright (c) Anne Urai, 2018
+anne.urai@gmail.com
+"""
+
+import os, json
+import numpy as np
+import pandas as pd
+
+columns = {'rt': np.float32, 'response': np.int8, 'stimulus': np.int8, 'subj_idx': np.int16}
+
+class SimulationStore(object):
+
+    """
+    Writer, use as:
+        store = SimulationStore('sims')
+        store.add_condition(0, model='DDM', v=0.7, a=1.8)
+        store.append(rt, response, stimulus) # once per chunk
+        store.close()
+    """
+
+    def __init__(self, path):
+        self.path = path
+        if not os.path.exists(path):
+            os.makedirs(path)
+        self.files = {}
+        for col, dtype in columns.items():
+            self.files[col] = open(os.path.join(path, '%s.bin'%col), 'wb')
+        self.conditions = []
+        self.n_trials = 0
+
+    def add_condition(self, subj_idx, **params):
+        # all trials appended after this belong to this condition
+        self.conditions.append({'subj_idx': subj_idx, 'start': self.n_trials,
+            'n_trials': 0, 'params': params})
+        self.write_meta()
+
+    def append(self, rt, response, stimulus):
+        n = len(rt)
+        chunk = {'rt': rt, 'response': response, 'stimulus': stimulus,
+            'subj_idx': np.ones(n) * self.conditions[-1]['subj_idx']}
+        for col, dtype in columns.items():
+            np.asarray(chunk[col]).astype(dtype).tofile(self.files[col])
+            self.files[col].flush()
+        self.n_trials += n
+        self.conditions[-1]['n_trials'] += n
+
+    def write_meta(self):
+        # write to a temporary file first, so that meta.json is never half-written
+        meta = {'columns': dict((col, np.dtype(dtype).name) for col, dtype in columns.items()),
+            'n_trials': self.n_trials, 'conditions': self.conditions}
+        with open(os.path.join(self.path, 'meta.json.tmp'), 'w') as f:
+            json.dump(meta, f, indent=1)
+        os.rename(os.path.join(self.path, 'meta.json.tmp'), os.path.join(self.path, 'meta.json'))
+
+    def close(self):
+        self.write_meta()
+        for f in self.files.values():
+            f.close()
+
+# ============================================ #
+# reading
+# ============================================ #
+
+def read_meta(path):
+    with open(os.path.join(path, 'meta.json')) as f:
+        return json.load(f)
+
+def open_columns(path, meta=None):
+    # memory-mapped columns, nothing is read from disk until it is indexed
+    if meta is None:
+        meta = read_meta(path)
+    if meta['n_trials'] == 0:
+        return dict((col, np.zeros(0, dtype=dtype)) for col, dtype in meta['columns'].items())
+    return dict((col, np.memmap(os.path.join(path, '%s.bin'%col), dtype=dtype, mode='r',
+        shape=(meta['n_trials'],))) for col, dtype in meta['columns'].items())
+
+def load_condition(path, subj_idx, meta=None):
+
+    """
+    Read all trials of one condition into a DataFrame with the same columns as
+    the csv written by sim_ddm_collapsing_bounds.py
+    """
+
+    if meta is None:
+        meta = read_meta(path)
+    cols = open_columns(path, meta)
+    df = []
+    for cond in meta['conditions']:
+        if cond['subj_idx'] == subj_idx:
+            idx = slice(cond['start'], cond['start'] + cond['n_trials'])
+            df.append(pd.DataFrame(dict((col, np.array(cols[col][idx])) for col in cols)))
+    df = pd.concat(df)
+    df.loc[:,'correct'] = np.array(df.stimulus == df.response, dtype=int)
+    return df
+
+def iter_chunks(path, chunk_size=100000, meta=None):
+    # yields (condition, dict of column arrays) without loading the whole store
+    if meta is None:
+        meta = read_meta(path)
+    cols = open_columns(path, meta)
+    for cond in meta['conditions']:
+        for start in range(cond['start'], cond['start'] + cond['n_trials'], chunk_size):
+            stop = min(start + chunk_size, cond['start'] + cond['n_trials'])
+            yield cond, dict((col, np.array(cols[col][start:stop])) for col in cols)
@@ -0,0 +1,126 @@
+#!/usr/bin/env python
+# encoding: utf-8
+
+"""
+One-pass summaries of simulated RT distributions: RT quantiles, conditional
+accuracy/response per quantile bin and RT histograms per choice.
+
+An RTSummary only keeps, per RT bin of bin_width seconds, the number of
+trials, the sum of their RTs, and the number of correct and of response=1
+trials. It is updated chunk by chunk and two summaries of the same bin_width
+can be merged by adding these counts, so summaries can be computed while
+simulating (or in separate processes) without keeping the raw trials around.
+Quantiles are binned at bin_width (1 ms by default): a quantile is only
+known up to the width of the bin it falls in, however finely the RTs were
+simulated.
+
+MIT License
+Copyright (c) Anne Urai, 2018
+anne.urai@gmail.com
+"""
+
+import numpy as np
+
+class RTSummary(object):
+
+    def __init__(self, bin_width=0.001):
+        self.bin_width = bin_width
+        self.offset = None # RT bin of the first element of the count arrays
+        self.counts = dict((k, np.zeros(0)) for k in ['n', 'rt', 'correct', 'response'])
+
+    def _extend(self, first, last):
+        # make the count arrays cover RT bins first ... last
+        if self.offset is None:
+            self.offset = first
+        pad_before = max(self.offset - first, 0)
+        pad_after = max(last + 1 - (self.offset + self.counts['n'].size), 0)
+        if pad_before or pad_after:
+            for k in self.counts:
+                self.counts[k] = np.concatenate([np.zeros(pad_before), self.counts[k], np.zeros(pad_after)])
+            self.offset -= pad_before
+
+    def update(self, rt, response, stimulus):
+        rt = np.asarray(rt, dtype=float)
+        if rt.size == 0:
+            return
+        bins = np.round(rt / self.bin_width).astype(int) # bins centred on multiples of bin_width
+        self._extend(bins.min(), bins.max())
+        idx = bins - self.offset
+        size = self.counts['n'].size
+        self.counts['n'] += np.bincount(idx, minlength=size)
+        self.counts['rt'] += np.bincount(idx, weights=rt, minlength=size)
+        self.counts['correct'] += np.bincount(idx, weights=np.asarray(stimulus) == np.asarray(response), minlength=size)
+        self.counts['response'] += np.bincount(idx, weights=np.asarray(response) == 1, minlength=size)
+
+    def merge(self, other):
+        if other.offset is None:
+            return self
+        if other.bin_width != self.bin_width:
+            raise ValueError('Can only merge summaries with the same bin_width')
+        self._extend(other.offset, other.offset + other.counts['n'].size - 1)
+        start = other.offset - self.offset
+        for k in self.counts:
+            self.counts[k][start:start + other.counts[k].size] += other.counts[k]
+        return self
+
+    # ============================================ #
+    # summary statistics
+    # ============================================ #
+
+    @property
+    def n_trials(self):
+        return int(self.counts['n'].sum())
+
+    def mean(self, what='rt'):
+        # mean rt, or proportion correct / response=1 over all trials
+        return self.counts[what].sum() / self.counts['n'].sum()
+
+    def bin_rts(self):
+        # mean RT of the trials in each non-empty bin
+        n = self.counts['n']
+        return np.where(n > 0, self.counts['rt'] / np.maximum(n, 1), np.nan)
+
+    def quantiles(self, q):
+        # RT of the trial at rank q*(n-1), resolved up to bin_width
+        cum = np.cumsum(self.counts['n'])
+        ranks = np.asarray(q, dtype=float) * (cum[-1] - 1)
+        return self.bin_rts()[np.searchsorted(cum, ranks, side='right')]
+
+    def conditional(self, quantiles=(0, 0.1, 0.3, 0.5, 0.7, 0.9, 1)):
+
+        """
+        Mean RT, accuracy and response per quantile bin, as in
+        pd.qcut(rt, quantiles) followed by a groupby on the bins
+        """
+
+        edges = self.quantiles(quantiles)
+        nonempty = self.counts['n'] > 0
+        rts = self.bin_rts()[nonempty]
+        # right-closed bins, the first one also includes the lowest RT
+        which = np.clip(np.searchsorted(edges, rts, side='left') - 1, 0, len(edges) - 2)
+        res = []
+        for k in ['n', 'rt', 'correct', 'response']:
+            res.append(np.bincount(which, weights=self.counts[k][nonempty], minlength=len(edges) - 1))
+        n = np.maximum(res[0], 1)
+        return res[1] / n, res[2] / n, res[3] / n
+
+    def histogram(self, response=None, bins=40):
+        # RT histogram of all trials or of one response, over the range of those RTs
+        n = self.counts['n']
+        if response == 1:
+            n = self.counts['response']
+        elif response == 0:
+            n = self.counts['n'] - self.counts['response']
+        rts = self.bin_rts()[n > 0]
+        counts, edges = np.histogram(rts, bins=bins, weights=n[n > 0])
+        return counts, edges
+
+def summarize_store(path, bin_width=0.001):
+    # summaries per subj_idx from a sim_store folder, read chunk by chunk
+    from sim_store import iter_chunks
+    summaries = {}
+    for cond, chunk in iter_chunks(path):
+        if cond['subj_idx'] not in summaries:
+            summaries[cond['subj_idx']] = RTSummary(bin_width)
+        summaries[cond['subj_idx']].update(chunk['rt'], chunk['response'], chunk['stimulus'])
+    return summaries
@@ -0,0 +1,113 @@
+#!/usr/bin/env python
+# encoding: utf-8
+
+"""
+Run a sweep over simulation conditions on a pool of worker processes.
+
+Every condition is split into tasks (stimulus x chunk of trials). Each task
+gets its own random stream from np.random.SeedSequence(seed, spawn_key=...),
+keyed on the task's position in the sweep rather than on the worker that runs
+it, so the simulated trials are identical for any number of workers. With a
+seed and a sim_cache.SimulationCache, tasks that were simulated before are
+read from the cache instead.
+
+MIT License
+Copyright (c) Anne Urai, 2018
+anne.urai@gmail.com
+"""
+
+import multiprocessing
+import numpy as np
+import ddm_sim
+from sim_cache import cache_key
+
+def make_tasks(conditions, chunk_size=100000, stims=(0, 1)):
+
+    """
+    Split conditions (dicts with 'model', 'v', 'a', 'z', 'dc', 'nr_trials',
+    and optionally 'dt' and the simulation 'method') into a list of
+    (condition index, stim, chunk index, nr_trials) tasks
+    """
+
+    tasks = []
+    for c, cond in enumerate(conditions):
+        for stim in stims:
+            for chunk, start in enumerate(range(0, cond['nr_trials'], chunk_size)):
+                tasks.append((c, stim, chunk, min(chunk_size, cond['nr_trials'] - start)))
+    return tasks
+
+def run_task(args):
+
+    # runs in the worker processes
+    cond, c, stim, chunk, nr_trials, entropy = args
+    rng = np.random.default_rng(np.random.SeedSequence(entropy, spawn_key=(c, stim, chunk)))
+    params = dict((k, cond[k]) for k in ['v', 'a', 'z', 'dc', 'dt', 'method'] if k in cond)
+    rt, response = ddm_sim.models[cond['model']](stim=stim, nr_trials=nr_trials, rng=rng, **params)
+    return c, stim, rt, response
+
+def task_key(cond, c, stim, chunk, nr_trials, entropy):
+    # cache key of one task, the condition index only matters through the seed
+    params = dict((k, cond[k]) for k in ['model', 'v', 'a', 'z', 'dc', 'method'] if k in cond)
+    return cache_key(dt=cond.get('dt', 0.01), stim=stim, nr_trials=nr_trials,
+        seed=str(entropy), spawn_key=[c, stim, chunk], **params)
+
+def iter_sweep(conditions, seed=None, n_workers=1, chunk_size=100000, cache=None):
+
+    """
+    Simulate all conditions, yields (condition index, stim, rt, response) per
+    task in sweep order. Use n_workers=None for one worker per core.
+    The cache is only used when a seed is given.
+    """
+
+    entropy = np.random.SeedSequence(seed).entropy
+    if seed is None:
+        print('sweep seed: {}'.format(entropy)) # pass this as seed to reproduce the sweep
+        cache = None
+
+    tasks = [(conditions[c], c, stim, chunk, n, entropy) for c, stim, chunk, n
+        in make_tasks(conditions, chunk_size)]
+    keys = [task_key(*task) if cache is not None else None for task in tasks]
+    hits = [key is not None and cache.has(key) for key in keys]
+    todo = [task for task, hit in zip(tasks, hits) if not hit]
+
+    # simulate the missing tasks, in sweep order
+    if n_workers == 1 or len(todo) < 2:
+        pool = None
+        simulated = (run_task(task) for task in todo)
+    else:
+        # fork, so that workers do not re-run the (unguarded) calling script
+        if 'fork' in multiprocessing.get_all_start_methods():
+            pool = multiprocessing.get_context('fork').Pool(n_workers)
+        else:
+            pool = multiprocessing.Pool(n_workers)
+        simulated = pool.imap(run_task, todo)
+
+    try:
+        for task, key, hit in zip(tasks, keys, hits):
+            if hit:
+                cached = cache.get(key)
+                if cached is not None:
+                    yield task[1], task[2], cached['rt'], cached['response']
+                    continue
+                result = run_task(task) # evicted since we checked
+            else:
+                result = next(simulated)
+            if key is not None:
+                cache.put(key, rt=result[2], response=result[3])
+            yield result
+        if pool is not None:
+            pool.close()
+    finally:
+        if pool is not None:
+            pool.terminate()
+            pool.join()
+
+def run_sweep(conditions, seed=None, n_workers=1, chunk_size=100000, cache=None):
+
+    # same as iter_sweep, but returns a dict of (rt, response, stimulus) per condition
+    results = dict((c, ([], [], [])) for c in range(len(conditions)))
+    for c, stim, rt, response in iter_sweep(conditions, seed, n_workers, chunk_size, cache):
+        results[c][0].append(rt)
+        results[c][1].append(response)
+        results[c][2].append(np.ones(len(rt)) * stim)
+    return dict((c, tuple(np.concatenate(x) for x in res)) for c, res in results.items())
@@ -0,0 +1,88 @@
+#!/usr/bin/env python
+# encoding: utf-8
+
+"""
+Starting values of the chains in b1_HDDM_run.py, found once per dataset and
+model instead of once per chain.
+
+The first chain of a run to claim the lock (chain_manifest.claim, with
+O_EXCL) runs m.find_starting_values() and writes the node values (m.values)
+to starting_values.pickle in the folder of the run (chain_manifest.run_dir),
+through a temporary file. The other chains wait for that file, then set the
+same values (m.set_values) and all chains add a small jitter of their own,
+so that they do not all start from the same point. A lock whose chain was
+killed (chain_manifest.stale) is removed, and the next chain to claim it
+finds the values instead. A jittered value that makes the model impossible
+(its log probability, plus that of its children, is -inf or cannot be
+computed) is put back.
+
+MIT License
+Copyright (c) Anne Urai, 2018
+anne.urai@gmail.com
+"""
+
+import os, time, pickle
+import numpy as np
+import chain_manifest
+
+def values_file(folder, run_id):
+    return os.path.join(chain_manifest.run_dir(folder, run_id), 'starting_values.pickle')
+
+def shared(folder, run_id, compute, poll=10, max_age=3600):
+
+    """
+    Node values of the model in folder, for the chains of run run_id: read
+    from disk if another chain has found them, computed with compute()
+    (which returns m.values) and saved if this chain gets the lock, and
+    otherwise waited for, polling every poll seconds. A lock of a chain that
+    is gone, or older than max_age seconds (about one m.find_starting_values()
+    of a large model), is removed; at worst, more than one chain then
+    computes the values.
+    """
+
+    path = chain_manifest.run_dir(folder, run_id)
+    filename = values_file(folder, run_id)
+    while not os.path.isfile(filename):
+        if chain_manifest.claim(path, 'starting_values'):
+            try:
+                values = compute()
+            except BaseException:
+                chain_manifest.release(path, 'starting_values') # let another chain try
+                raise
+            tmpname = '%s.%d.tmp'%(filename, os.getpid())
+            with open(tmpname, 'wb') as f:
+                pickle.dump(values, f, protocol=2)
+            os.rename(tmpname, filename)
+            return values
+        if chain_manifest.stale(path, 'starting_values', max_age):
+            print('removing the starting values lock of a chain that was killed')
+            chain_manifest.release(path, 'starting_values')
+            continue
+        time.sleep(poll)
+    with open(filename, 'rb') as f:
+        return pickle.load(f)
+
+def _logp(node):
+    # log probability of a node and of its stochastic children, -inf where that cannot be computed
+    try:
+        return np.sum(node.logp) + sum(np.sum(child.logp) for child in node.extended_children)
+    except Exception:
+        return -np.inf
+
+def jitter(m, scale=0.05, seed=None):
+
+    """
+    Add normal noise with sd scale to the value of every free node of m,
+    one node at a time, and put back the old value where the new one makes
+    the model impossible. Returns the names of the nodes that were put back.
+    """
+
+    rng = np.random.RandomState(seed)
+    reverted = []
+    for name, value in sorted(m.values.items()):
+        node = m.nodes_db.node[name]
+        m.set_values({name: value + scale * rng.standard_normal(np.shape(value))})
+        if not np.isfinite(_logp(node)):
+            m.set_values({name: value})
+            reverted.append(name)
+    return reverted